@@ -1,2 +1,4 @@
-from application.crawler.base import AbstractBaseCrawler
+from application.crawler.base import AbstractBaseCrawler, CrawlProgress
 from application.crawler.chefkoch_crawler import ChefkochCrawler
+from application.crawler.scrape_pool import ScrapePool
+from application.crawler.pipeline import CrawlPipeline
@@ -1,15 +1,44 @@
+import math
+import time
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import List, Generator, Callable, Any
+from typing import List, Generator, Callable, Any, Iterable, Tuple, Union, Dict, Set
+from uuid import UUID
 
+from application.crawler.known_urls import create_known_url_filter, BloomFilter
+from application.crawler.pipeline import CrawlPipeline
+from application.crawler.scrape_pool import ScrapePool
 from application.crawler.scrapers import RecipeOverviewItem
 from domain.model.category_aggregate import Category
 from domain.model.recipe_aggregate import Recipe
 from domain.model.vendor_aggregate import Vendor
 from domain.repositories.category import AbstractCategoryRepository
-from domain.repositories.recipe import AbstractRecipeRepository
+from domain.repositories.recipe import AbstractRecipeRepository, RecipeWriteCounts
 from domain.repositories.vendor import AbstractVendorRepository
-from infrastructure.fetch import FetchResult, AbstractFetcher
+from infrastructure.fetch import FetchResult, AbstractFetcher, URLQueue
+from infrastructure.metrics import MetricsRegistry
+
+
+@dataclass
+class CrawlProgress:
+    """Counters of a long running crawl, e.g. a backfill, that are reported while it runs."""
+    overview_pages: int = 0
+    recipes_found: int = 0
+    recipes_skipped: int = 0
+    recipes_crawled: int = 0
+    recipes_failed: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def recipes_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.recipes_crawled / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return dict(overview_pages=self.overview_pages, recipes_found=self.recipes_found, recipes_skipped=self.recipes_skipped,
+                    recipes_crawled=self.recipes_crawled, recipes_failed=self.recipes_failed,
+                    recipes_per_second=round(self.recipes_per_second, 2), elapsed=round(time.monotonic() - self.started))
 
 
 class AbstractBaseCrawler(ABC):
@@ -17,10 +46,44 @@ class AbstractBaseCrawler(ABC):
     def __init__(self, vendor: Vendor, fetcher: AbstractFetcher, create_logger: Callable,
                  recipe_repository: AbstractRecipeRepository = None,
                  category_repository: AbstractCategoryRepository = None,
-                 vendor_repository: AbstractVendorRepository = None):
+                 vendor_repository: AbstractVendorRepository = None,
+                 scrape_pool: ScrapePool = None,
+                 create_url_queue: Callable[[str], URLQueue] = None,
+                 known_urls_bloom_filter_threshold: int = 1_000_000,
+                 store_batch_size: int = 100,
+                 pipeline_queue_size: int = 100,
+                 pipeline_max_buffered_bytes: int = None,
+                 metrics: MetricsRegistry = None):
+        """create_url_queue creates the URL queue of a named crawl, e.g. a persistent queue that allows to resume an
+        interrupted crawl. It is only used by crawls that store their results. By default, every crawl gets an in-memory
+        URLQueue.
+
+        The URLs of the stored recipes are held in a set, or in a Bloom filter if the vendor has at least
+        known_urls_bloom_filter_threshold recipes.
+
+        Crawled recipes are stored in batches of store_batch_size recipes.
+
+        Pages are fetched, extracted and processed concurrently, at most pipeline_queue_size pages wait between two of
+        these stages and, with pipeline_max_buffered_bytes, at most that many bytes of page content are buffered.
+
+        The scrape and store times and the processed pages are recorded in the metrics, which are logged as a summary
+        when the crawler is closed. Pass the registry of the fetcher to get its metrics into the summary as well."""
         self.vendor = vendor
         self.logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+        self._create_logger = create_logger
         self._fetcher = fetcher
+        self._scrape_pool = scrape_pool if scrape_pool is not None else ScrapePool(workers=0)
+        self._create_url_queue = create_url_queue if create_url_queue is not None else lambda crawl: URLQueue()
+        self.known_urls_bloom_filter_threshold = known_urls_bloom_filter_threshold
+        self.store_batch_size = store_batch_size
+        self.pipeline_queue_size = pipeline_queue_size
+        self.pipeline_max_buffered_bytes = pipeline_max_buffered_bytes
+        self.recipe_write_counts = RecipeWriteCounts()
+        self._metrics = metrics if metrics is not None else MetricsRegistry()
+        self._pages_metric = self._metrics.counter('crawler_pages_total', 'Processed pages by vendor and result', ('vendor', 'result'))
+        self._scrape_metric = self._metrics.histogram('crawler_scrape_seconds', 'Time to scrape a page after its data was extracted', ('vendor',))
+        self._store_metric = self._metrics.histogram('crawler_store_seconds', 'Time to store a scrape result or a batch of them', ('vendor',))
+        self._recipe_writes_metric = self._metrics.counter('crawler_recipe_writes_total', 'Stored recipes by vendor and result', ('vendor', 'result'))
         self._recipe_repository = recipe_repository
         self._category_repository = category_repository
         self._vendor_repository = vendor_repository
@@ -33,34 +96,165 @@ class AbstractBaseCrawler(ABC):
     def crawl_new_recipes(self) -> List[Recipe]:
         raise NotImplementedError
 
-    def _crawl_urls(self, urls: List[str]) -> Generator[FetchResult, None, None]:
-        for page_batch in self._fetcher.fetch(urls):
+    def close(self):
+        """Closes the fetcher and with it every connection that was kept open during the crawl run, and the scrape pool,
+        and logs the summary of the metrics (since the start of the process)."""
+        self._fetcher.close()
+        self._scrape_pool.close()
+        self.logger.info('crawl metrics', vendor=self.vendor, **self._metrics.summary())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _crawl_urls(self, urls: Union[List[str], URLQueue]) -> Generator[FetchResult, None, None]:
+        """Fetches every URL once. Pass a URLQueue to add URLs that are discovered while the pages are processed."""
+        queue = urls if isinstance(urls, URLQueue) else URLQueue(urls)
+        for page_batch in self._fetcher.fetch(queue):
             for page in page_batch:
                 yield page
 
-    def _crawl_and_process(self, urls_to_crawl: List[str], scrape_callback: Callable[[FetchResult], Any],
-                           store_results: bool = False, store_callback: Callable = None):
-        results = list()
-        for crawled_page in self._crawl_urls(urls_to_crawl):
-            scrape_result = scrape_callback(crawled_page)
-            if store_results and store_callback is not None:
-                store_callback(scrape_result)
-            results.append(scrape_result)
-        return results
+    def _crawl_and_process(self, urls_to_crawl: Union[List[str], URLQueue], scrape_callback: Callable[..., Any],
+                           store_results: bool = False, store_callback: Callable = None,
+                           extract_callback: Callable[[bytes], Any] = None, store_batch_size: int = None) -> List[Any]:
+        """Fetches, scrapes and optionally stores the passed urls and returns the scrape results.
+
+        Without an extract_callback, the scrape_callback is called with every fetched page. With an extract_callback, the
+        extract_callback is applied to the raw content of every page in the scrape pool first and the scrape_callback is
+        called with the page and the extracted data. URLs that the callbacks add to a passed URLQueue are crawled and
+        processed in the same run. Every page is acknowledged to the queue once it was processed (and stored).
+
+        With a store_batch_size, the store_callback is called with lists of up to store_batch_size scrape results instead
+        of every single result, and the pages of a batch are acknowledged once the batch was stored.
+        """
+        return list(self._iter_crawl_and_process(urls_to_crawl, scrape_callback, store_results=store_results, store_callback=store_callback,
+                                                 extract_callback=extract_callback, store_batch_size=store_batch_size))
+
+    def _iter_crawl_and_process(self, urls_to_crawl: Union[List[str], URLQueue], scrape_callback: Callable[..., Any],
+                                store_results: bool = False, store_callback: Callable = None,
+                                extract_callback: Callable[[bytes], Any] = None, store_batch_size: int = None) -> Generator[Any, None, None]:
+        """Same as _crawl_and_process, but yields every scrape result as soon as it was processed (and stored), so the
+        results of large crawls don't have to be held in memory. The parsed document and the content of every page are
+        released right after the page was scraped."""
+        queue = urls_to_crawl if isinstance(urls_to_crawl, URLQueue) else URLQueue(urls_to_crawl)
+        store = store_results and store_callback is not None
+        unstored: List[Tuple[str, Any]] = list()
+        store_callback = self._measure_store_callback(store_callback) if store else store_callback
+        pipeline = CrawlPipeline(fetch=self._crawl_urls, create_logger=self._create_logger, scrape_pool=self._scrape_pool,
+                                 queue_size=self.pipeline_queue_size, max_buffered_bytes=self.pipeline_max_buffered_bytes,
+                                 name=self.vendor.name, metrics=self._metrics)
+        try:
+            for crawled_page, extracted in pipeline.run(queue, extract=extract_callback):
+                if not crawled_page.ok:
+                    self.logger.warning('skipped page that could not be fetched or extracted', url=crawled_page.url, status=crawled_page.status,
+                                        outcome=crawled_page.outcome.value, error=crawled_page.error, attempts=crawled_page.attempts)
+                    queue.mark_failed(crawled_page.url, error=crawled_page.error or crawled_page.outcome.value)
+                    self._pages_metric.inc(vendor=self.vendor.name, result='failed')
+                    continue
+                with self._scrape_metric.time(vendor=self.vendor.name):
+                    scrape_result = scrape_callback(crawled_page) if extract_callback is None else scrape_callback(crawled_page, extracted)
+                crawled_page.release(content=True)
+                self._pages_metric.inc(vendor=self.vendor.name, result='scraped')
+                if store and store_batch_size:
+                    unstored.append((crawled_page.url, scrape_result))
+                    if len(unstored) >= store_batch_size:
+                        yield from self._store_batch(queue, unstored, store_callback)
+                    continue
+                if store:
+                    store_callback(scrape_result)
+                queue.mark_done(crawled_page.url)
+                yield scrape_result
+            yield from self._store_batch(queue, unstored, store_callback)
+        finally:
+            queue.checkpoint()
+        queue.complete()
+
+    @staticmethod
+    def _store_batch(queue: URLQueue, unstored: List[Tuple[str, Any]], store_callback: Callable[[List[Any]], None]) -> Generator[Any, None, None]:
+        """Stores the batch of (url, scrape result) pairs, acknowledges their pages and yields the results. Empties unstored."""
+        if not unstored:
+            return
+        batch = unstored.copy()
+        unstored.clear()
+        store_callback([scrape_result for _, scrape_result in batch])
+        for url, scrape_result in batch:
+            queue.mark_done(url)
+        for url, scrape_result in batch:
+            yield scrape_result
+
+    def _measure_store_callback(self, store_callback: Callable) -> Callable:
+        def measured_store_callback(value: Any):
+            with self._store_metric.time(vendor=self.vendor.name):
+                store_callback(value)
+
+        return measured_store_callback
+
+    def _add_recipe_write_counts(self, counts: RecipeWriteCounts):
+        self.recipe_write_counts += counts
+        for result, count in counts.as_dict().items():
+            self._recipe_writes_metric.inc(count, vendor=self.vendor.name, result=result)
 
     def _crawl_categories_if_needed(self):
         already_stored_categories = self._category_repository.get_all_categories_for_vendor(self.vendor)
         if len(already_stored_categories) == 0:
             self.crawl_categories(store_categories=True)
 
+    def _filter_known_recipes(self, recipe_overviews: List[RecipeOverviewItem]) -> List[RecipeOverviewItem]:
+        """Drops the recipes that are already stored, before their pages are fetched."""
+        known_urls = self._load_known_recipe_urls()
+        unknown_recipe_overviews = [recipe_overview for recipe_overview in recipe_overviews if recipe_overview.url not in known_urls]
+        self.logger.info('filtered known recipes', vendor=self.vendor, known=len(recipe_overviews) - len(unknown_recipe_overviews),
+                         unknown=len(unknown_recipe_overviews))
+        return unknown_recipe_overviews
+
+    def _load_known_recipe_urls(self, headroom: float = 0) -> Union[Set[str], BloomFilter]:
+        """headroom is the share of the stored URLs that may still be added, e.g. 1.0 sizes a Bloom filter for twice the
+        stored URLs, so its false positive rate stays bounded while the crawl adds the URLs it found."""
+        if self._recipe_repository is None:
+            return set()
+        count = self._recipe_repository.count_by_vendor(self.vendor)
+        known_urls = create_known_url_filter(
+            self._recipe_repository.get_urls_by_vendor(self.vendor),
+            count=count + math.ceil(count * headroom),
+            bloom_filter_threshold=self.known_urls_bloom_filter_threshold,
+        )
+        self.logger.info('loaded known recipe urls', vendor=self.vendor, count=len(known_urls), structure=known_urls.__class__.__name__)
+        return known_urls
+
+    def _get_crawl_watermarks(self) -> Dict[UUID, datetime]:
+        """Returns the publish day up to which the recipes of every category of the vendor are completely crawled.
+
+        Categories without a stored watermark start at the day before the last crawl of the vendor, but at the latest at
+        the day before yesterday, so a first crawl covers at least yesterday.
+        """
+        stored_watermarks = self._vendor_repository.get_crawl_watermarks(self.vendor) if self._vendor_repository is not None else dict()
+        default_watermark = self._get_start_of_day(datetime.now()) - timedelta(days=2)
+        if self.vendor.date_last_crawled is not None:
+            default_watermark = min(default_watermark, self._get_start_of_day(self.vendor.date_last_crawled) - timedelta(days=1))
+        return {category.id: stored_watermarks.get(category.id, default_watermark) for category in self.vendor.categories}
+
+    def _advance_crawl_watermarks(self, categories: Iterable[Category]):
+        """Marks the recipes of the categories as completely crawled up to yesterday, today isn't over yet."""
+        if self._vendor_repository is None:
+            return
+        watermark = self._get_start_of_day(datetime.now()) - timedelta(days=1)
+        watermarks = {category.id: watermark for category in categories}
+        self._vendor_repository.advance_crawl_watermarks(self.vendor, watermarks, date_last_crawled=datetime.now())
+        self.logger.info('advanced crawl watermarks', vendor=self.vendor, watermark=watermark.date().isoformat(), categories=len(watermarks))
+
+    @staticmethod
+    def _filter_new_recipes(recipe_overviews: List[RecipeOverviewItem], watermarks: Dict[UUID, datetime]) -> List[RecipeOverviewItem]:
+        """Keeps the recipes that were published after the watermark of their category and before today."""
+        today = AbstractBaseCrawler._get_start_of_day(datetime.now())
+
+        def is_new_recipe(recipe_overview: RecipeOverviewItem) -> bool:
+            recipe_publish_day = AbstractBaseCrawler._get_start_of_day(recipe_overview.published)
+            return watermarks[recipe_overview.category.id] < recipe_publish_day < today
+
+        return list(filter(is_new_recipe, recipe_overviews))
+
     @staticmethod
-    def _filter_new_recipes(recipe_overviews: List[RecipeOverviewItem]) -> List[RecipeOverviewItem]:
-        def filter_recipes_from_previous_day(recipe_overview: RecipeOverviewItem) -> bool:
-            current_datetime = datetime.now()
-            previous_day = datetime(year=current_datetime.year, month=current_datetime.month,
-                                    day=current_datetime.day) - timedelta(days=1)
-            recipe_publish_day = datetime(year=recipe_overview.published.year, month=recipe_overview.published.month,
-                                          day=recipe_overview.published.day)
-            return recipe_publish_day == previous_day
-
-        return list(filter(filter_recipes_from_previous_day, recipe_overviews))
+    def _get_start_of_day(value: datetime) -> datetime:
+        return datetime(year=value.year, month=value.month, day=value.day)
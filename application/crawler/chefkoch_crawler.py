@@ -1,38 +1,54 @@
 from __future__ import annotations
 
 from itertools import chain
-from typing import List, Callable
+from datetime import datetime
+from typing import List, Callable, Optional, Dict, Tuple, Set, Union, Generator
+from uuid import UUID
 
 from more_itertools import one
 
-from application.crawler.base import AbstractBaseCrawler
-from application.crawler.scrapers import ChefkochScraper, RecipeOverviewItem
+from application.crawler.base import AbstractBaseCrawler, CrawlProgress
+from application.crawler.known_urls import BloomFilter
+from application.crawler.scrape_pool import ScrapePool
+from application.crawler.scrapers import ChefkochScraper, RecipeOverviewItem, RecipeOverviewEntry
 from domain.model.category_aggregate import Category
 from domain.model.recipe_aggregate import Recipe
 from domain.model.vendor_aggregate import Vendor
 from domain.repositories.category import AbstractCategoryRepository
-from domain.repositories.recipe import AbstractRecipeRepository
+from domain.repositories.recipe import AbstractRecipeRepository, RecipeWriteCounts
 from domain.repositories.vendor import AbstractVendorRepository
-from infrastructure.fetch import AbstractFetcher
+from infrastructure.fetch import AbstractFetcher, FetchResult, URLQueue, SharedURLQueue
+from infrastructure.metrics import MetricsRegistry
 
 
 class ChefkochCrawler(AbstractBaseCrawler):
+    overview_page_size = 30
+    backfill_known_urls_headroom = 1.0  # the known URLs filter of a backfill holds up to twice the stored recipes
 
     def __init__(self, vendor: Vendor, fetcher: AbstractFetcher, create_logger: Callable,
                  recipe_repository: AbstractRecipeRepository = None,
                  category_repository: AbstractCategoryRepository = None,
-                 vendor_repository: AbstractVendorRepository = None):
+                 vendor_repository: AbstractVendorRepository = None,
+                 scrape_pool: ScrapePool = None, create_url_queue: Callable[[str], URLQueue] = None,
+                 known_urls_bloom_filter_threshold: int = 1_000_000, store_batch_size: int = 100, pipeline_queue_size: int = 100,
+                 pipeline_max_buffered_bytes: int = None, metrics: MetricsRegistry = None, max_overview_pages: int = 100):
         super().__init__(
             vendor=vendor, fetcher=fetcher, create_logger=create_logger, recipe_repository=recipe_repository,
-            category_repository=category_repository, vendor_repository=vendor_repository
+            category_repository=category_repository, vendor_repository=vendor_repository, scrape_pool=scrape_pool,
+            create_url_queue=create_url_queue, known_urls_bloom_filter_threshold=known_urls_bloom_filter_threshold,
+            store_batch_size=store_batch_size, pipeline_queue_size=pipeline_queue_size,
+            pipeline_max_buffered_bytes=pipeline_max_buffered_bytes, metrics=metrics,
         )
         self.scraper = ChefkochScraper(vendor=vendor)
+        self.max_overview_pages = max_overview_pages
 
     def crawl_categories(self, store_categories: bool = False) -> List[Category]:
         self.logger.info('start crawling categories', vendor=self.vendor, store_categories=store_categories)
         result = one(self._crawl_and_process(
             urls_to_crawl=[self.vendor.categories_link],
-            scrape_callback=lambda categories_page: self.scraper.scrape_categories(soup=categories_page.html),
+            scrape_callback=lambda categories_page: self.scraper.scrape_categories(
+                soup=categories_page.parse(parse_only=self.scraper.categories_parse_only),
+            ),
             store_results=store_categories,
             store_callback=self._store_categories,
         ))
@@ -40,37 +56,233 @@ class ChefkochCrawler(AbstractBaseCrawler):
         return result
 
     def crawl_new_recipes(self, store_recipes: bool = True) -> List[Recipe]:
+        return list(self.iter_new_recipes(store_recipes=store_recipes))
+
+    def iter_new_recipes(self, store_recipes: bool = True) -> Generator[Recipe, None, None]:
+        """Same as crawl_new_recipes, but yields every recipe as soon as it was crawled (and stored), so the crawled
+        recipes are never held in memory together. The crawl watermarks are only advanced once every recipe was yielded,
+        and only for the categories whose recipe pages were all crawled."""
         self._crawl_categories_if_needed()
         self.logger.info('start crawling new recipes', vendor=self.vendor, store_recipes=store_recipes)
+        self.recipe_write_counts = RecipeWriteCounts()
+
+        watermarks = self._get_crawl_watermarks()
+        all_recipe_overview_items, completed_categories = self._get_recipe_overview_items(watermarks)
+        recent_recipe_overview_items = self._filter_known_recipes(self._filter_new_recipes(all_recipe_overview_items, watermarks))
+        overview_items_by_url = {overview_item.url: overview_item for overview_item in recent_recipe_overview_items}
+
+        # a dry run must not acknowledge URLs in the frontier of the real crawl, they would never be stored
+        recipe_urls = self._create_url_queue(f'{self.vendor.name}.new_recipes') if store_recipes else URLQueue()
+        recipe_urls.add(list(overview_items_by_url))
+        pending_urls = set(recipe_urls.urls)
+        scraped_urls: Set[str] = set()
+
+        def scrape_recipe(recipe_page: FetchResult, structured_data: Optional[dict]) -> Optional[Recipe]:
+            scraped_urls.add(recipe_page.url)
+            return self._build_recipe(recipe_page, structured_data, overview_items_by_url.get(recipe_page.url))
+
+        recipes = self._iter_crawl_and_process(
+            urls_to_crawl=recipe_urls,
+            extract_callback=self.scraper.extract_recipe,
+            scrape_callback=scrape_recipe,
+            store_results=store_recipes,
+            store_callback=self._store_recipes,
+            store_batch_size=self.store_batch_size,
+        )
+        crawled = 0
+        for recipe in recipes:
+            if recipe is None:  # a skipped page
+                continue
+            crawled += 1
+            yield recipe
 
-        all_recipe_overview_items = self._get_recipe_overview_items()
-        recent_recipe_overview_items = set(self._filter_new_recipes(all_recipe_overview_items))
+        if store_recipes:
+            # a failed recipe page stays pending in the frontier, the next run needs its overview item to resume it
+            failed_category_ids = {overview_items_by_url[url].category.id for url in pending_urls - scraped_urls if url in overview_items_by_url}
+            self._advance_crawl_watermarks([category for category in completed_categories if category.id not in failed_category_ids])
+        self.logger.info(f'crawled {crawled} new recipes', vendor=self.vendor, store_recipes=store_recipes, **self.recipe_write_counts.as_dict())
 
-        result = self._crawl_and_process(
-            urls_to_crawl=[overview_item.url for overview_item in recent_recipe_overview_items],
-            scrape_callback=lambda recipe_page: self.scraper.scrape_recipe(
-                soup=recipe_page.html, url=recipe_page.url,
-                category=list(
-                    filter(lambda item: item.url == recipe_page.url, recent_recipe_overview_items)
-                )[0].category
+    def enqueue_new_recipes(self, queue: SharedURLQueue) -> int:
+        """Crawls the recipe overviews and adds the new recipes to the shared queue, with the URL of their category as
+        context. The recipes themselves are crawled by the workers with crawl_queued_recipes."""
+        self._crawl_categories_if_needed()
+        watermarks = self._get_crawl_watermarks()
+        all_recipe_overview_items, completed_categories = self._get_recipe_overview_items(watermarks)
+        recent_recipe_overview_items = self._filter_known_recipes(self._filter_new_recipes(all_recipe_overview_items, watermarks))
+
+        recipe_urls_by_category: Dict[str, List[str]] = dict()
+        for overview_item in recent_recipe_overview_items:
+            recipe_urls_by_category.setdefault(overview_item.category.url.value, list()).append(overview_item.url)
+        for category_url, recipe_urls in recipe_urls_by_category.items():
+            queue.add(recipe_urls, context=category_url)
+        self._advance_crawl_watermarks(completed_categories)
+
+        self.logger.info(f'enqueued {len(recent_recipe_overview_items)} new recipes', vendor=self.vendor, crawl=queue.crawl)
+        return len(recent_recipe_overview_items)
+
+    def crawl_queued_recipes(self, queue: SharedURLQueue, store_recipes: bool = True) -> List[Recipe]:
+        """Crawls the recipes that this worker claims from the shared queue until no recipe is left to claim."""
+        return list(self.iter_queued_recipes(queue, store_recipes=store_recipes))
+
+    def iter_queued_recipes(self, queue: SharedURLQueue, store_recipes: bool = True) -> Generator[Recipe, None, None]:
+        """Same as crawl_queued_recipes, but yields every recipe as soon as it was crawled (and stored)."""
+        self.logger.info('start crawling queued recipes', vendor=self.vendor, crawl=queue.crawl, worker=queue.worker)
+        self.recipe_write_counts = RecipeWriteCounts()
+        categories = {category.url.value: category for category in self.vendor.categories}
+
+        recipes = self._iter_crawl_and_process(
+            urls_to_crawl=queue,
+            extract_callback=self.scraper.extract_recipe,
+            scrape_callback=lambda recipe_page, structured_data: self._build_queued_recipe(
+                recipe_page, structured_data, categories.get(queue.get_context(recipe_page.url)),
             ),
             store_results=store_recipes,
-            store_callback=self._store_recipe,
+            store_callback=self._store_recipes,
+            store_batch_size=self.store_batch_size,
         )
+        crawled = 0
+        for recipe in recipes:
+            if recipe is None:  # a skipped page
+                continue
+            crawled += 1
+            yield recipe
 
-        self.logger.info(f'crawled {len(result)} new recipes', vendor=self.vendor, store_recipes=store_recipes)
-        return result
+        self.logger.info(f'crawled {crawled} queued recipes', vendor=self.vendor, crawl=queue.crawl, worker=queue.worker,
+                         **self.recipe_write_counts.as_dict())
+
+    def backfill_recipes(self, published_from: datetime = None, published_until: datetime = None, store_recipes: bool = True,
+                         max_overview_pages: int = None, progress_interval: int = 1000) -> CrawlProgress:
+        """Crawls the back catalog: every recipe that was published in [published_from, published_until) and isn't stored yet.
 
-    def _get_recipe_overview_items(self) -> List[RecipeOverviewItem]:
-        recipe_overview_urls = [self._get_date_sorted_url(category.url.value) for category in self.vendor.categories]
-        return list(chain(*self._crawl_and_process(
-            urls_to_crawl=recipe_overview_urls,
-            scrape_callback=lambda overview_page: self.scraper.scrape_recipe_overview(
-                soup=overview_page.html,
-                category=one(filter(lambda category: self._get_date_sorted_url(category.url.value) == overview_page.url,
-                                    self.vendor.categories)),
+        The date sorted overview pages of all categories are walked in rounds, round n fetches page n of every category
+        whose previous page still had recipes published on or after published_from (all of them, without a max_overview_pages
+        limit). After every round the recipes that were found on its pages are crawled and streamed into storage, so only
+        one round of overview items is held in memory and the recipes themselves are never collected.
+
+        Recipes that are already stored, or were already crawled in this run from another category, are skipped. An
+        interrupted backfill is resumed by running it again, it walks the overview pages again but skips the recipes that
+        it already stored. Concurrency and rate limits are the ones of the fetcher.
+        """
+        self._crawl_categories_if_needed()
+        self.logger.info('start backfilling recipes', vendor=self.vendor, published_from=published_from, published_until=published_until,
+                         store_recipes=store_recipes)
+
+        known_urls = self._load_known_recipe_urls(headroom=self.backfill_known_urls_headroom)
+        progress = CrawlProgress()
+        self.recipe_write_counts = RecipeWriteCounts()
+        categories = list(self.vendor.categories)
+        page = 0
+        while categories and (max_overview_pages is None or page < max_overview_pages):
+            recipe_categories, categories = self._get_backfill_recipe_urls(categories, page, published_from, published_until, known_urls, progress)
+            self._crawl_backfill_recipes(recipe_categories, store_recipes, progress, progress_interval)
+            page += 1
+            self.logger.info('backfilled recipe overview page', vendor=self.vendor, page=page, remaining_categories=len(categories), **progress.as_dict())
+
+        self.logger.info(f'backfilled {progress.recipes_crawled} recipes', vendor=self.vendor, store_recipes=store_recipes, **progress.as_dict(),
+                         **self.recipe_write_counts.as_dict())
+        return progress
+
+    def _get_backfill_recipe_urls(self, categories: List[Category], page: int, published_from: Optional[datetime],
+                                  published_until: Optional[datetime], known_urls: Union[Set[str], BloomFilter],
+                                  progress: CrawlProgress) -> Tuple[Dict[str, Category], List[Category]]:
+        """Crawls the overview page of every category and returns the unknown recipe URLs (with their category) that
+        were published in the date range, and the categories that have to be paginated further."""
+        overview_pages = {self._get_date_sorted_url(category.url.value, page=page): category for category in categories}
+        recipe_categories: Dict[str, Category] = dict()
+        next_categories: List[Category] = list()
+
+        def scrape_overview_page(overview_page: FetchResult, overview_entries: List[RecipeOverviewEntry]):
+            category = overview_pages[overview_page.url]
+            overview_items = self.scraper.build_recipe_overview(entries=overview_entries, category=category)
+            progress.overview_pages += 1
+            has_next_page = self._get_date_sorted_url(category.url.value, page=page + 1) != overview_page.url
+            if has_next_page and overview_items and (published_from is None or min(item.published for item in overview_items) >= published_from):
+                next_categories.append(category)
+            for item in overview_items:
+                if (published_from is not None and item.published < published_from) or (published_until is not None and item.published >= published_until):
+                    continue
+                progress.recipes_found += 1
+                if item.url in known_urls:
+                    progress.recipes_skipped += 1
+                    continue
+                known_urls.add(item.url)
+                recipe_categories[item.url] = category
+
+        for _ in self._iter_crawl_and_process(urls_to_crawl=list(overview_pages), extract_callback=self.scraper.extract_recipe_overview,
+                                              scrape_callback=scrape_overview_page):
+            pass
+        return recipe_categories, next_categories
+
+    def _crawl_backfill_recipes(self, recipe_categories: Dict[str, Category], store_recipes: bool, progress: CrawlProgress,
+                                progress_interval: int):
+        recipes = self._iter_crawl_and_process(
+            urls_to_crawl=list(recipe_categories),
+            extract_callback=self.scraper.extract_recipe,
+            scrape_callback=lambda recipe_page, structured_data: self.scraper.build_recipe(
+                structured_data=structured_data, url=recipe_page.url, category=recipe_categories[recipe_page.url],
             ),
+            store_results=store_recipes,
+            store_callback=self._store_recipes,
+            store_batch_size=self.store_batch_size,
+        )
+        crawled = 0
+        for recipe in recipes:
+            crawled += 1
+            if recipe is None:
+                progress.recipes_failed += 1
+                continue
+            progress.recipes_crawled += 1
+            if progress.recipes_crawled % progress_interval == 0:
+                self.logger.info('backfill progress', vendor=self.vendor, **progress.as_dict())
+        progress.recipes_failed += len(recipe_categories) - crawled  # pages that could not be fetched
+
+    def _get_recipe_overview_items(self, watermarks: Dict[UUID, datetime]) -> Tuple[List[RecipeOverviewItem], List[Category]]:
+        """Crawls the date sorted recipe overview pages of every category, page by page until a page reaches the recipes
+        that were published on or before the watermark of the category.
+
+        Returns the overview items and the categories whose overview pages were crawled down to their watermark. Only
+        for those the watermark may be advanced, the others had overview pages that could not be fetched or more than
+        max_overview_pages new pages.
+        """
+        overview_pages: Dict[str, Tuple[Category, int]] = {
+            self._get_date_sorted_url(category.url.value): (category, 0) for category in self.vendor.categories
+        }
+        overview_urls = URLQueue(list(overview_pages))
+        completed_categories: List[Category] = list()
+
+        def scrape_overview_page(overview_page: FetchResult, overview_entries: List[RecipeOverviewEntry]) -> List[RecipeOverviewItem]:
+            category, page = overview_pages[overview_page.url]
+            overview_items = self.scraper.build_recipe_overview(entries=overview_entries, category=category)
+            if len(overview_items) == 0 or min(item.published for item in overview_items) <= watermarks[category.id]:
+                completed_categories.append(category)
+            elif page + 1 < self.max_overview_pages:
+                next_page_url = self._get_date_sorted_url(category.url.value, page=page + 1)
+                overview_pages[next_page_url] = (category, page + 1)
+                overview_urls.add(next_page_url)
+            else:
+                self.logger.warning('stopped paginating recipe overview', category=category.name, pages=page + 1)
+            return overview_items
+
+        recipe_overview_items = list(chain(*self._crawl_and_process(
+            urls_to_crawl=overview_urls,
+            extract_callback=self.scraper.extract_recipe_overview,
+            scrape_callback=scrape_overview_page,
         )))
+        self.logger.info(f'crawled {len(overview_pages)} recipe overview pages', vendor=self.vendor, items=len(recipe_overview_items),
+                         completed_categories=len(completed_categories))
+        return recipe_overview_items, completed_categories
+
+    def _build_recipe(self, recipe_page: FetchResult, structured_data: Optional[dict], overview_item: Optional[RecipeOverviewItem]) -> Optional[Recipe]:
+        if overview_item is None:  # resumed from an interrupted crawl whose overview items are no longer recent
+            self.logger.warning('skipped recipe without overview item', url=recipe_page.url)
+            return None
+        return self.scraper.build_recipe(structured_data=structured_data, url=recipe_page.url, category=overview_item.category)
+
+    def _build_queued_recipe(self, recipe_page: FetchResult, structured_data: Optional[dict], category: Optional[Category]) -> Optional[Recipe]:
+        if category is None:
+            self.logger.warning('skipped queued recipe of unknown category', url=recipe_page.url)
+            return None
+        return self.scraper.build_recipe(structured_data=structured_data, url=recipe_page.url, category=category)
 
     def _store_categories(self, categories: List[Category]):
         if self._category_repository is None:
@@ -79,17 +291,18 @@ class ChefkochCrawler(AbstractBaseCrawler):
             self._category_repository.add(category)
             self.vendor.add_category(category)
 
-    def _store_recipe(self, recipe: Recipe):
+    def _store_recipes(self, recipes: List[Optional[Recipe]]):
         if self._recipe_repository is None:
             raise ValueError('you must specify the recipe repository to store the crawled recipes')
-        self._recipe_repository.add(recipe)
+        self._add_recipe_write_counts(self._recipe_repository.add_many([recipe for recipe in recipes if recipe is not None]))
 
-    @staticmethod
-    def _get_date_sorted_url(recipe_url: str) -> str:
+    @classmethod
+    def _get_date_sorted_url(cls, recipe_url: str, page: int = 0) -> str:
+        """Returns the URL of the page of the recipe overview that is sorted by publish date, newest first."""
         url_parts = recipe_url.split('/')
 
         for index, part in enumerate(url_parts):
             if part.startswith('s0'):
-                url_parts[index] = f'{part[:2]}o3{part[2:]}'
+                url_parts[index] = f's{page * cls.overview_page_size}o3{part[2:]}'
 
         return "/".join(url_parts)
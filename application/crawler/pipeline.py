@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, BrokenExecutor
+from functools import partial
+from typing import Callable, Iterable, Generator, Tuple, Any, Optional, List, Deque
+
+from application.crawler.scrape_pool import ScrapePool
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import FetchResult, FetchOutcome, URLQueue
+from infrastructure.metrics import MetricsRegistry
+
+
+class StageStats:
+    """Throughput of one pipeline stage. A stage is busy while it works on items, blocked while it waits for a full
+    output queue (backpressure) and idle while it waits for input."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.idle = 0.0
+
+    def as_dict(self, elapsed: float) -> dict:
+        return dict(items=self.items, items_per_second=round(self.items / elapsed, 2) if elapsed > 0 else 0.0,
+                    busy=round(self.busy, 2), blocked=round(self.blocked, 2), idle=round(self.idle, 2))
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(name={self.name!r}, items={self.items})'
+
+
+class CrawlPipeline:
+    """Runs the fetch, extract and process stages of a crawl concurrently, connected by bounded queues.
+
+    The fetch stage runs in its own thread and keeps the fetcher's requests in flight while the other stages work. The
+    extract stage runs in a second thread and applies the extract function to the raw page content, in the processes
+    of the scrape pool if it has workers. The process stage (scraping the extracted data and storing the results) runs
+    in the thread that consumes run. A full queue blocks the stage before it, so at most queue_size pages wait between
+    two stages.
+
+    With max_buffered_bytes, the fetch stage waits before it passes on a page while the content of the pages that were
+    fetched but not processed yet would exceed max_buffered_bytes, so the memory of the pages in the pipeline is bounded
+    no matter how large they are. A single page that is larger than the limit is still passed on.
+
+    The depths of the URL queue and of the queues between the stages, the time the extract function takes per page and
+    the busy, blocked and idle time of every stage are recorded in the metrics, labelled with the name of the pipeline.
+
+    The URL queue and the database session are only used under the lock of the pipeline: the process stage holds it
+    while the consumer processes a page, the fetch stage only takes it to take over the next chunk of URLs from the URL
+    queue, and only waits for it if it has no URLs left to fetch. The pages in flight are counted under a separate
+    condition, so passing on a fetched page never waits for a page that is being processed (or stored).
+
+    The fetch stage has the concurrency of the fetcher and the extract stage the workers of the scrape pool. The process
+    stage runs in a single thread, because the database session isn't thread-safe, its writes are batched by the
+    consumer instead.
+    """
+
+    def __init__(self, fetch: Callable[[URLQueue], Iterable[FetchResult]], create_logger: Callable, scrape_pool: ScrapePool = None,
+                 queue_size: int = 100, fetch_chunk_size: int = 20, max_buffered_bytes: int = None, name: str = 'crawl',
+                 metrics: MetricsRegistry = None):
+        if queue_size < 1:
+            raise InvalidValueException(self, 'queue_size must be at least 1')
+        if fetch_chunk_size < 1:
+            raise InvalidValueException(self, 'fetch_chunk_size must be at least 1')
+        if max_buffered_bytes is not None and max_buffered_bytes < 1:
+            raise InvalidValueException(self, 'max_buffered_bytes must be at least 1')
+        self.queue_size = queue_size
+        self.fetch_chunk_size = fetch_chunk_size
+        self.max_buffered_bytes = max_buffered_bytes
+        self.name = name
+        self.stats: List[StageStats] = list()
+        self._fetch = fetch
+        self._scrape_pool = scrape_pool if scrape_pool is not None else ScrapePool(workers=0)
+        self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self._queue_depth_metric = metrics.gauge('crawler_pipeline_queue_depth', 'Items waiting in the queues of a crawl pipeline', ('pipeline', 'queue'))
+        self._extract_metric = metrics.histogram('crawler_extract_seconds', 'Time to extract the data of a page (parsing included)', ('pipeline',))
+        self._stage_metric = metrics.counter('crawler_pipeline_stage_seconds_total', 'Time the stages of a crawl pipeline were busy, blocked or idle',
+                                             ('pipeline', 'stage', 'state'))
+
+    def run(self, urls: URLQueue, extract: Callable[[bytes], Any] = None) -> Generator[Tuple[FetchResult, Any], None, None]:
+        """Fetches the urls and yields (page, extracted data) pairs, with None as data for pages that could not be
+        fetched or without an extract function. A page whose extraction raised is yielded as a failed page (with the
+        error outcome) and None as data, so one broken page doesn't end the run. URLs that are added to the queue while the pairs are processed are
+        crawled in the same run. The next page is only yielded when the consumer is done with the previous one."""
+        run = _PipelineRun(self, urls, extract)
+        yield from run.start()
+        self.stats = run.stats
+        for stats in run.stats:
+            for state in ('busy', 'blocked', 'idle'):
+                self._stage_metric.inc(getattr(stats, state), pipeline=self.name, stage=stats.name, state=state)
+        self._logger.info('finished crawl pipeline', pipeline=self.name, elapsed=round(run.elapsed, 2),
+                          **{stats.name: stats.as_dict(run.elapsed) for stats in run.stats})
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(name={self.name!r}, queue_size={self.queue_size}, fetch_chunk_size={self.fetch_chunk_size}, ' \
+               f'max_buffered_bytes={self.max_buffered_bytes}, scrape_pool={self._scrape_pool!r})'
+
+
+def _extract_timed(extract: Callable[[bytes], Any], content: bytes) -> Tuple[Any, float]:
+    """Runs in the worker processes of the scrape pool, so the measured time doesn't include waiting for a worker."""
+    started = time.monotonic()
+    return extract(content), time.monotonic() - started
+
+
+class _StageError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+_END = object()
+
+
+class _FetchBuffer(URLQueue):
+    """The URLs that the fetch stage took over from the URL queue of the crawl. Whenever fewer than chunk_size URLs are
+    left, the next URLs are taken over. The buffer never waits for the lock while it has URLs left and only briefly
+    if it is empty, so the requests in flight are not held up while the lock is held by the process stage."""
+
+    lock_timeout = 0.05
+
+    def __init__(self, source: URLQueue, lock: threading.Lock, chunk_size: int, on_refill: Callable[[int], None] = None):
+        super().__init__(deduplicate=False)
+        self.used = False
+        self._source = source
+        self._lock = lock
+        self._chunk_size = chunk_size
+        self._on_refill = on_refill
+
+    def is_empty(self):
+        self.used = True
+        if len(self) < self._chunk_size and self._acquire_lock():
+            try:
+                while len(self) < self._chunk_size and not self._source.is_empty():
+                    self._add_url(next(self._source), priority=0)
+                if self._on_refill is not None:
+                    self._on_refill(len(self._source))
+            finally:
+                self._lock.release()
+        return len(self) == 0
+
+    def _acquire_lock(self) -> bool:
+        if len(self) > 0:
+            return self._lock.acquire(blocking=False)
+        return self._lock.acquire(timeout=self.lock_timeout)
+
+
+class _PipelineRun:
+
+    def __init__(self, pipeline: CrawlPipeline, urls: URLQueue, extract: Optional[Callable[[bytes], Any]]):
+        self.stats = [StageStats('fetch'), StageStats('extract'), StageStats('process')]
+        self.elapsed = 0.0
+        self._pipeline = pipeline
+        self._urls = urls
+        self._extract = extract
+        self._lock = threading.Lock()  # of the URL queue and the database session
+        self._stopped = threading.Event()
+        self._buffered = threading.Condition()  # of the unfinished pages and their content
+        self._unfinished = 0  # pages that were fetched, but not processed yet
+        self._buffered_bytes = 0  # content of the unfinished pages
+        self._fetched: queue.Queue = queue.Queue(maxsize=pipeline.queue_size)
+        self._extracted: queue.Queue = queue.Queue(maxsize=pipeline.queue_size)
+
+    def start(self) -> Generator[Tuple[FetchResult, Any], None, None]:
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._fetch_stage, self._fetched), name='crawl-pipeline-fetch', daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._extract_stage, self._extracted), name='crawl-pipeline-extract', daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            yield from self._process_stage()
+        finally:
+            self._stopped.set()
+            with self._buffered:
+                self._buffered.notify_all()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.monotonic() - started
+
+    def _process_stage(self) -> Generator[Tuple[FetchResult, Any], None, None]:
+        stats = self.stats[2]
+        while True:
+            item = self._get(self._extracted, stats)
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.exception
+            started = time.monotonic()
+            try:
+                with self._lock:
+                    yield item
+            finally:
+                with self._buffered:
+                    self._unfinished -= 1
+                    self._buffered_bytes -= len(item[0].content)
+                    self._buffered.notify_all()
+                stats.items += 1
+                stats.busy += time.monotonic() - started
+
+    def _fetch_stage(self):
+        stats = self.stats[0]
+        while True:
+            buffer = _FetchBuffer(self._urls, self._lock, chunk_size=self._pipeline.fetch_chunk_size,
+                                  on_refill=lambda depth: self._pipeline._queue_depth_metric.set(depth, pipeline=self._pipeline.name, queue='urls'))
+            pages = iter(self._pipeline._fetch(buffer))
+            started = time.monotonic()
+            try:
+                for page in pages:
+                    stats.busy += time.monotonic() - started
+                    self._buffer(page, stats)
+                    stats.items += 1
+                    self._put(self._fetched, page, stats)
+                    if self._stopped.is_set():
+                        return
+                    started = time.monotonic()
+                stats.busy += time.monotonic() - started
+            finally:
+                if hasattr(pages, 'close'):
+                    pages.close()
+
+            with self._buffered:  # the fetcher ran out of URLs, but URLs may still be added while the fetched pages are processed
+                waiting = time.monotonic()
+                self._buffered.wait_for(lambda: self._unfinished == 0 or len(self._urls) > 0 or self._stopped.is_set())
+                stats.idle += time.monotonic() - waiting
+            with self._lock:
+                if self._stopped.is_set() or not buffer.used or self._urls.is_empty():
+                    return
+
+    def _buffer(self, page: FetchResult, stats: StageStats):
+        """Counts the page as unfinished, after waiting until its content fits into max_buffered_bytes."""
+        size = len(page.content)
+        max_buffered_bytes = self._pipeline.max_buffered_bytes
+        with self._buffered:
+            if max_buffered_bytes is not None:
+                started = time.monotonic()
+                self._buffered.wait_for(lambda: self._unfinished == 0 or self._buffered_bytes + size <= max_buffered_bytes or self._stopped.is_set())
+                stats.blocked += time.monotonic() - started
+            self._unfinished += 1
+            self._buffered_bytes += size
+
+    def _extract_stage(self):
+        """Submits the fetched pages to the scrape pool and passes the results on in the order of the pages. A result is
+        passed on as soon as no further page is waiting, so the pages in the pool never wait for the next fetched page."""
+        stats = self.stats[1]
+        scrape_pool = self._pipeline._scrape_pool
+        extract = partial(_extract_timed, self._extract) if self._extract is not None else None
+        pending: Deque[Tuple[FetchResult, Future]] = deque()
+        while True:
+            if pending and (len(pending) >= scrape_pool.max_pending or self._fetched.empty()):
+                self._put_extracted(pending, stats)
+                continue
+            page = self._get(self._fetched, stats)
+            if page is _END:
+                break
+            if isinstance(page, _StageError):
+                raise page.exception
+            started = time.monotonic()
+            if self._extract is None:
+                self._put(self._extracted, (page, None), stats)
+                stats.items += 1
+            else:
+                pending.append((page, scrape_pool.submit(extract, page)))
+            stats.busy += time.monotonic() - started
+        while pending:
+            self._put_extracted(pending, stats)
+
+    def _put_extracted(self, pending: Deque[Tuple[FetchResult, Future]], stats: StageStats):
+        started = time.monotonic()
+        page, future = pending.popleft()
+        extracted = None
+        if page.ok:
+            try:
+                extracted, seconds = future.result()
+                self._pipeline._extract_metric.observe(seconds, pipeline=self._pipeline.name)
+            except BrokenExecutor:
+                raise
+            except Exception as exception:
+                self._pipeline._logger.warning('could not extract page', pipeline=self._pipeline.name, url=page.url, exception=repr(exception))
+                page.outcome = FetchOutcome.ERROR
+                page.error = f'extraction failed, {exception.__class__.__name__}: {exception}'
+        stats.busy += time.monotonic() - started
+        stats.items += 1
+        self._put(self._extracted, (page, extracted), stats)
+
+    def _run_stage(self, stage: Callable[[], None], output: queue.Queue):
+        """Runs the stage and ends its output with _END, or with a _StageError if the stage failed."""
+        try:
+            stage()
+        except BaseException as exception:
+            self._put(output, _StageError(exception))
+            return
+        self._put(output, _END)
+
+    def _put(self, output: queue.Queue, item: Any, stats: StageStats = None):
+        started = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._pipeline._queue_depth_metric.set(output.qsize(), pipeline=self._pipeline.name,
+                                               queue='fetched' if output is self._fetched else 'extracted')
+        if stats is not None:
+            stats.blocked += time.monotonic() - started
+
+    def _get(self, source: queue.Queue, stats: StageStats) -> Any:
+        started = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                item = source.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = _END
+        stats.idle += time.monotonic() - started
+        return item
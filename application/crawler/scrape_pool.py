@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, TypeVar, Optional
+
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import FetchResult
+
+ExtractResult = TypeVar('ExtractResult')
+
+
+class ScrapePool:
+    """Runs the CPU-bound extract phase of scraping in a pool of worker processes.
+
+    The workers only receive the raw page content and return plain, picklable data (e.g. structured data dicts or
+    recipe overview entries), the domain entities are built afterwards in the crawler process. With 0 workers the
+    extract functions run in the current process. The pool is started lazily from the threads of a running crawl, so
+    the workers are started by a forkserver (or spawned), a fork of the crawler process could inherit locks that are
+    held by its other threads and deadlock.
+    """
+
+    def __init__(self, workers: int = 0, max_pending_per_worker: int = 2):
+        if workers < 0:
+            raise InvalidValueException(self, 'workers cannot be less than 0')
+        self.workers = workers
+        self.max_pending = max(1, workers * max_pending_per_worker)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, extract: Callable[[bytes], ExtractResult], page: FetchResult) -> Future:
+        """Applies extract to the content of the page in a worker and returns the future of the result. Without workers,
+        extract runs right away. The result of a page that could not be fetched is None, an exception of extract is
+        raised by the result of the future."""
+        if self.workers == 0 or not page.ok:
+            future = Future()
+            try:
+                future.set_result(extract(page.content) if page.ok else None)
+            except Exception as exception:
+                future.set_exception(exception)
+            return future
+        return self._get_executor().submit(extract, page.content)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._executor = None
+
+    def __enter__(self) -> ScrapePool:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(start_method))
+        return self._executor
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(workers={self.workers}, max_pending={self.max_pending})'
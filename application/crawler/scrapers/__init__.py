@@ -1,2 +1,2 @@
-from application.crawler.scrapers.base import AbstractBaseScraper, RecipeOverviewItem
+from application.crawler.scrapers.base import AbstractBaseScraper, RecipeOverviewItem, RecipeOverviewEntry
 from application.crawler.scrapers.chefkoch_scraper import ChefkochScraper
@@ -3,25 +3,58 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from domain.model.category_aggregate import Category
 from domain.model.recipe_aggregate import Recipe
 
 
+RecipeOverviewEntry = Tuple[str, datetime]
+
+
 class AbstractBaseScraper(ABC):
+    """Scrapes recipes and categories from the pages of a vendor.
+
+    Recipes and recipe overviews can be scraped in two phases: the static extract methods turn the raw page content into
+    plain, picklable data and can therefore run in worker processes, the build methods create the domain entities from
+    that data in the crawler process.
+
+    Scrapers declare the parts of the overview and categories pages they need as SoupStrainers, so only those subtrees
+    are built when the pages are parsed. None means that the whole page is needed.
+    """
+
+    recipe_overview_parse_only: Optional[SoupStrainer] = None
+    categories_parse_only: Optional[SoupStrainer] = None
 
     @abstractmethod
     def scrape_recipe(self, soup: BeautifulSoup, url: str, category: Category) -> Recipe:
         raise NotImplementedError
 
+    @staticmethod
+    @abstractmethod
+    def extract_recipe(content: bytes) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def build_recipe(self, structured_data: Optional[dict], url: str, category: Category) -> Optional[Recipe]:
+        raise NotImplementedError
+
     @staticmethod
     @abstractmethod
     def scrape_recipe_overview(soup: BeautifulSoup, category: Category) -> List[RecipeOverviewItem]:
         raise NotImplementedError
 
+    @staticmethod
+    @abstractmethod
+    def extract_recipe_overview(content: bytes) -> List[RecipeOverviewEntry]:
+        raise NotImplementedError
+
+    @staticmethod
+    def build_recipe_overview(entries: List[RecipeOverviewEntry], category: Category) -> List[RecipeOverviewItem]:
+        return [RecipeOverviewItem(url=url, category=category, published=published) for url, published in entries]
+
     @abstractmethod
     def scrape_categories(self, soup: BeautifulSoup) -> List[Category]:
         raise NotImplementedError
@@ -1,12 +1,15 @@
 import json
 from datetime import datetime
-from typing import List
+from io import BytesIO
+from typing import List, Optional
 from uuid import uuid4
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import EncodingDetector
+from lxml import etree
 
 from application.crawler.scrapers import RecipeOverviewItem
-from application.crawler.scrapers.base import AbstractBaseScraper
+from application.crawler.scrapers.base import AbstractBaseScraper, RecipeOverviewEntry
 from domain.model.category_aggregate import Category, create_category
 from domain.model.recipe_aggregate import Recipe
 from domain.model.recipe_aggregate.factory import create_recipe_from_structured_data
@@ -14,24 +17,68 @@ from domain.model.vendor_aggregate import Vendor
 
 
 class ChefkochScraper(AbstractBaseScraper):
+    recipe_overview_parse_only = SoupStrainer('article')
+    categories_parse_only = SoupStrainer(class_='category-column')
+
     def __init__(self, vendor: Vendor):
         self.vendor = vendor
 
     def scrape_recipe(self, soup: BeautifulSoup, url: str, category: Category) -> Recipe:
+        return self.build_recipe(structured_data=self._find_recipe_structured_data(soup), url=url, category=category)
+
+    @staticmethod
+    def extract_recipe(content: bytes) -> Optional[dict]:
+        """Extracts the ld+json recipe data with a targeted parse of the script tags and falls back to a full parse if that fails."""
+        try:
+            structured_data = ChefkochScraper._find_recipe_structured_data_fast(content)
+        except (ValueError, etree.LxmlError):
+            structured_data = None
+        if structured_data is not None:
+            return structured_data
+        return ChefkochScraper._find_recipe_structured_data(BeautifulSoup(content, "lxml"))
+
+    def build_recipe(self, structured_data: Optional[dict], url: str, category: Category) -> Optional[Recipe]:
+        if structured_data is None:
+            return None
+        return create_recipe_from_structured_data(structured_data=structured_data, url=url, vendor=self.vendor, category=category)
+
+    @staticmethod
+    def _find_recipe_structured_data(soup: BeautifulSoup) -> Optional[dict]:
         for structured_data_entry in soup.find_all("script", type="application/ld+json"):
             structured_data = json.loads(structured_data_entry.string)
             if structured_data.get('@type', None) == 'Recipe':
-                return create_recipe_from_structured_data(structured_data=structured_data, url=url, vendor=self.vendor, category=category)
+                return structured_data
+        return None
+
+    @staticmethod
+    def _find_recipe_structured_data_fast(content: bytes) -> Optional[dict]:
+        """Streams the content through the lxml HTML parser and only looks at the script elements, without building a BeautifulSoup tree."""
+        encoding = EncodingDetector.find_declared_encoding(content, is_html=True) or 'utf-8'
+        for _, script in etree.iterparse(BytesIO(content), events=('end',), tag='script', html=True, recover=True, encoding=encoding):
+            if script.get('type') == 'application/ld+json' and script.text:
+                structured_data = json.loads(script.text)
+                if structured_data.get('@type', None) == 'Recipe':
+                    return structured_data
+            script.clear()
+        return None
 
     @staticmethod
     def scrape_recipe_overview(soup: BeautifulSoup, category: Category) -> List[RecipeOverviewItem]:
-        recipe_overview_items = list()
+        return ChefkochScraper.build_recipe_overview(ChefkochScraper._find_recipe_overview_entries(soup), category=category)
+
+    @staticmethod
+    def extract_recipe_overview(content: bytes) -> List[RecipeOverviewEntry]:
+        return ChefkochScraper._find_recipe_overview_entries(BeautifulSoup(content, "lxml", parse_only=ChefkochScraper.recipe_overview_parse_only))
+
+    @staticmethod
+    def _find_recipe_overview_entries(soup: BeautifulSoup) -> List[RecipeOverviewEntry]:
+        recipe_overview_entries = list()
         for recipe in soup.findAll('article'):
             url = recipe.find('a').attrs.get('href', None)
             date_string = recipe.find(class_='recipe-date').contents[1].strip()
             date = datetime.strptime(date_string, '%d.%m.%Y')
-            recipe_overview_items.append(RecipeOverviewItem(url=url, category=category, published=date))
-        return recipe_overview_items
+            recipe_overview_entries.append((url, date))
+        return recipe_overview_entries
 
     def scrape_categories(self, soup: BeautifulSoup) -> List[Category]:
         categories = list()
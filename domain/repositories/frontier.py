@@ -0,0 +1,59 @@
+from abc import abstractmethod, ABC
+from enum import Enum
+from typing import List, Tuple, Dict, Optional
+
+
+class FrontierState(Enum):
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class AbstractFrontierRepository(ABC):
+    """Stores the URLs of crawls together with their processing state, so an interrupted crawl can be resumed.
+
+    A crawl is identified by its name, the URLs of one crawl are unique. Every URL can carry a context string, e.g. the
+    URL of the page it was found on, that is handed out together with the URL when it is claimed.
+    """
+
+    @abstractmethod
+    def add_urls(self, crawl: str, urls: List[str], priority: int = 0, context: Optional[str] = None):
+        """Adds the urls as pending URLs to the crawl, URLs that the crawl already contains are ignored."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim_urls(self, crawl: str, worker: str, limit: int, lease_timeout: float) -> List[Tuple[str, Optional[str]]]:
+        """Claims up to limit pending URLs of the crawl for the worker and returns them as (url, context) pairs.
+
+        Claimed URLs are in progress until they are acknowledged with save_checkpoint. URLs that are in progress for
+        longer than lease_timeout seconds, e.g. because their worker died, can be claimed again. URLs that are claimed by
+        concurrent workers are skipped, so no URL is claimed by two workers at the same time.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_pending_urls(self, crawl: str) -> List[Tuple[str, int]]:
+        """Returns (url, priority) pairs of the pending URLs of the crawl, ordered by priority and the order they were added."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_finished_urls(self, crawl: str) -> List[str]:
+        """Returns the URLs of the crawl that are done or failed permanently."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_checkpoint(self, crawl: str, done_urls: List[str], failed_urls: Dict[str, str], max_attempts: int):
+        """Marks the done_urls as done and records a failed attempt for every url of failed_urls (url -> error) in one
+        transaction. Failed URLs stay pending until they failed max_attempts times."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_progress(self, crawl: str) -> Dict[FrontierState, int]:
+        """Returns the number of URLs of the crawl per state."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_urls(self, crawl: str, state: FrontierState = None):
+        """Deletes the URLs of the crawl, only those in the passed state if a state is passed."""
+        raise NotImplementedError
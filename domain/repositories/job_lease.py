@@ -0,0 +1,27 @@
+from abc import abstractmethod, ABC
+
+
+class AbstractJobLeaseRepository(ABC):
+    """Stores the leases of scheduled jobs, so that of several scheduler replicas exactly one runs every job run.
+
+    A job run is identified by the name of the job and a run key, e.g. the day of a daily job. A lease is held by one
+    owner until it expires, unless the owner renews it. A finished run is never leased again, a run whose owner died
+    (or failed) can be leased by another owner once the lease expired, up to max_attempts times.
+    """
+
+    @abstractmethod
+    def acquire(self, job: str, run: str, owner: str, lease_timeout: float, max_attempts: int = None) -> bool:
+        """Leases the run of the job to the owner for lease_timeout seconds. Returns False if the job is leased by
+        another owner, if the run (or a later run) of the job already finished, or if the run was already leased
+        max_attempts times."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew(self, job: str, owner: str, lease_timeout: float) -> bool:
+        """Extends the lease of the owner by lease_timeout seconds from now. Returns False if the owner lost the lease."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, job: str, owner: str, finished: bool = True):
+        """Ends the lease of the owner. A finished run is not leased again, an unfinished one can be taken over."""
+        raise NotImplementedError
@@ -1,11 +1,30 @@
+from __future__ import annotations
+
 from abc import abstractmethod, ABC
-from typing import List
+from dataclasses import dataclass
+from typing import List, Iterator
 
 from domain.model.recipe_aggregate import Recipe
 from domain.model.user_aggregate import User
+from domain.model.vendor_aggregate import Vendor
 from domain.repositories.base import AbstractBaseRepository
 
 
+@dataclass
+class RecipeWriteCounts:
+    """Number of recipes that add_many inserted, updated or left unchanged."""
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(inserted=self.inserted, updated=self.updated, unchanged=self.unchanged)
+
+    def __add__(self, other: RecipeWriteCounts) -> RecipeWriteCounts:
+        return RecipeWriteCounts(inserted=self.inserted + other.inserted, updated=self.updated + other.updated,
+                                 unchanged=self.unchanged + other.unchanged)
+
+
 class AbstractRecipeRepository(AbstractBaseRepository, ABC):
 
     @abstractmethod
@@ -19,3 +38,20 @@ class AbstractRecipeRepository(AbstractBaseRepository, ABC):
     @abstractmethod
     def get_unseen_recipes_for_user(self, user: User, limit: int = None) -> List[Recipe]:
         raise NotImplementedError
+
+    @abstractmethod
+    def get_urls_by_vendor(self, vendor: Vendor) -> Iterator[str]:
+        """Streams the URLs of all stored recipes of the vendor."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_by_vendor(self, vendor: Vendor) -> int:
+        raise NotImplementedError
+
+    def add_many(self, entities: List[Recipe], chunk_size: int = 1000) -> RecipeWriteCounts:
+        """Adds or updates the recipes in transactions of up to chunk_size recipes and returns how many were inserted,
+        updated or unchanged. Repositories that can write many rows at once should override this, by default the
+        recipes are added one by one."""
+        for entity in entities:
+            self.add(entity)
+        return RecipeWriteCounts(inserted=len(entities))
@@ -1,5 +1,7 @@
 from abc import abstractmethod, ABC
-from typing import List
+from datetime import datetime
+from typing import List, Dict
+from uuid import UUID
 
 from domain.model.recipe_aggregate import Recipe
 from domain.model.vendor_aggregate import Vendor
@@ -15,3 +17,14 @@ class AbstractVendorRepository(AbstractBaseRepository, ABC):
     @abstractmethod
     def get_recipes(self, vendor: Vendor, limit: int = None) -> List[Recipe]:
         raise NotImplementedError
+
+    @abstractmethod
+    def get_crawl_watermarks(self, vendor: Vendor) -> Dict[UUID, datetime]:
+        """Returns the publish date up to which the recipes of a category are completely crawled, per category id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def advance_crawl_watermarks(self, vendor: Vendor, watermarks: Dict[UUID, datetime], date_last_crawled: datetime):
+        """Stores the watermarks (category id -> publish date) and the date_last_crawled of the vendor in one transaction.
+        A watermark never moves backwards."""
+        raise NotImplementedError
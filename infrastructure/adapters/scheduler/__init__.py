@@ -1 +1,2 @@
 from infrastructure.adapters.scheduler.blocking_scheduler import BlockingSchedulerAdapter
+from infrastructure.adapters.scheduler.job_lease import JobLease
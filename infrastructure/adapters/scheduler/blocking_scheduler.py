@@ -1,18 +1,54 @@
 from datetime import datetime, timedelta
-from typing import Callable, List
+from typing import Callable, Dict
 
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_ERROR, JobEvent, JobExecutionEvent
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 
+from domain.exceptions import InvalidValueException
+from domain.repositories.job_lease import AbstractJobLeaseRepository
+from infrastructure.adapters.scheduler.job_lease import JobLease
+
 
 class BlockingSchedulerAdapter:
     """Adapter for the BlockingScheduler from the apscheduler library.
 
     This scheduler blocks the current process and should be used when
     it is the only thing running in the process.
+
+    Jobs run in a pool of max_workers threads, so the daily jobs of different vendors run at the same time. A job never
+    runs twice at the same time: a run that is due while the previous run is still going is skipped, and runs that were
+    missed (e.g. while the process was down) are coalesced into one run if it is at most misfire_grace_time seconds late.
+
+    With a lease_repository, every run of a job is leased before it starts, so any number of scheduler replicas can
+    be deployed and exactly one of them runs each daily job run. The other replicas skip it. A run is identified by
+    its date in the timezone of the scheduler, the one the hour of the jobs is in. From lease_timeout seconds after the
+    hour on, each replica retries the run of the day every lease_timeout seconds, so a run that failed or whose replica
+    died is taken over once its lease expired. A finished run is skipped, and a run is given up after max_attempts
+    leases. A job gets a callable that returns True once its run lost the lease to another replica, then it should stop.
     """
 
-    def __init__(self, create_logger: Callable):
-        self._scheduler = BlockingScheduler()
+    def __init__(self, create_logger: Callable, max_workers: int = 4, misfire_grace_time: int = 3600,
+                 lease_repository: AbstractJobLeaseRepository = None, owner: str = None, lease_timeout: float = 300,
+                 max_attempts: int = 3):
+        if max_workers < 1:
+            raise InvalidValueException(self, 'max_workers must be at least 1')
+        if lease_repository is not None and not owner:
+            raise InvalidValueException(self, 'owner is required with a lease_repository')
+        if max_attempts < 1:
+            raise InvalidValueException(self, 'max_attempts must be at least 1')
+        self.max_workers = max_workers
+        self.misfire_grace_time = misfire_grace_time
+        self.owner = owner
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lease_repository = lease_repository
+        self._create_logger = create_logger
+        self._scheduler = BlockingScheduler(
+            executors={'default': ThreadPoolExecutor(max_workers=max_workers)},
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': misfire_grace_time},
+        )
+        self._scheduler.add_listener(self._log_job_event, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED | EVENT_JOB_ERROR)
         self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
         self._logger.info('Created a new BlockingScheduler', scheduler=self)
 
@@ -20,9 +56,55 @@ class BlockingSchedulerAdapter:
         self._logger.info('BlockingScheduler started', scheduler=self)
         self._scheduler.start()
 
-    def add_daily_jobs(self, jobs: List[Callable]):
-        for index, job in enumerate(jobs):
-            start = datetime.now() + timedelta(seconds=10)
-            self._scheduler.add_job(job, 'cron', hour=index % 24, start_date=start)
-            # self._scheduler.add_job(job, 'date', run_date=start) for local testing
-            self._logger.info('Added daily job to BlockingScheduler', job=job, start=str(start), scheduler=self)
+    def add_daily_jobs(self, jobs: Dict[str, Callable[[Callable[[], bool]], None]], hour: int = 0):
+        """Runs every job once a day at the hour, the jobs are identified by their names. A job is called with a callable
+        that returns True once the job should stop."""
+        start = datetime.now() + timedelta(seconds=10)
+        for name, job in jobs.items():
+            self._scheduler.add_job(self._with_lease(name, job), 'cron', hour=hour, start_date=start, id=name, name=name, replace_existing=True)
+            # self._scheduler.add_job(job, 'date', run_date=start, id=name, name=name) for local testing
+            if self._lease_repository is not None:
+                self._scheduler.add_job(self._with_lease(name, job, retry_after_hour=hour), 'interval', seconds=self.lease_timeout,
+                                        start_date=start, id=f'{name}.retry', name=f'{name}.retry', replace_existing=True)
+            self._logger.info('Added daily job to BlockingScheduler', job=name, hour=hour, start=str(start), scheduler=self)
+
+    def _with_lease(self, name: str, job: Callable[[Callable[[], bool]], None], retry_after_hour: int = None) -> Callable:
+        """Wraps the daily job, so it only runs if this scheduler gets the lease of the run of the current day. A retry
+        only runs from lease_timeout seconds after retry_after_hour on, so the daily job gets to start the run first."""
+        if self._lease_repository is None:
+            return lambda: job(lambda: False)
+
+        def run_leased_job():
+            now = datetime.now(self._scheduler.timezone)
+            if retry_after_hour is not None and now < now.replace(hour=retry_after_hour, minute=0, second=0, microsecond=0) + timedelta(seconds=self.lease_timeout):
+                return
+            lease = JobLease(self._lease_repository, job=name, run=now.date().isoformat(), owner=self.owner, create_logger=self._create_logger,
+                             lease_timeout=self.lease_timeout, max_attempts=self.max_attempts)
+            if not lease.acquire():
+                if retry_after_hour is None:
+                    self._logger.info('Skipped job run, it is leased by another scheduler, finished or given up', job=name, run=lease.run, owner=self.owner)
+                return
+            if retry_after_hour is not None:
+                self._logger.info('Retrying unfinished job run', job=name, run=lease.run, owner=self.owner)
+            finished = False
+            try:
+                job(lambda: lease.lost)
+                finished = not lease.lost
+            finally:
+                lease.release(finished=finished)
+            if lease.lost:
+                self._logger.warning('Stopped job run, it lost its lease to another scheduler', job=name, run=lease.run, owner=self.owner)
+
+        return run_leased_job
+
+    def _log_job_event(self, event: JobEvent):
+        if event.code == EVENT_JOB_MAX_INSTANCES:
+            self._logger.warning('Skipped job run, the previous run is still running', job=event.job_id)
+        elif event.code == EVENT_JOB_MISSED:
+            self._logger.warning('Missed job run', job=event.job_id, scheduled=str(event.scheduled_run_time))
+        elif isinstance(event, JobExecutionEvent):
+            self._logger.error('Job failed', job=event.job_id, exception=repr(event.exception))
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(max_workers={self.max_workers}, misfire_grace_time={self.misfire_grace_time}, owner={self.owner!r}, ' \
+               f'max_attempts={self.max_attempts})'
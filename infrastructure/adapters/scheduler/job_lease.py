@@ -0,0 +1,61 @@
+import threading
+from typing import Callable, Optional
+
+from domain.exceptions import InvalidValueException
+from domain.repositories.job_lease import AbstractJobLeaseRepository
+
+
+class JobLease:
+    """Lease of one run of a scheduled job, so that of several scheduler replicas exactly one runs it.
+
+    While the lease is held, a background thread renews it every lease_timeout / 3 seconds, so it only expires if the
+    replica died or can't reach the database anymore. Then the run can be taken over by another replica, and lost is set,
+    so the job stops instead of running next to the replica that took it over. A run is leased at most max_attempts
+    times, so a run that keeps failing is given up.
+    """
+
+    def __init__(self, repository: AbstractJobLeaseRepository, job: str, run: str, owner: str, create_logger: Callable,
+                 lease_timeout: float = 300, max_attempts: int = None):
+        if lease_timeout <= 0:
+            raise InvalidValueException(self, 'lease_timeout must be greater than 0')
+        if max_attempts is not None and max_attempts < 1:
+            raise InvalidValueException(self, 'max_attempts must be at least 1')
+        self.job = job
+        self.run = run
+        self.owner = owner
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.lost = False
+        self._repository = repository
+        self._stopped = threading.Event()
+        self._renewal: Optional[threading.Thread] = None
+        self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+
+    def acquire(self) -> bool:
+        if not self._repository.acquire(self.job, run=self.run, owner=self.owner, lease_timeout=self.lease_timeout, max_attempts=self.max_attempts):
+            return False
+        self._renewal = threading.Thread(target=self._renew, name=f'job-lease-{self.job}', daemon=True)
+        self._renewal.start()
+        return True
+
+    def release(self, finished: bool = True):
+        self._stopped.set()
+        if self._renewal is not None:
+            self._renewal.join()
+        self._repository.release(self.job, owner=self.owner, finished=finished)
+
+    def _renew(self):
+        while not self._stopped.wait(self.lease_timeout / 3):
+            try:
+                renewed = self._repository.renew(self.job, owner=self.owner, lease_timeout=self.lease_timeout)
+            except Exception as exception:
+                self._logger.warning('failed to renew job lease', job=self.job, owner=self.owner, exception=repr(exception))
+                continue
+            if not renewed:
+                self.lost = True
+                self._logger.error('lost job lease, the job is stopped', job=self.job, run=self.run, owner=self.owner)
+                return
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(job={self.job!r}, run={self.run!r}, owner={self.owner!r}, lease_timeout={self.lease_timeout}, ' \
+               f'max_attempts={self.max_attempts})'
@@ -12,6 +12,44 @@ PROJECT_ROOT_DIR = Path(__file__).parent.parent.parent
 class CrawlerConfig(ConfigComponent):
     PREFIX = 'CRAWLER_'
     fetch_batch_size: int
+    fetch_persistent_session: bool = ConfigField(optional=True, default=True)
+    fetch_streaming: bool = ConfigField(optional=True, default=True)
+    fetch_limit_per_host: int = ConfigField(optional=True, default=0)
+    fetch_keepalive_timeout: float = ConfigField(optional=True, default=30.0)
+    fetch_dns_cache_ttl: int = ConfigField(optional=True, default=300)
+    rate_limit_requests_per_second: float = ConfigField(optional=True, default=0.0)
+    rate_limit_burst: int = ConfigField(optional=True, default=1)
+    rate_limit_max_concurrent_per_host: int = ConfigField(optional=True, default=0)
+    adaptive_concurrency: bool = ConfigField(optional=True, default=False)
+    adaptive_concurrency_min_window: int = ConfigField(optional=True, default=1)
+    adaptive_concurrency_max_window: int = ConfigField(optional=True, default=100)
+    adaptive_concurrency_latency_threshold: float = ConfigField(optional=True, default=2.0)
+    adaptive_concurrency_error_rate_threshold: float = ConfigField(optional=True, default=0.1)
+    retry_max_attempts: int = ConfigField(optional=True, default=3)
+    retry_base_delay: float = ConfigField(optional=True, default=0.5)
+    retry_max_delay: float = ConfigField(optional=True, default=30.0)
+    retry_budget: int = ConfigField(optional=True, default=100)
+    cache_directory: str = ConfigField(optional=True, default=None)
+    cache_max_age: float = ConfigField(optional=True, default=0.0)
+    cache_max_size_mb: int = ConfigField(optional=True, default=1024)
+    cache_max_entry_age: float = ConfigField(optional=True, default=2592000.0)
+    scrape_workers: int = ConfigField(optional=True, default=0)
+    overview_max_pages: int = ConfigField(optional=True, default=100)
+    known_urls_bloom_filter_threshold: int = ConfigField(optional=True, default=1000000)
+    store_batch_size: int = ConfigField(optional=True, default=100)
+    pipeline_queue_size: int = ConfigField(optional=True, default=100)
+    pipeline_max_buffered_mb: int = ConfigField(optional=True, default=64)
+    frontier_checkpoint_interval: int = ConfigField(optional=True, default=100)
+    frontier_max_attempts: int = ConfigField(optional=True, default=3)
+    frontier_claim_batch_size: int = ConfigField(optional=True, default=50)
+    frontier_lease_timeout: float = ConfigField(optional=True, default=600.0)
+    frontier_poll_interval: float = ConfigField(optional=True, default=60.0)
+    scheduler_max_workers: int = ConfigField(optional=True, default=4)
+    scheduler_misfire_grace_time: int = ConfigField(optional=True, default=3600)
+    scheduler_hour: int = ConfigField(optional=True, default=0)
+    scheduler_lease_timeout: float = ConfigField(optional=True, default=300.0)
+    scheduler_max_attempts: int = ConfigField(optional=True, default=3)
+    metrics_port: int = ConfigField(optional=True, default=0)
     log_file_name: str
     log_level_console: str = LogLevelField()
     log_level_file: str = LogLevelField()
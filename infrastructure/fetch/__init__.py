@@ -1,2 +1,8 @@
-from infrastructure.fetch.async_fetcher import AsyncFetcher
-from infrastructure.fetch.base import AbstractFetcher, FetchResult
+from infrastructure.fetch.async_fetcher import AsyncFetcher, create_async_fetcher
+from infrastructure.fetch.base import AbstractFetcher, FetchResult, FetchOutcome
+from infrastructure.fetch.cache import PageCache, CacheEntry
+from infrastructure.fetch.concurrency import AIMDConcurrencyController
+from infrastructure.fetch.rate_limiter import HostRateLimiter, TokenBucket
+from infrastructure.fetch.retry import RetryPolicy
+from infrastructure.fetch.url_queue import URLQueue, PersistentURLQueue, create_persistent_url_queue, SharedURLQueue, \
+    create_shared_url_queue
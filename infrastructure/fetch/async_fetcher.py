@@ -1,49 +1,312 @@
+from __future__ import annotations
+
 import asyncio
+import time
 from asyncio import AbstractEventLoop
-from typing import List, Generator
+from contextlib import asynccontextmanager
+from typing import List, Generator, Optional, AsyncGenerator, Callable, Dict, Union
+from urllib.parse import urlparse
 
-import aiohttp
-from aiohttp import ClientTimeout, ClientSession
-from bs4 import BeautifulSoup
+from aiohttp import ClientTimeout, ClientSession, TCPConnector, ClientConnectionError
+from multidict import CIMultiDict
 
-from infrastructure.fetch.base import AbstractFetcher, FetchResult
+from domain.exceptions import InvalidValueException
+from infrastructure.config import CrawlerConfig
+from infrastructure.fetch.base import AbstractFetcher, FetchResult, FetchOutcome
+from infrastructure.fetch.cache import PageCache, CacheEntry
+from infrastructure.fetch.concurrency import AIMDConcurrencyController
+from infrastructure.fetch.rate_limiter import HostRateLimiter
+from infrastructure.fetch.retry import RetryPolicy
 from infrastructure.fetch.url_queue import URLQueue
+from infrastructure.metrics import MetricsRegistry
+
+
+def create_async_fetcher(config: CrawlerConfig, create_logger: Callable, metrics: MetricsRegistry = None) -> AsyncFetcher:
+    if not isinstance(config, CrawlerConfig):
+        raise InvalidValueException(AsyncFetcher, 'config must be a CrawlerConfig')
+
+    rate_limiter = None
+    if config.rate_limit_requests_per_second > 0 or config.rate_limit_max_concurrent_per_host > 0:
+        rate_limiter = HostRateLimiter(
+            requests_per_second=config.rate_limit_requests_per_second,
+            burst=config.rate_limit_burst,
+            max_concurrent_per_host=config.rate_limit_max_concurrent_per_host,
+        )
+
+    concurrency_controller = None
+    if config.adaptive_concurrency:
+        concurrency_controller = AIMDConcurrencyController(
+            create_logger=create_logger,
+            initial_window=config.fetch_batch_size,
+            min_window=min(config.adaptive_concurrency_min_window, config.fetch_batch_size),
+            max_window=max(config.adaptive_concurrency_max_window, config.fetch_batch_size),
+            latency_threshold=config.adaptive_concurrency_latency_threshold,
+            error_rate_threshold=config.adaptive_concurrency_error_rate_threshold,
+        )
+
+    retry_policy = None
+    if config.retry_max_attempts > 1:
+        retry_policy = RetryPolicy(
+            max_attempts=config.retry_max_attempts,
+            base_delay=config.retry_base_delay,
+            max_delay=config.retry_max_delay,
+            retry_budget=config.retry_budget,
+        )
+
+    cache = None
+    if config.cache_directory:
+        cache = PageCache(directory=config.cache_directory, max_age=config.cache_max_age, max_size_bytes=config.cache_max_size_mb * 1024 * 1024,
+                          max_entry_age=config.cache_max_entry_age)
+
+    return AsyncFetcher(
+        batch_size=config.fetch_batch_size,
+        persistent_session=config.fetch_persistent_session,
+        streaming=config.fetch_streaming,
+        limit_per_host=config.fetch_limit_per_host,
+        keepalive_timeout=config.fetch_keepalive_timeout,
+        dns_cache_ttl=config.fetch_dns_cache_ttl,
+        rate_limiter=rate_limiter,
+        concurrency_controller=concurrency_controller,
+        retry_policy=retry_policy,
+        cache=cache,
+        metrics=metrics,
+    )
 
 
 class AsyncFetcher(AbstractFetcher):
+    """Fetches URLs concurrently with aiohttp.
+
+    By default every batch is fetched with a new ClientSession. With persistent_session enabled the fetcher keeps
+    one session (and therefore one pool of keep-alive connections) until close() is called, so the TCP and TLS
+    handshakes are only paid once per host and not once per batch.
+
+    In streaming mode the URLs are not fetched in lock-step batches. Instead batch_size requests are kept in flight at
+    all times and every FetchResult is yielded (as a single-element batch) as soon as its request completes, so one slow
+    URL doesn't hold back the others.
+
+    An optional HostRateLimiter is applied to every request, so each host is only fetched within its own budget.
+
+    With an AIMDConcurrencyController the number of requests per batch (or in flight while streaming) is not fixed to
+    batch_size but follows the window of the controller, which adapts to the latency and error rate of the responses.
+
+    Failed requests never surface as exceptions. Every URL results in a FetchResult whose outcome classifies the
+    failure, and transient failures are retried according to the optional RetryPolicy.
+
+    With a PageCache, fresh pages are served from disk without a request and stale pages are revalidated with
+    If-None-Match / If-Modified-Since, so unchanged pages are answered with a body-less 304 and loaded from disk. The
+    cache is read and written in the default executor, so the disk I/O doesn't block the event loop.
+
+    Every request is recorded in the metrics: its latency, status and response size per host, and the outcome of every
+    URL after its retries.
+    """
+
     user_agent = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:86.0) Gecko/20100101 Firefox/86.0'
 
-    def __init__(self, batch_size: int):
+    def __init__(self, batch_size: int, persistent_session: bool = False, streaming: bool = False, limit_per_host: int = 0,
+                 keepalive_timeout: float = 30, dns_cache_ttl: int = 300, rate_limiter: HostRateLimiter = None,
+                 concurrency_controller: AIMDConcurrencyController = None, retry_policy: RetryPolicy = None,
+                 cache: PageCache = None, metrics: MetricsRegistry = None):
         self.fetch_batch_size = batch_size
+        self.persistent_session = persistent_session
+        self.streaming = streaming
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.rate_limiter = rate_limiter
+        self.concurrency_controller = concurrency_controller
+        self.retry_policy = retry_policy
+        self.cache = cache
+        self._session: Optional[ClientSession] = None
+        self._loop: Optional[AbstractEventLoop] = None
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self._requests_metric = metrics.counter('crawler_fetch_requests_total', 'HTTP requests by host and status', ('host', 'status'))
+        self._latency_metric = metrics.histogram('crawler_fetch_seconds', 'Latency of HTTP requests by host', ('host',))
+        self._bytes_metric = metrics.counter('crawler_fetch_bytes_total', 'Received response bytes by host', ('host',))
+        self._results_metric = metrics.counter('crawler_fetch_results_total', 'Fetched URLs by outcome, after retries', ('outcome', 'from_cache'))
+
+    def fetch(self, urls: Union[List[str], URLQueue]) -> Generator[List[FetchResult], None, None]:
+        """Fetches urls parallel in batches and returns a generator that yields every fetched URL batch as a list of FetchResult objects.
 
-    def fetch(self, urls: List[str]) -> Generator[List[FetchResult], None, None]:
-        """Fetches urls parallel in batches and returns a generator that yields every fetched URL batch as a list of FetchResult objects."""
+        A list of urls is fetched as it is, including duplicates. A URLQueue is consumed, so URLs that are added to it
+        while the generator is running are fetched in the same run.
+        """
 
         loop = self._get_event_loop()
-        queue = URLQueue(urls=urls)
+        queue = urls if isinstance(urls, URLQueue) else URLQueue(urls=urls, deduplicate=False)
+        if self.retry_policy is not None:
+            self.retry_policy.reset_budget()
+        if self.streaming:
+            yield from self._fetch_streaming(loop, queue)
+            return
         while not queue.is_empty():
-            url_batch = [next(queue) for _ in range(self.fetch_batch_size) if not queue.is_empty()]
+            url_batch = [next(queue) for _ in range(self.concurrency) if not queue.is_empty()]
             yield loop.run_until_complete(self._fetch_parallel_job(url_batch))
 
+    @property
+    def concurrency(self) -> int:
+        """Number of requests that are fetched at the same time."""
+        if self.concurrency_controller is not None:
+            return self.concurrency_controller.window
+        return self.fetch_batch_size
+
+    def close(self):
+        """Closes the persistent session and all of its pooled connections, and the event loop of the fetcher."""
+        if self._session is not None and not self._session.closed:
+            self._get_event_loop().run_until_complete(self._session.close())
+        self._session = None
+        if self._loop is not None:
+            self._loop.close()
+        self._loop = None
+
     @staticmethod
-    async def _fetch_url_async(session: ClientSession, url: str) -> FetchResult:
-        async with session.get(url) as response:
+    async def _fetch_url_async(session: ClientSession, url: str, headers: Dict[str, str] = None) -> FetchResult:
+        async with session.get(url, headers=headers) as response:
             status = response.status
-            html = await response.read()
-            return FetchResult(url=url, status=status, html=BeautifulSoup(html, "lxml"))
+            content = await response.read()
+            return FetchResult(url=url, status=status, content=content, headers=CIMultiDict(response.headers))
 
-    async def _fetch_parallel_job(self, urls):
-        async with aiohttp.ClientSession(timeout=ClientTimeout(10), headers={'user-agent': self.user_agent}) as session:
-            return await asyncio.gather(
-                *[self._fetch_url_async(session, url) for url in urls], return_exceptions=True
-            )
+    async def _fetch_with_retry(self, session: ClientSession, url: str) -> FetchResult:
+        attempt = 1
+        while True:
+            result = await self._fetch_classified(session, url)
+            if self.retry_policy is None or not self.retry_policy.should_retry(result.outcome, attempt):
+                result.attempts = attempt
+                self._results_metric.inc(outcome=result.outcome.value, from_cache=result.from_cache)
+                return result
+            await asyncio.sleep(self.retry_policy.get_delay(attempt))
+            attempt += 1
+
+    async def _fetch_classified(self, session: ClientSession, url: str) -> FetchResult:
+        """Fetches the url and turns every failure without a response into a FetchResult with the matching outcome."""
+        try:
+            return await self._fetch_cached(session, url)
+        except asyncio.TimeoutError as exception:
+            return FetchResult.failed(url=url, outcome=FetchOutcome.TIMEOUT, error=exception)
+        except ClientConnectionError as exception:
+            return FetchResult.failed(url=url, outcome=FetchOutcome.CONNECTION_ERROR, error=exception)
+        except Exception as exception:
+            return FetchResult.failed(url=url, outcome=FetchOutcome.ERROR, error=exception)
+
+    async def _fetch_cached(self, session: ClientSession, url: str) -> FetchResult:
+        if self.cache is None:
+            return await self._fetch_limited(session, url)
+
+        loop = asyncio.get_event_loop()
+        entry = await self.cache.get_async(loop, url)
+        if entry is not None and entry.is_fresh(self.cache.max_age):
+            return self._create_cached_result(entry, status=200)
+
+        result = await self._fetch_limited(session, url, headers=entry.conditional_headers() if entry is not None else None)
+        if result.status == 304 and entry is not None:
+            return self._create_cached_result(await self.cache.touch_async(loop, entry), status=304)
+        if result.status == 200:
+            await self.cache.store_async(loop, url=url, content=result.content, headers=result.headers)
+        return result
 
     @staticmethod
-    def _get_event_loop() -> AbstractEventLoop:
+    def _create_cached_result(entry: CacheEntry, status: int) -> FetchResult:
+        return FetchResult(url=entry.url, status=status, content=entry.content, from_cache=True)
+
+    async def _fetch_limited(self, session: ClientSession, url: str, headers: Dict[str, str] = None) -> FetchResult:
+        if self.rate_limiter is None:
+            return await self._fetch_measured(session, url, headers)
+        async with self.rate_limiter.limit(url):
+            return await self._fetch_measured(session, url, headers)
+
+    async def _fetch_measured(self, session: ClientSession, url: str, headers: Dict[str, str] = None) -> FetchResult:
+        start = time.monotonic()
         try:
-            return asyncio.get_event_loop()
-        except RuntimeError as exception:
-            if "There is no current event loop in thread" in str(exception):
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                return asyncio.get_event_loop()
+            result = await self._fetch_url_async(session, url, headers=headers)
+        except Exception:
+            self._record_request(url, latency=time.monotonic() - start, status=None)
+            raise
+        self._record_request(url, latency=time.monotonic() - start, status=result.status, size=len(result.content))
+        return result
+
+    def _record_request(self, url: str, latency: float, status: Optional[int], size: int = 0):
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.record(latency=latency, status=status)
+        host = urlparse(url).netloc
+        self._requests_metric.inc(host=host, status=status if status is not None else 'error')
+        self._latency_metric.observe(latency, host=host)
+        self._bytes_metric.inc(size, host=host)
+
+    async def _fetch_parallel_job(self, urls):
+        async with self._session_scope() as session:
+            return await asyncio.gather(*[self._fetch_with_retry(session, url) for url in urls])
+
+    def _fetch_streaming(self, loop: AbstractEventLoop, queue: URLQueue) -> Generator[List[FetchResult], None, None]:
+        stream = self._stream(queue)
+        try:
+            while True:
+                try:
+                    yield [loop.run_until_complete(stream.__anext__())]
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(stream.aclose())
+
+    async def _stream(self, queue: URLQueue) -> AsyncGenerator[FetchResult, None]:
+        """Keeps up to concurrency requests in flight and yields the results in order of completion.
+
+        New requests are only started when a slot becomes free, so URLs that are added to the queue while the stream
+        is running are fetched as well.
+        """
+        async with self._session_scope() as session:
+            in_flight = set()
+            try:
+                while in_flight or not queue.is_empty():
+                    while len(in_flight) < self.concurrency and not queue.is_empty():
+                        in_flight.add(asyncio.ensure_future(self._fetch_with_retry(session, next(queue))))
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+            finally:
+                for task in in_flight:
+                    task.cancel()
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+    @asynccontextmanager
+    async def _session_scope(self) -> AsyncGenerator[ClientSession, None]:
+        """Provides the persistent session if enabled, otherwise a new session that is closed afterwards."""
+        if not self.persistent_session:
+            async with self._create_session() as session:
+                yield session
+            return
+
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        yield self._session
+
+    def _create_session(self) -> ClientSession:
+        """Creates a ClientSession. Must be called from within a coroutine, so the session is bound to the running loop."""
+        connector = TCPConnector(
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=self.dns_cache_ttl > 0,
+        )
+        return ClientSession(connector=connector, timeout=ClientTimeout(10), headers={'user-agent': self.user_agent})
+
+    def _get_event_loop(self) -> AbstractEventLoop:
+        """Returns the event loop of the fetcher. The fetcher owns its loop, so its session (and the asyncio primitives of
+        the rate limiter) stay bound to one loop, no matter from which thread fetch is called, e.g. from the fetch stage
+        of a crawl pipeline. The fetcher must not be used by two threads at the same time."""
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def __repr__(self) -> str:
+        return '{c}(batch_size={batch_size}, persistent_session={persistent_session}, streaming={streaming}, limit_per_host={limit_per_host}, ' \
+               'rate_limiter={rate_limiter!r}, concurrency_controller={concurrency_controller!r}, retry_policy={retry_policy!r}, ' \
+               'cache={cache!r})'.format(
+            c=self.__class__.__name__,
+            batch_size=self.fetch_batch_size,
+            persistent_session=self.persistent_session,
+            streaming=self.streaming,
+            limit_per_host=self.limit_per_host,
+            rate_limiter=self.rate_limiter,
+            concurrency_controller=self.concurrency_controller,
+            retry_policy=self.retry_policy,
+            cache=self.cache,
+        )
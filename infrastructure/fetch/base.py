@@ -1,21 +1,126 @@
 from __future__ import annotations
 
 from abc import abstractmethod, ABC
-from dataclasses import dataclass
-from typing import List, Generator
+from enum import Enum
+from typing import List, Generator, Optional, Mapping, Union
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+from infrastructure.fetch.url_queue import URLQueue
 
 
 class AbstractFetcher(ABC):
 
     @abstractmethod
-    def fetch(self, urls: List[str]) -> Generator[List[FetchResult], None, None]:
+    def fetch(self, urls: Union[List[str], URLQueue]) -> Generator[List[FetchResult], None, None]:
+        """Fetches the passed urls. URLs that are added to a passed URLQueue while the generator is consumed are fetched as well."""
         raise NotImplementedError
 
+    def close(self):
+        """Releases resources that are held between fetch calls. Fetchers without such resources don't need to override this."""
+        pass
+
+    def __enter__(self) -> AbstractFetcher:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FetchOutcome(Enum):
+    SUCCESS = 'success'
+    CLIENT_ERROR = 'client_error'
+    RATE_LIMITED = 'rate_limited'
+    SERVER_ERROR = 'server_error'
+    TIMEOUT = 'timeout'
+    CONNECTION_ERROR = 'connection_error'
+    ERROR = 'error'
+
+    @property
+    def is_transient(self) -> bool:
+        """True if the same request might succeed when it is retried later."""
+        return self in (FetchOutcome.RATE_LIMITED, FetchOutcome.SERVER_ERROR, FetchOutcome.TIMEOUT, FetchOutcome.CONNECTION_ERROR)
+
+    @classmethod
+    def from_status(cls, status: int) -> FetchOutcome:
+        if status == 429:
+            return cls.RATE_LIMITED
+        if status >= 500:
+            return cls.SERVER_ERROR
+        if status >= 400:
+            return cls.CLIENT_ERROR
+        return cls.SUCCESS
+
 
-@dataclass
 class FetchResult:
-    url: str
-    status: int
-    html: BeautifulSoup
+    """Result of fetching a single URL.
+
+    The response body is kept as raw bytes. The BeautifulSoup document is only built on the first access of html (or
+    explicitly with parse), so the fetcher never blocks its event loop with parsing and pages that are discarded are
+    never parsed at all.
+    """
+
+    __slots__ = ('url', 'status', 'content', 'headers', 'outcome', 'error', 'attempts', 'from_cache', '_document')
+
+    parser = 'lxml'
+
+    def __init__(self, url: str, status: Optional[int], content: bytes = b'', headers: Mapping[str, str] = None,
+                 outcome: FetchOutcome = None, error: Optional[str] = None, attempts: int = 1, from_cache: bool = False,
+                 html: BeautifulSoup = None):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.headers = headers if headers is not None else dict()
+        self.outcome = outcome if outcome is not None else FetchOutcome.from_status(status) if status is not None else FetchOutcome.ERROR
+        self.error = error
+        self.attempts = attempts
+        self.from_cache = from_cache
+        self._document = html
+
+    @property
+    def ok(self) -> bool:
+        return self.outcome is FetchOutcome.SUCCESS
+
+    @property
+    def html(self) -> BeautifulSoup:
+        """The parsed document. It is parsed on first access and kept until release is called."""
+        if self._document is None:
+            self._document = self.parse()
+        return self._document
+
+    @property
+    def is_parsed(self) -> bool:
+        return self._document is not None
+
+    def parse(self, parse_only: SoupStrainer = None) -> BeautifulSoup:
+        """Parses the content into a new document without caching it. parse_only restricts the document to the matching elements."""
+        return BeautifulSoup(self.content, self.parser, parse_only=parse_only)
+
+    def release(self, content: bool = False):
+        """Drops the parsed document, so its memory can be freed while the result itself is still referenced. With
+        content, the raw content is dropped as well, e.g. once the page was scraped."""
+        self._document = None
+        if content:
+            self.content = b''
+
+    @classmethod
+    def failed(cls, url: str, outcome: FetchOutcome, error: Exception) -> FetchResult:
+        """Creates the result for a request that didn't receive a response."""
+        return cls(url=url, status=None, outcome=outcome, error=f'{error.__class__.__name__}: {error}')
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FetchResult):
+            return NotImplemented
+        return (self.url, self.status, self.outcome, self.error, self.attempts, self.content) == \
+               (other.url, other.status, other.outcome, other.error, other.attempts, other.content)
+
+    def __repr__(self) -> str:
+        return '{c}(url={url!r}, status={status!r}, outcome={outcome}, attempts={attempts}, size={size}, from_cache={from_cache})'.format(
+            c=self.__class__.__name__,
+            url=self.url,
+            status=self.status,
+            outcome=self.outcome.value,
+            attempts=self.attempts,
+            size=len(self.content),
+            from_cache=self.from_cache,
+        )
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from asyncio import AbstractEventLoop
+from dataclasses import dataclass
+from typing import Optional, Mapping, Dict, List, Tuple
+
+from domain.exceptions import InvalidValueException
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    url: str
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Returns the request headers to revalidate this entry with the server."""
+        headers = dict()
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.stored_at < max_age
+
+
+class PageCache:
+    """On-disk HTTP cache for fetched pages.
+
+    The cache is content-addressed: the gzip compressed bodies are stored under the SHA-256 digest of their content, so
+    identical pages are only stored once. A small JSON index file per URL (stored under the digest of the URL) holds the
+    content digest and the validators (ETag / Last-Modified) of the last response.
+
+    Entries that are younger than max_age seconds are served without any request. Older entries are revalidated with a
+    conditional request and served from disk if the server answers with 304 Not Modified.
+
+    The cache is bounded: every eviction_interval stores, the entries that were not stored or revalidated for
+    max_entry_age seconds are evicted, and then the least recently stored entries until the compressed bodies take at
+    most max_size_bytes. The *_async methods run the disk I/O in the default executor of the event loop.
+    """
+
+    def __init__(self, directory: str, max_age: float = 0, compression_level: int = 6, max_size_bytes: int = 1024 * 1024 * 1024,
+                 max_entry_age: float = 30 * 24 * 3600, eviction_interval: int = 1000):
+        if not directory:
+            raise InvalidValueException(self, 'directory must be a non-empty path')
+        if max_size_bytes < 1:
+            raise InvalidValueException(self, 'max_size_bytes must be at least 1')
+        if max_entry_age <= 0:
+            raise InvalidValueException(self, 'max_entry_age must be positive')
+        if eviction_interval < 1:
+            raise InvalidValueException(self, 'eviction_interval must be at least 1')
+        self.directory = directory
+        self.max_age = max_age
+        self.compression_level = compression_level
+        self.max_size_bytes = max_size_bytes
+        self.max_entry_age = max_entry_age
+        self.eviction_interval = eviction_interval
+        self._stores_since_eviction = 0
+        self._lock = threading.Lock()  # stores and evictions may run in several executor threads at the same time
+
+    async def get_async(self, loop: AbstractEventLoop, url: str) -> Optional[CacheEntry]:
+        return await loop.run_in_executor(None, self.get, url)
+
+    async def store_async(self, loop: AbstractEventLoop, url: str, content: bytes, headers: Mapping[str, str]) -> CacheEntry:
+        return await loop.run_in_executor(None, self.store, url, content, headers)
+
+    async def touch_async(self, loop: AbstractEventLoop, entry: CacheEntry) -> CacheEntry:
+        return await loop.run_in_executor(None, self.touch, entry)
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._index_path(url), 'r') as file:
+                index = json.load(file)
+            with gzip.open(self._object_path(index['digest']), 'rb') as file:
+                content = file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return CacheEntry(url=url, content=content, etag=index.get('etag'), last_modified=index.get('last_modified'),
+                          stored_at=index.get('stored_at', 0))
+
+    def store(self, url: str, content: bytes, headers: Mapping[str, str]) -> CacheEntry:
+        """Stores the content with the validators of the response headers, which are looked up case-insensitively."""
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        entry = CacheEntry(url=url, content=content, etag=_get_header(headers, 'ETag'), last_modified=_get_header(headers, 'Last-Modified'),
+                           stored_at=time.time())
+        index = dict(url=url, digest=digest, etag=entry.etag, last_modified=entry.last_modified, stored_at=entry.stored_at)
+        with self._lock:
+            if not os.path.exists(object_path):
+                self._write_atomic(object_path, gzip.compress(content, compresslevel=self.compression_level))
+            self._write_atomic(self._index_path(url), json.dumps(index).encode())
+            self._stores_since_eviction += 1
+            if self._stores_since_eviction >= self.eviction_interval:
+                self._evict()
+        return entry
+
+    def touch(self, entry: CacheEntry) -> CacheEntry:
+        """Marks a revalidated entry as fresh again."""
+        return self.store(url=entry.url, content=entry.content, headers={'ETag': entry.etag, 'Last-Modified': entry.last_modified})
+
+    def evict(self) -> int:
+        """Evicts the expired entries and the oldest entries beyond max_size_bytes, returns the number of evicted entries."""
+        with self._lock:
+            return self._evict()
+
+    def _evict(self) -> int:
+        self._stores_since_eviction = 0
+        indexes = sorted(self._read_indexes(), key=lambda item: item[1].get('stored_at', 0), reverse=True)
+        object_sizes = self._get_object_sizes()
+        expired_before = time.time() - self.max_entry_age
+        kept_digests = set()
+        size = 0
+        evicted = 0
+        for index_path, index in indexes:
+            digest = index.get('digest')
+            object_size = object_sizes.get(digest, 0) if digest not in kept_digests else 0
+            if index.get('stored_at', 0) < expired_before or size + object_size > self.max_size_bytes:
+                _remove(index_path)
+                evicted += 1
+                continue
+            kept_digests.add(digest)
+            size += object_size
+        for digest in object_sizes.keys() - kept_digests:
+            _remove(self._object_path(digest))
+        return evicted
+
+    def _read_indexes(self) -> List[Tuple[str, dict]]:
+        indexes = list()
+        for directory, _, files in os.walk(os.path.join(self.directory, 'index')):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                try:
+                    with open(path, 'r') as file:
+                        indexes.append((path, json.load(file)))
+                except (OSError, ValueError):
+                    _remove(path)
+        return indexes
+
+    def _get_object_sizes(self) -> Dict[str, int]:
+        sizes = dict()
+        for directory, _, files in os.walk(os.path.join(self.directory, 'objects')):
+            for file_name in files:
+                if file_name.endswith('.gz'):
+                    try:
+                        sizes[file_name[:-len('.gz')]] = os.path.getsize(os.path.join(directory, file_name))
+                    except OSError:
+                        pass
+        return sizes
+
+    def _index_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, 'index', key[:2], f'{key}.json')
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'objects', digest[:2], f'{digest}.gz')
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(directory={self.directory!r}, max_age={self.max_age}, max_size_bytes={self.max_size_bytes})'
+
+
+def _get_header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    """Header names are case-insensitive, but a plain dict of headers is not."""
+    name = name.lower()
+    return next((value for key, value in headers.items() if key.lower() == name and value is not None), None)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from typing import Callable, Optional, List
+
+from domain.exceptions import InvalidValueException
+
+
+class AIMDConcurrencyController:
+    """Adapts the number of in-flight requests with additive increase / multiplicative decrease (AIMD).
+
+    Every request reports its latency and status code. Once a full window of requests has been recorded, the window is
+    evaluated: if the share of failed requests (429, 5xx or no response at all) or the mean latency exceed their
+    thresholds, the window is multiplied by decrease_factor, otherwise it grows by increase_step.
+    """
+
+    def __init__(self, create_logger: Callable, initial_window: int, min_window: int = 1, max_window: int = 100,
+                 increase_step: int = 1, decrease_factor: float = 0.5, latency_threshold: float = 2.0,
+                 error_rate_threshold: float = 0.1):
+        if not 1 <= min_window <= initial_window <= max_window:
+            raise InvalidValueException(self, 'windows must satisfy 1 <= min_window <= initial_window <= max_window')
+        if not 0 < decrease_factor < 1:
+            raise InvalidValueException(self, 'decrease_factor must be between 0 and 1')
+
+        self.min_window = min_window
+        self.max_window = max_window
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self._window = initial_window
+        self._latencies: List[float] = list()
+        self._errors = 0
+        self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+
+    @property
+    def window(self) -> int:
+        return self._window
+
+    def record(self, latency: float, status: Optional[int]):
+        """Records a finished request. A status of None means that no response was received."""
+        self._latencies.append(latency)
+        if self.is_overload_signal(status):
+            self._errors += 1
+        if len(self._latencies) >= self._window:
+            self._evaluate()
+
+    @staticmethod
+    def is_overload_signal(status: Optional[int]) -> bool:
+        return status is None or status == 429 or status >= 500
+
+    def _evaluate(self):
+        sample_size = len(self._latencies)
+        error_rate = self._errors / sample_size
+        mean_latency = sum(self._latencies) / sample_size
+        previous_window = self._window
+
+        if error_rate > self.error_rate_threshold or mean_latency > self.latency_threshold:
+            self._window = max(self.min_window, int(self._window * self.decrease_factor))
+            decision = 'decrease'
+        else:
+            self._window = min(self.max_window, self._window + self.increase_step)
+            decision = 'increase'
+
+        self._latencies.clear()
+        self._errors = 0
+        self._logger.info('adjusted fetch concurrency', decision=decision, window=self._window, previous_window=previous_window,
+                          error_rate=round(error_rate, 3), mean_latency=round(mean_latency, 3), sample_size=sample_size)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(window={self._window}, min_window={self.min_window}, max_window={self.max_window})'
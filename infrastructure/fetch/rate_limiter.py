@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, AsyncGenerator
+from urllib.parse import urlparse
+
+from domain.exceptions import InvalidValueException
+
+
+class TokenBucket:
+    """Token bucket that allows `rate` acquisitions per second on average and bursts of up to `burst` acquisitions.
+
+    Waiters are served in FIFO order, because the bucket is guarded by a lock while a waiter sleeps for the next token.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0:
+            raise InvalidValueException(self, 'rate must be greater than 0')
+        if burst < 1:
+            raise InvalidValueException(self, 'burst must be at least 1')
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(rate={self.rate}, burst={self.burst})'
+
+
+class HostRateLimiter:
+    """Politeness limiter that gives every host its own request budget.
+
+    Each host gets its own token bucket (requests_per_second, burst) and its own semaphore (max_concurrent_per_host),
+    so a slow or strict host never consumes the budget of another host. A value of 0 disables the respective limit.
+    """
+
+    def __init__(self, requests_per_second: float = 0, burst: int = 1, max_concurrent_per_host: int = 0):
+        if requests_per_second < 0:
+            raise InvalidValueException(self, 'requests_per_second cannot be less than 0')
+        if max_concurrent_per_host < 0:
+            raise InvalidValueException(self, 'max_concurrent_per_host cannot be less than 0')
+
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_concurrent_per_host = max_concurrent_per_host
+        self._buckets: Dict[str, TokenBucket] = dict()
+        self._semaphores: Dict[str, asyncio.Semaphore] = dict()
+
+    @asynccontextmanager
+    async def limit(self, url: str) -> AsyncGenerator[None, None]:
+        """Waits until a request to the host of the url is allowed and holds a concurrency slot of that host meanwhile."""
+        host = self.get_host(url)
+        semaphore = self._get_semaphore(host)
+        if semaphore is None:
+            await self._acquire_token(host)
+            yield
+            return
+
+        async with semaphore:
+            await self._acquire_token(host)
+            yield
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    async def _acquire_token(self, host: str):
+        if self.requests_per_second == 0:
+            return
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(rate=self.requests_per_second, burst=self.burst)
+        await self._buckets[host].acquire()
+
+    def _get_semaphore(self, host: str) -> Optional[asyncio.Semaphore]:
+        if self.max_concurrent_per_host == 0:
+            return None
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_concurrent_per_host)
+        return self._semaphores[host]
+
+    def __repr__(self) -> str:
+        return '{c}(requests_per_second={rps}, burst={burst}, max_concurrent_per_host={concurrent}, hosts={hosts})'.format(
+            c=self.__class__.__name__,
+            rps=self.requests_per_second,
+            burst=self.burst,
+            concurrent=self.max_concurrent_per_host,
+            hosts=len(set(self._buckets) | set(self._semaphores)),
+        )
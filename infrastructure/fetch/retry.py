@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import random
+
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch.base import FetchOutcome
+
+
+class RetryPolicy:
+    """Decides if and when a failed request is retried.
+
+    Only transient outcomes (429, 5xx, timeouts and connection errors) are retried, at most max_attempts times per URL.
+    The delay between two attempts grows exponentially with full jitter, i.e. it is drawn uniformly from
+    [0, min(max_delay, base_delay * 2 ** (attempt - 1))]. The retry budget caps the number of retries of all URLs of one
+    fetch run, so a remote side that is down doesn't multiply the duration of the run by max_attempts.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30, retry_budget: int = 100):
+        if max_attempts < 1:
+            raise InvalidValueException(self, 'max_attempts must be at least 1')
+        if base_delay < 0 or max_delay < base_delay:
+            raise InvalidValueException(self, 'delays must satisfy 0 <= base_delay <= max_delay')
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self._remaining_budget = retry_budget
+
+    @property
+    def remaining_budget(self) -> int:
+        return self._remaining_budget
+
+    def reset_budget(self):
+        self._remaining_budget = self.retry_budget
+
+    def should_retry(self, outcome: FetchOutcome, attempt: int) -> bool:
+        """Returns True and consumes one retry of the budget if the attempt with the passed outcome should be retried."""
+        if not outcome.is_transient or attempt >= self.max_attempts or self._remaining_budget <= 0:
+            return False
+        self._remaining_budget -= 1
+        return True
+
+    def get_delay(self, attempt: int) -> float:
+        """Returns the jittered delay in seconds before the attempt after the passed one."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def __repr__(self) -> str:
+        return '{c}(max_attempts={max_attempts}, base_delay={base_delay}, max_delay={max_delay}, remaining_budget={budget})'.format(
+            c=self.__class__.__name__,
+            max_attempts=self.max_attempts,
+            base_delay=self.base_delay,
+            max_delay=self.max_delay,
+            budget=self._remaining_budget,
+        )
@@ -1,34 +1,115 @@
 from __future__ import annotations
 
-from typing import List
+from bisect import insort
+from collections import deque
+from typing import List, Dict, Deque, Set, Callable, Optional
+
+from domain.exceptions import InvalidValueException
+from domain.repositories.frontier import AbstractFrontierRepository, FrontierState
+
+
+def create_persistent_url_queue(repository: AbstractFrontierRepository, crawl: str, create_logger: Callable,
+                                checkpoint_interval: int = 100, max_attempts: int = 3) -> PersistentURLQueue:
+    if not isinstance(repository, AbstractFrontierRepository):
+        raise InvalidValueException(PersistentURLQueue, 'repository must be an AbstractFrontierRepository')
+    return PersistentURLQueue(repository=repository, crawl=crawl, create_logger=create_logger,
+                              checkpoint_interval=checkpoint_interval, max_attempts=max_attempts)
+
+
+def create_shared_url_queue(repository: AbstractFrontierRepository, crawl: str, worker: str, create_logger: Callable,
+                            claim_batch_size: int = 50, lease_timeout: float = 600, checkpoint_interval: int = 100,
+                            max_attempts: int = 3) -> SharedURLQueue:
+    if not isinstance(repository, AbstractFrontierRepository):
+        raise InvalidValueException(SharedURLQueue, 'repository must be an AbstractFrontierRepository')
+    return SharedURLQueue(repository=repository, crawl=crawl, worker=worker, create_logger=create_logger,
+                          claim_batch_size=claim_batch_size, lease_timeout=lease_timeout,
+                          checkpoint_interval=checkpoint_interval, max_attempts=max_attempts)
 
 
 class URLQueue:
+    """Crawl frontier of URLs that are waiting to be fetched.
+
+    Every priority has its own FIFO deque, so adding and popping a URL is O(1) (plus a lookup in the usually very short
+    list of used priorities). URLs with a higher priority are popped first, URLs with the same priority in the order they
+    were added. With deduplicate, every URL that was ever added to the queue is remembered and adding it again is a
+    no-op, so a URL that is reachable from several pages is only fetched once.
+
+    URLs may be added while the queue is consumed, e.g. URLs that are discovered on fetched pages.
+    """
 
-    def __init__(self, urls: List[str] = None):
-        self.urls = urls.copy() if urls else list()
+    def __init__(self, urls: List[str] = None, deduplicate: bool = True):
+        self.deduplicate = deduplicate
+        self._queues: Dict[int, Deque[str]] = dict()
+        self._priorities: List[int] = list()  # negated, so the highest priority comes first
+        self._seen: Set[str] = set()
+        self._length = 0
+        if urls:
+            self.add(urls)
 
-    def add(self, value: str or List[str]):
+    @property
+    def urls(self) -> List[str]:
+        """The waiting URLs in the order they will be popped."""
+        return [url for priority in self._priorities for url in self._queues[-priority]]
+
+    def add(self, value: str or List[str], priority: int = 0):
         if isinstance(value, str):
-            self.urls.append(value)
+            self._add_url(value, priority)
         elif isinstance(value, list):
             for item in value:
-                self.add(item)
+                self.add(item, priority)
         else:
             raise ValueError(f'unsupported type {type(value)} for {self}')
 
     def clear(self):
-        self.urls.clear()
+        self._queues.clear()
+        self._priorities.clear()
+        self._seen.clear()
+        self._length = 0
 
     def is_empty(self):
         return len(self) == 0
 
+    def mark_done(self, url: str):
+        """Acknowledges that the url was processed. Only persistent queues keep track of acknowledgements."""
+        pass
+
+    def mark_failed(self, url: str, error: str):
+        """Acknowledges that the url could not be processed. Only persistent queues keep track of acknowledgements."""
+        pass
+
+    def checkpoint(self):
+        """Persists the acknowledgements since the last checkpoint. Only persistent queues need to override this."""
+        pass
+
+    def complete(self):
+        """Called after every URL of the queue was processed. Only persistent queues need to override this."""
+        pass
+
+    def _add_url(self, url: str, priority: int) -> bool:
+        if self.deduplicate:
+            if url in self._seen:
+                return False
+            self._seen.add(url)
+
+        if priority not in self._queues:
+            self._queues[priority] = deque()
+            insort(self._priorities, -priority)
+        self._queues[priority].append(url)
+        self._length += 1
+        return True
+
     def __add__(self, other) -> URLQueue:
         self.add(other)
         return self
 
+    def __contains__(self, url: str) -> bool:
+        """Returns True if the url is waiting or, with deduplicate, was already popped from the queue."""
+        if self.deduplicate:
+            return url in self._seen
+        return any(url in queue for queue in self._queues.values())
+
     def __len__(self) -> int:
-        return len(self.urls)
+        return self._length
 
     def __bool__(self):
         return not self.is_empty()
@@ -37,9 +118,174 @@ class URLQueue:
         return self
 
     def __next__(self):
-        if not self.is_empty():
-            return self.urls.pop(0)
-        raise StopIteration
+        if self.is_empty():
+            raise StopIteration
+
+        priority = -self._priorities[0]
+        queue = self._queues[priority]
+        url = queue.popleft()
+        if not queue:
+            del self._queues[priority]
+            self._priorities.pop(0)
+        self._length -= 1
+        return url
 
     def __repr__(self) -> str:
         return f'URLQueue({len(self)} urls)'
+
+
+class PersistentURLQueue(URLQueue):
+    """URLQueue that is backed by the crawl frontier table, so an interrupted crawl resumes where it stopped.
+
+    Added URLs are stored right away. Processed URLs are acknowledged with mark_done and mark_failed, the acknowledgements
+    are stored in checkpoints, every checkpoint_interval acknowledgements and when the crawl is completed. On creation,
+    the pending URLs of the crawl are loaded and its finished URLs count as seen, so a restarted crawl fetches at most
+    the URLs of one checkpoint interval again. A failed URL stays pending for later runs until it failed max_attempts
+    times. Completing the crawl deletes its done URLs, so the next crawl with the same name only starts with the URLs that
+    are still pending.
+    """
+
+    def __init__(self, repository: AbstractFrontierRepository, crawl: str, create_logger: Callable,
+                 checkpoint_interval: int = 100, max_attempts: int = 3):
+        if checkpoint_interval < 1:
+            raise InvalidValueException(self, 'checkpoint_interval must be at least 1')
+        if max_attempts < 1:
+            raise InvalidValueException(self, 'max_attempts must be at least 1')
+
+        super().__init__(deduplicate=True)
+        self.crawl = crawl
+        self.checkpoint_interval = checkpoint_interval
+        self.max_attempts = max_attempts
+        self._repository = repository
+        self._unsaved_urls: Dict[int, List[str]] = dict()
+        self._done_urls: List[str] = list()
+        self._failed_urls: Dict[str, str] = dict()
+        self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+        self._load()
+
+    @property
+    def progress(self) -> Dict[FrontierState, int]:
+        """Number of URLs of the crawl per state, as of the last checkpoint."""
+        return self._repository.get_progress(self.crawl)
+
+    def add(self, value: str or List[str], priority: int = 0):
+        super().add(value, priority)
+        for unsaved_priority, urls in self._unsaved_urls.items():
+            self._repository.add_urls(self.crawl, urls, unsaved_priority)
+        self._unsaved_urls.clear()
+
+    def clear(self):
+        super().clear()
+        self._unsaved_urls.clear()
+        self._done_urls.clear()
+        self._failed_urls.clear()
+        self._repository.delete_urls(self.crawl)
+
+    def mark_done(self, url: str):
+        self._done_urls.append(url)
+        self._checkpoint_if_needed()
+
+    def mark_failed(self, url: str, error: str):
+        self._failed_urls[url] = error
+        self._checkpoint_if_needed()
+
+    def checkpoint(self):
+        if not self._done_urls and not self._failed_urls:
+            return
+        self._repository.save_checkpoint(self.crawl, done_urls=self._done_urls, failed_urls=self._failed_urls, max_attempts=self.max_attempts)
+        self._logger.info('saved crawl checkpoint', crawl=self.crawl, done=len(self._done_urls), failed=len(self._failed_urls), pending=len(self))
+        self._done_urls = list()
+        self._failed_urls = dict()
+
+    def complete(self):
+        self.checkpoint()
+        if self.is_empty():
+            self._repository.delete_urls(self.crawl, state=FrontierState.DONE)
+            self._logger.info('completed crawl', crawl=self.crawl)
+
+    def _load(self):
+        self._seen.update(self._repository.get_finished_urls(self.crawl))
+        pending_urls = self._repository.get_pending_urls(self.crawl)
+        for url, priority in pending_urls:
+            super()._add_url(url, priority)
+        if pending_urls:
+            self._logger.info('resumed crawl', crawl=self.crawl, pending=len(pending_urls), finished=len(self._seen) - len(pending_urls))
+
+    def _add_url(self, url: str, priority: int) -> bool:
+        added = super()._add_url(url, priority)
+        if added:
+            self._unsaved_urls.setdefault(priority, list()).append(url)
+        return added
+
+    def _checkpoint_if_needed(self):
+        if len(self._done_urls) + len(self._failed_urls) >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def __repr__(self) -> str:
+        return f'PersistentURLQueue(crawl={self.crawl!r}, {len(self)} urls)'
+
+
+class SharedURLQueue(PersistentURLQueue):
+    """PersistentURLQueue that several workers, in one or more processes or hosts, consume at the same time.
+
+    Added URLs only go to the crawl frontier table. Whenever the queue runs empty, the worker claims the next batch of up
+    to claim_batch_size pending URLs (with SELECT ... FOR UPDATE SKIP LOCKED, so workers never wait for each other and
+    never claim the same URL). The queue is exhausted once no URL can be claimed anymore. URLs of a worker that died are
+    claimed by another worker after lease_timeout seconds.
+
+    Every URL can carry a context, e.g. the category page it was found on, that the worker gets back with get_context.
+    """
+
+    def __init__(self, repository: AbstractFrontierRepository, crawl: str, worker: str, create_logger: Callable,
+                 claim_batch_size: int = 50, lease_timeout: float = 600, checkpoint_interval: int = 100,
+                 max_attempts: int = 3):
+        if claim_batch_size < 1:
+            raise InvalidValueException(self, 'claim_batch_size must be at least 1')
+        self.worker = worker
+        self.claim_batch_size = claim_batch_size
+        self.lease_timeout = lease_timeout
+        self._contexts: Dict[str, Optional[str]] = dict()
+        super().__init__(repository=repository, crawl=crawl, create_logger=create_logger,
+                         checkpoint_interval=checkpoint_interval, max_attempts=max_attempts)
+        self.deduplicate = False  # the frontier table deduplicates, a failed URL may be claimed again by the same worker
+
+    def add(self, value: str or List[str], priority: int = 0, context: Optional[str] = None):
+        urls = [value] if isinstance(value, str) else value
+        if not isinstance(urls, list):
+            raise ValueError(f'unsupported type {type(value)} for {self}')
+        self._repository.add_urls(self.crawl, urls, priority, context)
+
+    def get_context(self, url: str) -> Optional[str]:
+        return self._contexts.get(url)
+
+    def is_empty(self):
+        if len(self) == 0:
+            self._claim()
+        return len(self) == 0
+
+    def complete(self):
+        self.checkpoint()
+        self._logger.info('completed crawl on worker', crawl=self.crawl, worker=self.worker)
+
+    def mark_done(self, url: str):
+        self._contexts.pop(url, None)
+        super().mark_done(url)
+
+    def mark_failed(self, url: str, error: str):
+        self._contexts.pop(url, None)
+        super().mark_failed(url, error)
+
+    def _load(self):
+        pass
+
+    def _claim(self):
+        self.checkpoint()
+        claimed = self._repository.claim_urls(self.crawl, worker=self.worker, limit=self.claim_batch_size, lease_timeout=self.lease_timeout)
+        for url, context in claimed:
+            URLQueue._add_url(self, url, priority=0)  # claimed URLs are already stored
+            self._contexts[url] = context
+        if claimed:
+            self._logger.debug('claimed urls', crawl=self.crawl, worker=self.worker, count=len(claimed))
+
+    def __repr__(self) -> str:
+        return f'SharedURLQueue(crawl={self.crawl!r}, worker={self.worker!r}, {len(self)} urls)'
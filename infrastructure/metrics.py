@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Tuple, Iterator, List, Optional, Sequence, Union
+
+from domain.exceptions import InvalidValueException
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _get_label_values(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise InvalidValueException(self, f'{self.name} needs the labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format_labels(self, label_values: LabelValues, **extra_labels: str) -> str:
+        labels = list(zip(self.label_names, label_values)) + list(extra_labels.items())
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}'] + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def summary(self) -> dict:
+        raise NotImplementedError
+
+    def _format_key(self, label_values: LabelValues) -> str:
+        return ','.join(f'{name}={value}' for name, value in zip(self.label_names, label_values)) or 'total'
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(name={self.name!r}, labels={self.label_names})'
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per combination of label values, e.g. the number of fetched bytes per host."""
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = dict()
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise InvalidValueException(self, 'counters can only be increased')
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._get_label_values(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._format_labels(label_values)} {_format_value(value)}' for label_values, value in values]
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {self._format_key(label_values): value for label_values, value in sorted(self._values.items())}
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. the number of pages waiting in a queue."""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = dict()
+        self._max_values: Dict[LabelValues, float] = dict()
+
+    def set(self, value: float, **labels):
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            self._values[label_values] = value
+            self._max_values[label_values] = max(value, self._max_values.get(label_values, value))
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._get_label_values(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._format_labels(label_values)} {_format_value(value)}' for label_values, value in values]
+
+    def summary(self) -> dict:
+        """The last and the highest value per combination of label values."""
+        with self._lock:
+            return {self._format_key(label_values): dict(last=value, max=self._max_values[label_values])
+                    for label_values, value in sorted(self._values.items())}
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. latencies, in cumulative buckets per combination of label values."""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        if not buckets or list(buckets) != sorted(buckets):
+            raise InvalidValueException(self, 'buckets must be sorted and not empty')
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[LabelValues, List[int]] = dict()  # per bucket, the last one is +Inf
+        self._sums: Dict[LabelValues, float] = dict()
+        self._max_values: Dict[LabelValues, float] = dict()
+
+    def observe(self, value: float, **labels):
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            counts = self._counts.setdefault(label_values, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[label_values] = self._sums.get(label_values, 0.0) + value
+            self._max_values[label_values] = max(value, self._max_values.get(label_values, value))
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes the seconds that the with block took."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def get_count(self, **labels) -> int:
+        return sum(self._counts.get(self._get_label_values(labels), []))
+
+    def _render_samples(self) -> List[str]:
+        lines = list()
+        with self._lock:
+            items = sorted((label_values, list(counts), self._sums[label_values]) for label_values, counts in self._counts.items())
+        for label_values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._format_labels(label_values, le=_format_value(bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format_labels(label_values)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{self._format_labels(label_values)} {cumulative}')
+        return lines
+
+    def summary(self) -> dict:
+        """Count, sum, mean, max and the estimated 50th and 95th percentile (the upper bound of their bucket)."""
+        with self._lock:
+            items = sorted((label_values, list(counts), self._sums[label_values], self._max_values[label_values])
+                           for label_values, counts in self._counts.items())
+        return {self._format_key(label_values): dict(
+            count=sum(counts), sum=round(total, 4), mean=round(total / sum(counts), 4), max=round(max_value, 4),
+            p50=self._get_quantile(counts, 0.5, max_value), p95=self._get_quantile(counts, 0.95, max_value),
+        ) for label_values, counts, total, max_value in items}
+
+    def _get_quantile(self, counts: List[int], quantile: float, max_value: float) -> float:
+        rank = quantile * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, round(max_value, 4))
+        return round(max_value, 4)
+
+
+class MetricsRegistry:
+    """Metrics of a process, exported in the Prometheus text format and summarized for the log at the end of a run.
+
+    Metrics are created on first use and shared by every component that asks for the same name, so e.g. all fetchers
+    of the process count into the same counters.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = dict()
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return ''.join(line + '\n' for metric in metrics for line in metric.render())
+
+    def summary(self) -> Dict[str, dict]:
+        """The metrics as plain, loggable dicts of their name, without the metrics that were never used."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return {metric.name: summary for metric in metrics for summary in [metric.summary()] if summary}
+
+    def _get_or_create(self, metric_class: type, name: str, documentation: str, label_names: Sequence[str], **kwargs) -> Union[Counter, Gauge, Histogram]:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, label_names, **kwargs)
+        if not isinstance(metric, metric_class) or metric.label_names != tuple(label_names):
+            raise InvalidValueException(self, f'metric {name} already exists as {metric!r}')
+        return metric
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({len(self._metrics)} metrics)'
+
+
+class MetricsServer:
+    """Serves the metrics of the registry on http://host:port/metrics in a background thread, for Prometheus to scrape."""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = '0.0.0.0'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self) -> MetricsServer:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(host={self.host!r}, port={self.port})'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(float(value))
+    return repr(float(value))
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import uuid
+from typing import List
 
-from sqlalchemy import Column, String, Boolean, Integer, ForeignKey, TIMESTAMP, func, Text, Interval, Float, DateTime
+from sqlalchemy import Column, String, Boolean, Integer, ForeignKey, TIMESTAMP, func, Text, Interval, Float, DateTime, BigInteger, \
+    UniqueConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base, relationship
 
@@ -223,7 +227,12 @@ class DBIngredient(Base):
 
     @classmethod
     def from_entity(cls, ingredient: Ingredient, recipe_id: UUID):
-        return cls(
+        return cls(**cls.values_from_entity(ingredient, recipe_id))
+
+    @staticmethod
+    def values_from_entity(ingredient: Ingredient, recipe_id: UUID) -> dict:
+        """returns the column values of the ingredient as a dict, e.g. as a row of a bulk insert"""
+        return dict(
             id=ingredient.id,
             text=ingredient.text,
             fk_recipe=recipe_id,
@@ -257,15 +266,47 @@ class DBRecipe(Base):
     fk_vendor = Column(UUID(as_uuid=True), ForeignKey('vendor.id'))
     vendor = relationship("DBVendor")
     image = Column(String(200))
+    content_hash = Column(String(64))
     ingredients = relationship("DBIngredient")
 
+    __table_args__ = (Index('uq_recipe_vendor_url', 'fk_vendor', 'url', unique=True),)
+
     @classmethod
     def from_entity(cls, recipe: Recipe):
         """creates a DBRecipe instance from the entity class Recipe.
             Important: The relationship of the DBRecipe class are not parsed. They have to be added manually.
         """
         return cls(
+            **cls.values_from_entity(recipe),
+            ingredients=[DBIngredient.from_entity(ingredient, recipe.id) for ingredient in recipe.ingredients],
+        )
+
+    @classmethod
+    def values_from_entity(cls, recipe: Recipe) -> dict:
+        """returns the column values of the recipe as a dict, e.g. as a row of a bulk insert. The ingredients are not
+        included, but they are part of the content hash."""
+        values = cls.content_values_from_entity(recipe)
+        values.update(
             id=recipe.id,
+            fk_category=recipe.category.id,
+            fk_language=recipe.language.id,
+            fk_vendor=recipe.vendor.id,
+            content_hash=cls.get_content_hash(values, [ingredient.text for ingredient in recipe.ingredients]),
+        )
+        return values
+
+    @staticmethod
+    def get_content_hash(content_values: dict, ingredient_texts: List[str]) -> str:
+        """returns the SHA-256 hex digest of the normalized recipe content: its content column values and ingredient texts.
+        The foreign keys are not part of it, so e.g. a recipe that is found in another category is not changed"""
+        content = dict(content_values, ingredients=ingredient_texts)
+        normalized = json.dumps(content, sort_keys=True, default=str, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    @staticmethod
+    def content_values_from_entity(recipe: Recipe) -> dict:
+        """returns the values of the content columns of the recipe, the columns that a crawl may change"""
+        return dict(
             name=recipe.name,
             description=recipe.description,
             author=recipe.author.name,
@@ -277,10 +318,6 @@ class DBRecipe(Base):
             image=recipe.image.__str__(),
             rating_count=recipe.aggregate_rating.rating_count if recipe.aggregate_rating is not None else None,
             rating_value=recipe.aggregate_rating.rating_value if recipe.aggregate_rating is not None else None,
-            fk_category=recipe.category.id,
-            fk_language=recipe.language.id,
-            fk_vendor=recipe.vendor.id,
-            ingredients=[DBIngredient.from_entity(ingredient, recipe.id) for ingredient in recipe.ingredients],
         )
 
     def to_entity(self) -> Recipe:
@@ -349,3 +386,44 @@ class DBVendor(Base):
             language=self.language.to_entity(),
             categories=[],
         )
+
+
+class DBCrawlWatermark(Base):
+    """Publish date up to which the recipes of a category are completely crawled."""
+    __tablename__ = 'crawl_watermark'
+
+    fk_vendor = Column(UUID(as_uuid=True), ForeignKey('vendor.id'), primary_key=True, nullable=False)
+    fk_category = Column(UUID(as_uuid=True), ForeignKey('category.id'), primary_key=True, nullable=False)
+    watermark = Column(DateTime(), nullable=False)
+
+
+class DBFrontierURL(Base):
+    """URL of the crawl frontier, the id preserves the order in which the URLs were added."""
+    __tablename__ = 'crawl_frontier'
+    __table_args__ = (UniqueConstraint('crawl', 'url'),)
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    crawl = Column(String(100), nullable=False, index=True)
+    url = Column(String(200), nullable=False)
+    priority = Column(Integer, nullable=False, server_default='0')
+    state = Column(String(20), nullable=False, server_default='pending')
+    attempts = Column(Integer, nullable=False, server_default='0')
+    last_error = Column(Text)
+    context = Column(String(200))
+    claimed_by = Column(String(100))
+    date_claimed = Column(DateTime())
+    date_added = Column(DateTime(), nullable=False, server_default=func.now())
+    date_updated = Column(DateTime(), onupdate=func.now())
+
+
+class DBJobLease(Base):
+    """Lease of the current (or last) run of a scheduled job."""
+    __tablename__ = 'job_lease'
+
+    job = Column(String(100), primary_key=True)
+    run = Column(String(50), nullable=False)
+    owner = Column(String(100), nullable=False)
+    date_expires = Column(DateTime(), nullable=False)
+    date_finished = Column(DateTime())
+    attempts = Column(Integer, nullable=False, default=1)
+    date_updated = Column(DateTime(), onupdate=func.now())
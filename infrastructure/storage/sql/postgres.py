@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Callable
+from contextlib import contextmanager
+from typing import Callable, Iterator
 
 from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
@@ -60,6 +61,37 @@ class PostgresDatabase:
             self._session.add(item)
         self._session.commit()
 
+    def execute(self, *statements):
+        """Executes one or multiple statements (e.g. bulk inserts or updates) in one transaction"""
+        try:
+            for statement in statements:
+                self._session.execute(statement)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    @contextmanager
+    def transaction(self) -> Iterator[Session]:
+        """Yields the session for statements that have to run in one transaction, e.g. statements that depend on the
+        rows returned by a previous statement. Commits at the end, or rolls back on an exception."""
+        try:
+            yield self._session
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    def execute_returning(self, statement) -> list:
+        """Executes a statement that returns rows (e.g. UPDATE ... RETURNING) and commits it"""
+        try:
+            rows = self._session.execute(statement).fetchall()
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+        return rows
+
     def update(self, table: Base, filters: tuple, data: dict):
         """Updates a row in the database
         :param table: class of the table that should get altered
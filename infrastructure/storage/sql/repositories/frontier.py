@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import List, Callable, Tuple, Dict, Optional
+
+from sqlalchemy import func, case, update, delete, select, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+
+from domain.exceptions import InvalidValueException
+from domain.repositories.frontier import AbstractFrontierRepository, FrontierState
+from infrastructure.storage.sql.model import DBFrontierURL
+from infrastructure.storage.sql.postgres import PostgresDatabase
+from infrastructure.storage.sql.repositories.decorators import catch_add_data_exception, catch_no_result_found_exception, \
+    catch_update_data_exception, catch_delete_data_exception
+
+
+def create_frontier_repository(database: PostgresDatabase, create_logger: Callable) -> FrontierRepository:
+    if not isinstance(database, PostgresDatabase):
+        raise InvalidValueException(FrontierRepository, 'database must be a PostgresDatabase')
+    return FrontierRepository(database=database, create_logger=create_logger)
+
+
+class FrontierRepository(AbstractFrontierRepository):
+
+    def __init__(self, database: PostgresDatabase, create_logger: Callable):
+        self._db = database
+        self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+        self._logger.info(f'created new {self.__class__.__name__}')
+
+    @catch_add_data_exception
+    def add_urls(self, crawl: str, urls: List[str], priority: int = 0, context: Optional[str] = None):
+        if not urls:
+            return
+        self._db.execute(insert(DBFrontierURL).values([
+            dict(crawl=crawl, url=url, priority=priority, context=context) for url in urls
+        ]).on_conflict_do_nothing(index_elements=[DBFrontierURL.crawl, DBFrontierURL.url]))
+        self._logger.debug("added urls to frontier", crawl=crawl, count=len(urls), priority=priority)
+
+    @catch_update_data_exception
+    def claim_urls(self, crawl: str, worker: str, limit: int, lease_timeout: float) -> List[Tuple[str, Optional[str]]]:
+        claimable_ids = select(DBFrontierURL.id).where(
+            DBFrontierURL.crawl == crawl,
+            or_(
+                DBFrontierURL.state == FrontierState.PENDING.value,
+                and_(DBFrontierURL.state == FrontierState.IN_PROGRESS.value,
+                     DBFrontierURL.date_claimed < func.now() - timedelta(seconds=lease_timeout)),
+            ),
+        ).order_by(DBFrontierURL.priority.desc(), DBFrontierURL.id).limit(limit).with_for_update(skip_locked=True)
+
+        rows = self._db.execute_returning(update(DBFrontierURL).where(DBFrontierURL.id.in_(claimable_ids)).values(
+            state=FrontierState.IN_PROGRESS.value, claimed_by=worker, date_claimed=func.now(),
+        ).returning(DBFrontierURL.url, DBFrontierURL.context).execution_options(synchronize_session=False))
+        self._logger.debug("claimed frontier urls", crawl=crawl, worker=worker, count=len(rows))
+        return [(row.url, row.context) for row in rows]
+
+    @catch_no_result_found_exception
+    def get_pending_urls(self, crawl: str) -> List[Tuple[str, int]]:
+        rows = self._db.session.query(DBFrontierURL.url, DBFrontierURL.priority).filter(
+            DBFrontierURL.crawl == crawl, DBFrontierURL.state == FrontierState.PENDING.value,
+        ).order_by(DBFrontierURL.priority.desc(), DBFrontierURL.id).all()
+        self._logger.debug("get pending frontier urls", crawl=crawl, count=len(rows))
+        return [(row.url, row.priority) for row in rows]
+
+    @catch_no_result_found_exception
+    def get_finished_urls(self, crawl: str) -> List[str]:
+        rows = self._db.session.query(DBFrontierURL.url).filter(
+            DBFrontierURL.crawl == crawl, DBFrontierURL.state.in_([FrontierState.DONE.value, FrontierState.FAILED.value]),
+        ).all()
+        self._logger.debug("get finished frontier urls", crawl=crawl, count=len(rows))
+        return [row.url for row in rows]
+
+    @catch_update_data_exception
+    def save_checkpoint(self, crawl: str, done_urls: List[str], failed_urls: Dict[str, str], max_attempts: int):
+        statements = list()
+        if done_urls:
+            statements.append(update(DBFrontierURL).where(
+                DBFrontierURL.crawl == crawl, DBFrontierURL.url.in_(done_urls),
+            ).values(state=FrontierState.DONE.value).execution_options(synchronize_session=False))
+        for url, error in failed_urls.items():
+            statements.append(update(DBFrontierURL).where(
+                DBFrontierURL.crawl == crawl, DBFrontierURL.url == url,
+            ).values(
+                attempts=DBFrontierURL.attempts + 1,
+                last_error=error,
+                state=case(
+                    (DBFrontierURL.attempts + 1 >= max_attempts, FrontierState.FAILED.value),
+                    else_=FrontierState.PENDING.value,
+                ),
+            ).execution_options(synchronize_session=False))
+        if statements:
+            self._db.execute(*statements)
+        self._logger.debug("saved frontier checkpoint", crawl=crawl, done=len(done_urls), failed=len(failed_urls))
+
+    @catch_no_result_found_exception
+    def get_progress(self, crawl: str) -> Dict[FrontierState, int]:
+        rows = self._db.session.query(DBFrontierURL.state, func.count(DBFrontierURL.id)).filter(
+            DBFrontierURL.crawl == crawl,
+        ).group_by(DBFrontierURL.state).all()
+        progress = {state: 0 for state in FrontierState}
+        progress.update({FrontierState(state): count for state, count in rows})
+        return progress
+
+    @catch_delete_data_exception
+    def delete_urls(self, crawl: str, state: FrontierState = None):
+        statement = delete(DBFrontierURL).where(DBFrontierURL.crawl == crawl)
+        if state is not None:
+            statement = statement.where(DBFrontierURL.state == state.value)
+        self._db.execute(statement.execution_options(synchronize_session=False))
+        self._logger.debug("deleted frontier urls", crawl=crawl, state=state.value if state is not None else None)
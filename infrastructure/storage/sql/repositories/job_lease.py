@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import threading
+from datetime import timedelta
+from typing import Callable
+
+from sqlalchemy import func, update, or_, and_, case, true
+from sqlalchemy.dialects.postgresql import insert
+
+from domain.exceptions import InvalidValueException
+from domain.repositories.job_lease import AbstractJobLeaseRepository
+from infrastructure.storage.sql.model import DBJobLease
+from infrastructure.storage.sql.postgres import PostgresDatabase
+from infrastructure.storage.sql.repositories.decorators import catch_add_data_exception, catch_update_data_exception
+
+
+def create_job_lease_repository(database: PostgresDatabase, create_logger: Callable) -> JobLeaseRepository:
+    if not isinstance(database, PostgresDatabase):
+        raise InvalidValueException(JobLeaseRepository, 'database must be a PostgresDatabase')
+    return JobLeaseRepository(database=database, create_logger=create_logger)
+
+
+class JobLeaseRepository(AbstractJobLeaseRepository):
+    """The expiry of the leases is based on the clock of the database, so the clocks of the replicas don't matter. The
+    leases of concurrently running jobs are renewed from several threads, so the statements are serialized."""
+
+    def __init__(self, database: PostgresDatabase, create_logger: Callable):
+        self._db = database
+        self._lock = threading.Lock()
+        self._logger = create_logger(f'{__name__}.{self.__class__.__name__}')
+        self._logger.info(f'created new {self.__class__.__name__}')
+
+    @catch_add_data_exception
+    def acquire(self, job: str, run: str, owner: str, lease_timeout: float, max_attempts: int = None) -> bool:
+        statement = insert(DBJobLease).values(job=job, run=run, owner=owner, date_expires=func.now() + timedelta(seconds=lease_timeout), attempts=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=[DBJobLease.job],
+            set_=dict(run=statement.excluded.run, owner=statement.excluded.owner, date_expires=statement.excluded.date_expires,
+                      date_finished=None, attempts=case((DBJobLease.run == statement.excluded.run, DBJobLease.attempts + 1), else_=1),
+                      date_updated=func.now()),
+            where=and_(
+                DBJobLease.date_expires < func.now(),
+                or_(DBJobLease.run < statement.excluded.run, and_(
+                    DBJobLease.run == statement.excluded.run, DBJobLease.date_finished.is_(None),
+                    DBJobLease.attempts < max_attempts if max_attempts is not None else true(),
+                )),
+            ),
+        ).returning(DBJobLease.job)
+        with self._lock:
+            acquired = len(self._db.execute_returning(statement)) > 0
+        self._logger.debug("acquired job lease" if acquired else "job lease is taken", job=job, run=run, owner=owner)
+        return acquired
+
+    @catch_update_data_exception
+    def renew(self, job: str, owner: str, lease_timeout: float) -> bool:
+        statement = update(DBJobLease).where(
+            DBJobLease.job == job, DBJobLease.owner == owner, DBJobLease.date_finished.is_(None),
+        ).values(date_expires=func.now() + timedelta(seconds=lease_timeout)).returning(DBJobLease.job).execution_options(synchronize_session=False)
+        with self._lock:
+            renewed = len(self._db.execute_returning(statement)) > 0
+        self._logger.debug("renewed job lease" if renewed else "lost job lease", job=job, owner=owner)
+        return renewed
+
+    @catch_update_data_exception
+    def release(self, job: str, owner: str, finished: bool = True):
+        statement = update(DBJobLease).where(DBJobLease.job == job, DBJobLease.owner == owner).values(
+            date_expires=func.now(), date_finished=func.now() if finished else None,
+        ).execution_options(synchronize_session=False)
+        with self._lock:
+            self._db.execute(statement)
+        self._logger.debug("released job lease", job=job, owner=owner, finished=finished)
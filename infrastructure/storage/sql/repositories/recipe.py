@@ -1,13 +1,19 @@
 from __future__ import annotations
 
-from typing import List, Callable
+from typing import List, Callable, Iterator, Dict, Tuple
 from uuid import UUID
 
+from more_itertools import chunked
+from sqlalchemy import insert as core_insert, update, delete
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.dialects.postgresql import insert, Insert
+
 from domain.exceptions import InvalidValueException
 from domain.model.recipe_aggregate import Recipe
 from domain.model.user_aggregate import User
-from domain.repositories.recipe import AbstractRecipeRepository
-from infrastructure.storage.sql.model import DBRecipe, DBUser
+from domain.model.vendor_aggregate import Vendor
+from domain.repositories.recipe import AbstractRecipeRepository, RecipeWriteCounts
+from infrastructure.storage.sql.model import DBRecipe, DBUser, DBIngredient
 from infrastructure.storage.sql.postgres import PostgresDatabase
 from infrastructure.storage.sql.repositories.decorators import catch_no_result_found_exception, \
     catch_add_data_exception, catch_update_data_exception, catch_delete_data_exception
@@ -72,11 +78,110 @@ class RecipeRepository(AbstractRecipeRepository):
                            count_recipes=len(recipes))
         return recipes
 
+    @catch_no_result_found_exception
+    def get_urls_by_vendor(self, vendor: Vendor) -> Iterator[str]:
+        rows = self._db.session.query(DBRecipe.url).filter(DBRecipe.fk_vendor == vendor.id).yield_per(10000)
+        self._logger.debug("get recipe urls for vendor", vendor_id=vendor.id.__str__())
+        return (row.url for row in rows)
+
+    @catch_no_result_found_exception
+    def count_by_vendor(self, vendor: Vendor) -> int:
+        count = self._db.session.query(DBRecipe.id).filter(DBRecipe.fk_vendor == vendor.id).count()
+        self._logger.debug("count recipes for vendor", vendor_id=vendor.id.__str__(), count=count)
+        return count
+
     @catch_add_data_exception
     def add(self, entity: Recipe):
         self._db.add(DBRecipe.from_entity(entity))
         self._logger.debug("added recipe to database", recipe_id=entity.id.__str__())
 
+    @catch_add_data_exception
+    def add_many(self, entities: List[Recipe], chunk_size: int = 1000) -> RecipeWriteCounts:
+        """Writes the recipes keyed on their vendor and url, so crawling a recipe again doesn't create a duplicate.
+
+        The content hash of every recipe is compared with the stored one first. Unchanged recipes are not written at
+        all, new recipes are inserted with their ingredients (with ON CONFLICT DO NOTHING, in case a concurrent worker
+        inserted the same recipe), and of changed recipes only the changed columns are updated. Their ingredients are
+        only replaced if they changed. Every chunk of recipes is written in one transaction.
+        """
+        counts = RecipeWriteCounts()
+        for chunk in chunked(self._deduplicate(entities), chunk_size):
+            with self._db.transaction() as session:
+                counts += self._write_chunk(session, chunk)
+        self._logger.debug("added recipes to database", count=len(entities), **counts.as_dict())
+        return counts
+
+    def _write_chunk(self, session: Session, recipes: List[Recipe]) -> RecipeWriteCounts:
+        values = {(recipe.vendor.id, recipe.url.__str__()): DBRecipe.values_from_entity(recipe) for recipe in recipes}
+        stored_hashes = {(row.fk_vendor, row.url): (row.id, row.content_hash) for row in session.query(
+            DBRecipe.id, DBRecipe.fk_vendor, DBRecipe.url, DBRecipe.content_hash,
+        ).filter(
+            DBRecipe.fk_vendor.in_({vendor_id for vendor_id, _ in values}), DBRecipe.url.in_({url for _, url in values}),
+        )}
+
+        new_recipes, changed_recipes = list(), dict()
+        for recipe in recipes:
+            key = (recipe.vendor.id, recipe.url.__str__())
+            if key not in stored_hashes:
+                new_recipes.append(recipe)
+            elif stored_hashes[key][1] != values[key]['content_hash']:
+                changed_recipes[stored_hashes[key][0]] = recipe
+
+        inserted = self._insert_recipes(session, new_recipes, values)
+        self._update_recipes(session, changed_recipes, values)
+        return RecipeWriteCounts(inserted=inserted, updated=len(changed_recipes),
+                                 unchanged=len(recipes) - inserted - len(changed_recipes))
+
+    @staticmethod
+    def _insert_recipes(session: Session, recipes: List[Recipe], values: Dict[Tuple[UUID, str], dict]) -> int:
+        if not recipes:
+            return 0
+        inserted_ids = {row.id for row in session.execute(RecipeRepository._get_insert_statement([
+            values[(recipe.vendor.id, recipe.url.__str__())] for recipe in recipes
+        ]))}
+        ingredient_rows = [DBIngredient.values_from_entity(ingredient, recipe.id)
+                           for recipe in recipes if recipe.id in inserted_ids for ingredient in recipe.ingredients]
+        if ingredient_rows:
+            session.execute(core_insert(DBIngredient), ingredient_rows)
+        return len(inserted_ids)
+
+    @staticmethod
+    def _get_insert_statement(rows: List[dict]) -> Insert:
+        """INSERT ... ON CONFLICT (fk_vendor, url) DO NOTHING RETURNING id, the conflict target is the uq_recipe_vendor_url index."""
+        return insert(DBRecipe).values(rows).on_conflict_do_nothing(index_elements=[DBRecipe.fk_vendor, DBRecipe.url]).returning(DBRecipe.id)
+
+    @staticmethod
+    def _update_recipes(session: Session, recipes: Dict[UUID, Recipe], values: Dict[Tuple[UUID, str], dict]):
+        """Updates the changed content columns and ingredients of the stored recipes (stored id -> crawled recipe). The
+        foreign keys are kept, so a recipe stays in the category it was first stored with."""
+        if not recipes:
+            return
+        stored_recipes: List[DBRecipe] = session.query(DBRecipe).options(selectinload(DBRecipe.ingredients)).filter(
+            DBRecipe.id.in_(list(recipes)),
+        ).all()
+        for stored_recipe in stored_recipes:
+            recipe = recipes[stored_recipe.id]
+            recipe_values = values[(recipe.vendor.id, recipe.url.__str__())]
+            content_columns = DBRecipe.content_values_from_entity(recipe).keys() | {'content_hash'}
+            changed_values = {column: value for column, value in recipe_values.items()
+                              if column in content_columns and getattr(stored_recipe, column) != value}
+            session.execute(update(DBRecipe).where(DBRecipe.id == stored_recipe.id).values(changed_values)
+                            .execution_options(synchronize_session=False))
+
+            ingredient_texts = [ingredient.text for ingredient in recipe.ingredients]
+            if sorted(ingredient.text for ingredient in stored_recipe.ingredients) != sorted(ingredient_texts):
+                session.execute(delete(DBIngredient).where(DBIngredient.fk_recipe == stored_recipe.id)
+                                .execution_options(synchronize_session=False))
+                if ingredient_texts:
+                    session.execute(core_insert(DBIngredient), [
+                        DBIngredient.values_from_entity(ingredient, stored_recipe.id) for ingredient in recipe.ingredients
+                    ])
+
+    @staticmethod
+    def _deduplicate(recipes: List[Recipe]) -> List[Recipe]:
+        """Keeps the last recipe of every vendor and url, so a chunk never writes the same row twice."""
+        return list({(recipe.vendor.id, recipe.url.__str__()): recipe for recipe in recipes}.values())
+
     @catch_update_data_exception
     def update(self, entity: Recipe):
         self._db.update(table=DBRecipe, filters=(DBRecipe.id == entity.id,), data={
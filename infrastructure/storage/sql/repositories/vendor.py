@@ -1,13 +1,17 @@
 from __future__ import annotations
 
-from typing import List, Callable
+from datetime import datetime
+from typing import List, Callable, Dict
 from uuid import UUID
 
+from sqlalchemy import update, func
+from sqlalchemy.dialects.postgresql import insert
+
 from domain.exceptions import InvalidValueException
 from domain.model.recipe_aggregate import Recipe
 from domain.model.vendor_aggregate import Vendor
 from domain.repositories.vendor import AbstractVendorRepository
-from infrastructure.storage.sql.model import DBVendor, DBRecipe
+from infrastructure.storage.sql.model import DBVendor, DBRecipe, DBCrawlWatermark
 from infrastructure.storage.sql.postgres import PostgresDatabase
 from infrastructure.storage.sql.repositories.decorators import catch_add_data_exception, \
     catch_no_result_found_exception, catch_update_data_exception, catch_delete_data_exception
@@ -73,6 +77,30 @@ class VendorRepository(AbstractVendorRepository):
         })
         self._logger.debug("updated vendor", vendor_id=entity.id.__str__())
 
+    @catch_no_result_found_exception
+    def get_crawl_watermarks(self, vendor: Vendor) -> Dict[UUID, datetime]:
+        db_watermarks: List[DBCrawlWatermark] = self._db.session.query(DBCrawlWatermark).filter(DBCrawlWatermark.fk_vendor == vendor.id).all()
+        self._logger.debug("get crawl watermarks for vendor", vendor_id=vendor.id.__str__(), count=len(db_watermarks))
+        return {db_watermark.fk_category: db_watermark.watermark for db_watermark in db_watermarks}
+
+    @catch_update_data_exception
+    def advance_crawl_watermarks(self, vendor: Vendor, watermarks: Dict[UUID, datetime], date_last_crawled: datetime):
+        statements = list()
+        if watermarks:
+            insert_statement = insert(DBCrawlWatermark).values([
+                dict(fk_vendor=vendor.id, fk_category=category_id, watermark=watermark) for category_id, watermark in watermarks.items()
+            ])
+            statements.append(insert_statement.on_conflict_do_update(
+                index_elements=[DBCrawlWatermark.fk_vendor, DBCrawlWatermark.fk_category],
+                set_=dict(watermark=func.greatest(DBCrawlWatermark.watermark, insert_statement.excluded.watermark)),
+            ))
+        statements.append(update(DBVendor).where(DBVendor.id == vendor.id).values(
+            date_last_crawled=date_last_crawled,
+        ).execution_options(synchronize_session=False))
+        self._db.execute(*statements)
+        vendor.date_last_crawled = date_last_crawled
+        self._logger.debug("advanced crawl watermarks", vendor_id=vendor.id.__str__(), count=len(watermarks))
+
     @catch_delete_data_exception
     def delete(self, entity: Vendor):
         self._db.delete(table=DBVendor, filters=(DBVendor.id == entity.id,))
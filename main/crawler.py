@@ -1,25 +1,36 @@
-from datetime import datetime
+import argparse
+import os
+import socket
+import time
+from datetime import datetime, date, timedelta
+from multiprocessing import Process
 from typing import Callable, List, Generic, TypeVar
 from uuid import uuid4
 
 from application.api.services.vendor import create_vendor_service
 from application.crawler import AbstractBaseCrawler
 from application.crawler import ChefkochCrawler
+from application.crawler import ScrapePool
 from domain.model.language_aggregate import create_language
 from domain.model.recipe_aggregate import Recipe
-from domain.model.vendor_aggregate import Vendor, create_vendor
+from domain.model.vendor_aggregate import create_vendor
 from infrastructure.adapters.scheduler import BlockingSchedulerAdapter
-from infrastructure.config import create_new_config
-from infrastructure.fetch import AsyncFetcher
+from infrastructure.config import create_new_config, CrawlerConfig, AppConfig
+from infrastructure.fetch import create_async_fetcher, create_persistent_url_queue, URLQueue, create_shared_url_queue, SharedURLQueue
 from infrastructure.log import Logger
-from infrastructure.storage.sql.postgres import create_postgres_database
+from infrastructure.metrics import MetricsRegistry, MetricsServer
+from infrastructure.storage.sql.postgres import create_postgres_database, PostgresDatabase
 from infrastructure.storage.sql.repositories.category import create_category_repository
+from infrastructure.storage.sql.repositories.frontier import create_frontier_repository, FrontierRepository
+from infrastructure.storage.sql.repositories.job_lease import create_job_lease_repository
 from infrastructure.storage.sql.repositories.language import create_language_repository
 from infrastructure.storage.sql.repositories.recipe import create_recipe_repository
 from infrastructure.storage.sql.repositories.vendor import create_vendor_repository
 
 CrawlerClass = TypeVar('CrawlerClass')
 
+metrics = MetricsRegistry()  # shared by the fetchers and crawlers of the process
+
 
 def initial_crawler_setup():
     config = create_new_config()
@@ -43,41 +54,62 @@ def initial_crawler_setup():
     logger.info('crawler setup completed')
 
 
+def get_create_url_queue(config: CrawlerConfig, frontier_repository: FrontierRepository) -> Callable[[str], URLQueue]:
+    def create_url_queue(crawl: str) -> URLQueue:
+        return create_persistent_url_queue(frontier_repository, crawl=crawl, create_logger=Logger.create,
+                                           checkpoint_interval=config.frontier_checkpoint_interval,
+                                           max_attempts=config.frontier_max_attempts)
+
+    return create_url_queue
+
+
+def get_shared_recipe_queue(config: CrawlerConfig, frontier_repository: FrontierRepository, vendor_name: str) -> SharedURLQueue:
+    return create_shared_url_queue(frontier_repository, crawl=f'{vendor_name}.queued_recipes', worker=f'{socket.gethostname()}-{os.getpid()}',
+                                   create_logger=Logger.create, claim_batch_size=config.frontier_claim_batch_size,
+                                   lease_timeout=config.frontier_lease_timeout,
+                                   checkpoint_interval=config.frontier_checkpoint_interval,
+                                   max_attempts=config.frontier_max_attempts)
+
+
 def crawl_all_sources_loop():
     config = create_new_config()
-    fetcher = AsyncFetcher(batch_size=config.crawler.fetch_batch_size)
 
     db = create_postgres_database(config.database, Logger.create)
-
-    category_repository = create_category_repository(db, Logger.create)
-    recipe_repository = create_recipe_repository(db, Logger.create)
-    vendor_repository = create_vendor_repository(db, Logger.create)
-
-    vendor_service = create_vendor_service(vendor_repo=vendor_repository)
+    vendor_service = create_vendor_service(vendor_repo=create_vendor_repository(db, Logger.create))
     if len(vendor_service.get_all()) == 0:
         initial_crawler_setup()
 
-    def create_crawl_new_recipes_job(crawler_class: type(AbstractBaseCrawler), vendor: Vendor) -> Callable:
-        def job():
-            crawler = crawler_class(vendor=vendor, fetcher=fetcher, create_logger=Logger.create,
-                                    recipe_repository=recipe_repository,
-                                    category_repository=category_repository)
-            return crawler.crawl_new_recipes(store_recipes=True)
+    def create_crawl_new_recipes_job(crawler_class: type(AbstractBaseCrawler), vendor_name: str) -> Callable:
+        vendor_db = create_postgres_database(config.database, Logger.create)  # the jobs of the vendors run concurrently, each with its own session
+
+        def job(is_cancelled: Callable[[], bool]):
+            with get_crawler(crawler_class, vendor_name=vendor_name, with_category_repository=True, with_recipe_repository=True,
+                             database=vendor_db, config=config) as crawler:
+                recipes = crawler.iter_new_recipes(store_recipes=True)
+                try:
+                    for _ in recipes:
+                        if is_cancelled():  # the run was taken over by another scheduler
+                            return
+                finally:
+                    recipes.close()  # stops the crawl before the crawler is closed
 
         return job
 
-    scheduler = BlockingSchedulerAdapter(create_logger=Logger.create)
-    scheduler.add_daily_jobs(jobs=[
-        create_crawl_new_recipes_job(crawler_class=ChefkochCrawler, vendor=vendor_repository.get_by_name('Chefkoch')),
-    ])
+    scheduler = BlockingSchedulerAdapter(create_logger=Logger.create, max_workers=config.crawler.scheduler_max_workers,
+                                         misfire_grace_time=config.crawler.scheduler_misfire_grace_time,
+                                         lease_repository=create_job_lease_repository(db, Logger.create), owner=f'{socket.gethostname()}-{os.getpid()}',
+                                         lease_timeout=config.crawler.scheduler_lease_timeout, max_attempts=config.crawler.scheduler_max_attempts)
+    scheduler.add_daily_jobs(jobs={
+        'crawl_new_recipes.Chefkoch': create_crawl_new_recipes_job(crawler_class=ChefkochCrawler, vendor_name='Chefkoch'),
+    }, hour=config.crawler.scheduler_hour)
     scheduler.start()
 
 
 def get_crawler(crawler_class: type(Generic[CrawlerClass]), vendor_name: str, with_category_repository: bool = False,
-                with_recipe_repository: bool = False) -> CrawlerClass:
-    config = create_new_config()
-    fetcher = AsyncFetcher(batch_size=config.crawler.fetch_batch_size)
-    db = create_postgres_database(config.database, Logger.create)
+                with_recipe_repository: bool = False, database: PostgresDatabase = None, config: AppConfig = None) -> CrawlerClass:
+    config = config if config is not None else create_new_config()
+    fetcher = create_async_fetcher(config.crawler, Logger.create, metrics=metrics)
+    db = database if database is not None else create_postgres_database(config.database, Logger.create)
     vendor_repository = create_vendor_repository(db, Logger.create)
     return crawler_class(
         vendor=vendor_repository.get_by_name(vendor_name=vendor_name),
@@ -85,13 +117,112 @@ def get_crawler(crawler_class: type(Generic[CrawlerClass]), vendor_name: str, wi
         category_repository=create_category_repository(db, Logger.create) if with_category_repository else None,
         recipe_repository=create_recipe_repository(db, Logger.create) if with_recipe_repository else None,
         vendor_repository=create_vendor_repository(db, Logger.create),
+        scrape_pool=ScrapePool(workers=config.crawler.scrape_workers),
+        create_url_queue=get_create_url_queue(config.crawler, create_frontier_repository(db, Logger.create)),
+        known_urls_bloom_filter_threshold=config.crawler.known_urls_bloom_filter_threshold,
+        store_batch_size=config.crawler.store_batch_size,
+        pipeline_queue_size=config.crawler.pipeline_queue_size,
+        pipeline_max_buffered_bytes=config.crawler.pipeline_max_buffered_mb * 1024 * 1024,
+        metrics=metrics,
+        max_overview_pages=config.crawler.overview_max_pages,
     )
 
 
 def crawl_chefkoch_recipes(store_recipes: bool = False) -> List[Recipe]:  # for local development and testing
-    crawler = get_crawler(ChefkochCrawler, vendor_name='Chefkoch', with_recipe_repository=True)
-    return crawler.crawl_new_recipes(store_recipes=store_recipes)
+    with get_crawler(ChefkochCrawler, vendor_name='Chefkoch', with_recipe_repository=True) as crawler:
+        return crawler.crawl_new_recipes(store_recipes=store_recipes)
+
+
+def enqueue_chefkoch_recipes() -> int:
+    """Adds the new recipes to the shared queue that the crawler workers consume."""
+    config = create_new_config()
+    db = create_postgres_database(config.database, Logger.create)
+    queue = get_shared_recipe_queue(config.crawler, create_frontier_repository(db, Logger.create), vendor_name='Chefkoch')
+    with get_crawler(ChefkochCrawler, vendor_name='Chefkoch', with_category_repository=True, database=db) as crawler:
+        return crawler.enqueue_new_recipes(queue)
+
+
+def run_chefkoch_worker(wait: bool = False):
+    """Crawls the recipes of the shared queue until it is empty, or forever if wait is True."""
+    config = create_new_config()
+    db = create_postgres_database(config.database, Logger.create)
+    queue = get_shared_recipe_queue(config.crawler, create_frontier_repository(db, Logger.create), vendor_name='Chefkoch')
+    with get_crawler(ChefkochCrawler, vendor_name='Chefkoch', with_recipe_repository=True, database=db) as crawler:
+        while True:
+            for _ in crawler.iter_queued_recipes(queue, store_recipes=True):
+                pass
+            if not wait:
+                return
+            time.sleep(config.crawler.frontier_poll_interval)
+
+
+def run_chefkoch_workers(processes: int, wait: bool = False):
+    """Runs independent worker processes, each with its own database connection, fetcher and scrape pool. A single
+    worker runs in the current process."""
+    if processes == 1:
+        run_chefkoch_worker(wait=wait)
+        return
+    workers = [Process(target=run_chefkoch_worker, kwargs=dict(wait=wait), name=f'crawler-worker-{index}') for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def backfill_chefkoch_recipes(published_from: date = None, published_until: date = None, concurrency: int = None,
+                              requests_per_second: float = None, max_pages: int = None, progress_interval: int = 1000):
+    """Crawls and stores all recipes that were published from published_from until (including) published_until.
+
+    concurrency and requests_per_second override the fetch batch size and the rate limit of the crawler config. The
+    adaptive concurrency never exceeds concurrency either."""
+    config = create_new_config()
+    if concurrency is not None:
+        config.crawler.fetch_batch_size = concurrency
+        config.crawler.adaptive_concurrency_max_window = concurrency
+        config.crawler.adaptive_concurrency_min_window = min(config.crawler.adaptive_concurrency_min_window, concurrency)
+    if requests_per_second is not None:
+        config.crawler.rate_limit_requests_per_second = requests_per_second
+    with get_crawler(ChefkochCrawler, vendor_name='Chefkoch', with_category_repository=True, with_recipe_repository=True, config=config) as crawler:
+        return crawler.backfill_recipes(
+            published_from=datetime.combine(published_from, datetime.min.time()) if published_from is not None else None,
+            published_until=datetime.combine(published_until + timedelta(days=1), datetime.min.time()) if published_until is not None else None,
+            store_recipes=True, max_overview_pages=max_pages, progress_interval=progress_interval,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python3 -m main.crawler', description='swipe-food recipe crawler')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('loop', help='crawl the new recipes of all sources once a day (default)')
+    commands.add_parser('enqueue', help='add the new recipes to the shared queue of the crawler workers')
+    worker_parser = commands.add_parser('worker', help='crawl the recipes of the shared queue')
+    worker_parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    worker_parser.add_argument('--wait', action='store_true', help='wait for new recipes instead of exiting when the queue is empty')
+    backfill_parser = commands.add_parser('backfill', help='crawl and store the back catalog of recipes')
+    backfill_parser.add_argument('--from', dest='published_from', type=date.fromisoformat, help='first publish day (YYYY-MM-DD)')
+    backfill_parser.add_argument('--until', dest='published_until', type=date.fromisoformat, help='last publish day (YYYY-MM-DD)')
+    backfill_parser.add_argument('--concurrency', type=int, help='number of concurrent requests (default: SF_CRAWLER_FETCH_BATCH_SIZE)')
+    backfill_parser.add_argument('--rate-limit', dest='requests_per_second', type=float,
+                                 help='requests per second per host (default: SF_CRAWLER_RATE_LIMIT_REQUESTS_PER_SECOND)')
+    backfill_parser.add_argument('--max-pages', type=int, help='maximum number of overview pages per category (default: all)')
+    backfill_parser.add_argument('--progress-interval', type=int, default=1000, help='log the progress every n crawled recipes')
+    arguments = parser.parse_args()
+
+    config = create_new_config()
+    if config.crawler.metrics_port > 0 and not (arguments.command == 'worker' and arguments.processes > 1):
+        MetricsServer(metrics, port=config.crawler.metrics_port).start()  # worker processes only log their metrics summary
+
+    if arguments.command == 'enqueue':
+        enqueue_chefkoch_recipes()
+    elif arguments.command == 'backfill':
+        backfill_chefkoch_recipes(published_from=arguments.published_from, published_until=arguments.published_until,
+                                  concurrency=arguments.concurrency, requests_per_second=arguments.requests_per_second,
+                                  max_pages=arguments.max_pages, progress_interval=arguments.progress_interval)
+    elif arguments.command == 'worker':
+        run_chefkoch_workers(processes=arguments.processes, wait=arguments.wait)
+    else:
+        crawl_all_sources_loop()
 
 
 if __name__ == '__main__':
-    crawl_all_sources_loop()
+    main()
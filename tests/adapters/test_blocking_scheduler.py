@@ -0,0 +1,46 @@
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from domain.exceptions import InvalidValueException
+from domain.repositories.job_lease import AbstractJobLeaseRepository
+from infrastructure.adapters.scheduler import BlockingSchedulerAdapter
+from infrastructure.log import Logger
+
+
+class TestBlockingSchedulerAdapter:
+
+    @staticmethod
+    @pytest.fixture
+    def scheduler() -> BlockingSchedulerAdapter:
+        return BlockingSchedulerAdapter(create_logger=Logger.create, max_workers=3, misfire_grace_time=60)
+
+    def test_add_daily_jobs(self, scheduler: BlockingSchedulerAdapter):
+        scheduler.add_daily_jobs(jobs={'crawl.a': lambda is_cancelled: None, 'crawl.b': lambda is_cancelled: None}, hour=3)
+
+        jobs = scheduler._scheduler.get_jobs()
+        assert [job.id for job in jobs] == ['crawl.a', 'crawl.b']
+        for job in jobs:
+            assert isinstance(job.trigger, CronTrigger)
+            assert str(job.trigger.fields[job.trigger.FIELD_NAMES.index('hour')]) == '3'
+
+    def test_add_daily_jobs_with_retries(self):
+        scheduler = BlockingSchedulerAdapter(create_logger=Logger.create, lease_repository=MagicMock(spec=AbstractJobLeaseRepository),
+                                             owner='replica-0', lease_timeout=120)
+        scheduler.add_daily_jobs(jobs={'crawl.a': lambda is_cancelled: None}, hour=3)
+
+        jobs = {job.id: job for job in scheduler._scheduler.get_jobs()}
+        assert list(jobs) == ['crawl.a', 'crawl.a.retry']
+        assert isinstance(jobs['crawl.a.retry'].trigger, IntervalTrigger)
+        assert jobs['crawl.a.retry'].trigger.interval == timedelta(seconds=120)
+
+    def test_job_defaults(self, scheduler: BlockingSchedulerAdapter):
+        assert scheduler._scheduler._job_defaults == dict(coalesce=True, max_instances=1, misfire_grace_time=60)
+        assert scheduler._scheduler._lookup_executor('default')._pool._max_workers == 3
+
+    def test_invalid_scheduler(self):
+        with pytest.raises(InvalidValueException):
+            BlockingSchedulerAdapter(create_logger=Logger.create, max_workers=0)
@@ -0,0 +1,229 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+
+from domain.exceptions import InvalidValueException
+from domain.repositories.job_lease import AbstractJobLeaseRepository
+from infrastructure.adapters.scheduler import BlockingSchedulerAdapter, JobLease
+from infrastructure.config import create_new_config
+from infrastructure.log import Logger
+from infrastructure.storage.sql.postgres import create_postgres_database
+from infrastructure.storage.sql.repositories.job_lease import create_job_lease_repository
+
+
+class TestJobLease:
+
+    class JobLeaseRepositoryMock(AbstractJobLeaseRepository):
+        """In-memory lease table with the semantics of the SQL repository, shared by all schedulers of a test."""
+
+        def __init__(self):
+            self.leases: Dict[str, dict] = dict()
+            self._lock = threading.Lock()
+
+        def acquire(self, job: str, run: str, owner: str, lease_timeout: float, max_attempts: int = None) -> bool:
+            with self._lock:
+                lease: Optional[dict] = self.leases.get(job)
+                attempts = lease['attempts'] if lease is not None and lease['run'] == run else 0
+                if lease is not None and (lease['expires'] >= time.monotonic() or lease['run'] > run or (lease['run'] == run and lease['finished'])):
+                    return False
+                if max_attempts is not None and attempts >= max_attempts:
+                    return False
+                self.leases[job] = dict(run=run, owner=owner, expires=time.monotonic() + lease_timeout, finished=False, attempts=attempts + 1)
+                return True
+
+        def renew(self, job: str, owner: str, lease_timeout: float) -> bool:
+            with self._lock:
+                lease = self.leases.get(job)
+                if lease is None or lease['owner'] != owner or lease['finished']:
+                    return False
+                lease['expires'] = time.monotonic() + lease_timeout
+                return True
+
+        def release(self, job: str, owner: str, finished: bool = True):
+            with self._lock:
+                lease = self.leases.get(job)
+                if lease is not None and lease['owner'] == owner:
+                    lease.update(expires=time.monotonic(), finished=finished)
+
+    @staticmethod
+    @pytest.fixture
+    def repository() -> JobLeaseRepositoryMock:
+        return TestJobLease.JobLeaseRepositoryMock()
+
+    @staticmethod
+    def create_scheduler(repository: AbstractJobLeaseRepository, owner: str, lease_timeout: float = 300, max_attempts: int = 3) -> BlockingSchedulerAdapter:
+        return BlockingSchedulerAdapter(create_logger=Logger.create, lease_repository=repository, owner=owner, lease_timeout=lease_timeout,
+                                        max_attempts=max_attempts)
+
+    @staticmethod
+    def freeze_time(now: datetime):
+        """Patches the clock of the scheduler, now is the local time in the timezone of the scheduler."""
+
+        class FrozenDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return now.replace(tzinfo=tz)
+
+        return patch('infrastructure.adapters.scheduler.blocking_scheduler.datetime', FrozenDatetime)
+
+    def test_one_replica_runs_the_job(self, repository: JobLeaseRepositoryMock):
+        runs = list()
+        started = threading.Barrier(3)
+
+        def job(is_cancelled):
+            runs.append(threading.current_thread().name)
+            time.sleep(0.1)
+
+        replicas = [self.create_scheduler(repository, owner=f'replica-{index}')._with_lease('crawl.a', job) for index in range(3)]
+
+        def run_replica(leased_job):
+            started.wait()
+            leased_job()
+
+        threads = [threading.Thread(target=run_replica, args=(leased_job,), name=f'replica-{index}') for index, leased_job in enumerate(replicas)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(runs) == 1
+        assert repository.leases['crawl.a']['finished'] is True
+
+        for leased_job in replicas:  # the run of today is finished, even for replicas that are late
+            leased_job()
+        assert len(runs) == 1
+
+    def test_failed_run_is_taken_over(self, repository: JobLeaseRepositoryMock):
+        def failing_job(is_cancelled):
+            raise ValueError('crawl failed')
+
+        with pytest.raises(ValueError):
+            self.create_scheduler(repository, owner='replica-0')._with_lease('crawl.a', failing_job)()
+        assert repository.leases['crawl.a']['finished'] is False
+
+        runs = list()
+        self.create_scheduler(repository, owner='replica-1')._with_lease('crawl.a', lambda is_cancelled: runs.append('replica-1'))()
+        assert runs == ['replica-1']
+
+    def test_failed_run_is_retried(self, repository: JobLeaseRepositoryMock):
+        runs = list()
+        retry = self.create_scheduler(repository, owner='replica-0')._with_lease('crawl.a', lambda is_cancelled: runs.append('retry'), retry_after_hour=3)
+
+        with self.freeze_time(datetime(2021, 1, 1, 23, 30)):
+            retry()  # the run of the day wasn't finished yet
+            retry()
+        assert runs == ['retry']
+        assert repository.leases['crawl.a']['run'] == '2021-01-01'  # the local date, the one the hour of the job is in
+
+    @pytest.mark.parametrize('hour, now', [(3, datetime(2021, 1, 1, 2, 59)), (3, datetime(2021, 1, 1, 3, 4)), (0, datetime(2021, 1, 1, 0, 4))])
+    def test_retry_waits_for_the_daily_job(self, repository: JobLeaseRepositoryMock, hour: int, now: datetime):
+        runs = list()
+        retry = self.create_scheduler(repository, owner='replica-0')._with_lease('crawl.a', lambda is_cancelled: runs.append('retry'), retry_after_hour=hour)
+
+        with self.freeze_time(now):
+            retry()
+        assert runs == []
+        assert 'crawl.a' not in repository.leases
+
+    def test_run_is_given_up_after_max_attempts(self, repository: JobLeaseRepositoryMock):
+        runs = list()
+
+        def failing_job(is_cancelled):
+            runs.append(len(runs))
+            raise ValueError('crawl failed')
+
+        for owner in ('replica-0', 'replica-1'):
+            with pytest.raises(ValueError):
+                self.create_scheduler(repository, owner=owner, max_attempts=2)._with_lease('crawl.a', failing_job)()
+        self.create_scheduler(repository, owner='replica-2', max_attempts=2)._with_lease('crawl.a', failing_job)()
+
+        assert runs == [0, 1]
+        assert repository.leases['crawl.a']['attempts'] == 2
+
+    def test_job_stops_on_lost_lease(self, repository: JobLeaseRepositoryMock):
+        checks = list()
+
+        def job(is_cancelled):
+            repository.leases['crawl.a']['owner'] = 'replica-1'  # the lease expired and was taken over
+            deadline = time.monotonic() + 5
+            while not is_cancelled() and time.monotonic() < deadline:
+                checks.append(time.monotonic())
+                time.sleep(0.01)
+
+        self.create_scheduler(repository, owner='replica-0', lease_timeout=0.15)._with_lease('crawl.a', job)()
+
+        assert time.monotonic() - checks[0] < 1
+        assert repository.leases['crawl.a']['owner'] == 'replica-1'
+        assert repository.leases['crawl.a']['finished'] is False
+
+    def test_lease_is_renewed(self, repository: JobLeaseRepositoryMock):
+        lease = JobLease(repository, job='crawl.a', run='2021-01-01', owner='replica-0', create_logger=Logger.create, lease_timeout=0.15)
+        assert lease.acquire() is True
+
+        time.sleep(0.4)
+        assert repository.acquire('crawl.a', run='2021-01-01', owner='replica-1', lease_timeout=0.15) is False
+        assert lease.lost is False
+
+        lease.release(finished=True)
+        assert repository.acquire('crawl.a', run='2021-01-01', owner='replica-1', lease_timeout=0.15) is False
+        assert repository.acquire('crawl.a', run='2021-01-02', owner='replica-1', lease_timeout=0.15) is True
+
+    def test_lease_expires(self, repository: JobLeaseRepositoryMock):
+        assert repository.acquire('crawl.a', run='2021-01-01', owner='dead-replica', lease_timeout=0.1) is True
+        lease = JobLease(repository, job='crawl.a', run='2021-01-01', owner='replica-1', create_logger=Logger.create, lease_timeout=0.1)
+        assert lease.acquire() is False
+
+        time.sleep(0.15)
+        assert lease.acquire() is True
+        lease.release()
+
+    def test_lost_lease(self, repository: JobLeaseRepositoryMock):
+        lease = JobLease(repository, job='crawl.a', run='2021-01-01', owner='replica-0', create_logger=Logger.create, lease_timeout=0.15)
+        assert lease.acquire() is True
+        repository.leases['crawl.a']['owner'] = 'replica-1'
+
+        time.sleep(0.1)
+        assert lease.lost is True
+        lease.release()
+
+    def test_invalid_lease(self, repository: JobLeaseRepositoryMock):
+        with pytest.raises(InvalidValueException):
+            JobLease(repository, job='crawl.a', run='2021-01-01', owner='replica-0', create_logger=Logger.create, lease_timeout=0)
+        with pytest.raises(InvalidValueException):
+            JobLease(repository, job='crawl.a', run='2021-01-01', owner='replica-0', create_logger=Logger.create, max_attempts=0)
+        with pytest.raises(InvalidValueException):
+            BlockingSchedulerAdapter(create_logger=Logger.create, lease_repository=repository)
+        with pytest.raises(InvalidValueException):
+            BlockingSchedulerAdapter(create_logger=Logger.create, lease_repository=repository, owner='replica-0', max_attempts=0)
+
+
+def run_replica(owner: str, job: str, started) -> bool:
+    """Runs the job in a scheduler replica of its own process against the database of local.env, returns whether it ran."""
+    database = create_postgres_database(create_new_config().database, Logger.create)
+    scheduler = BlockingSchedulerAdapter(create_logger=Logger.create, lease_repository=create_job_lease_repository(database, Logger.create),
+                                         owner=owner)
+    runs = list()
+    started.wait()
+    scheduler._with_lease(job, lambda is_cancelled: (runs.append(owner), time.sleep(1)))()
+    return len(runs) > 0
+
+
+@pytest.mark.postgres
+class TestJobLeaseRepository:
+
+    def test_one_process_runs_the_job(self):
+        job = f'test.{uuid4()}'
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager, ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            started = manager.Barrier(2)
+            futures = [executor.submit(run_replica, f'process-{index}', job, started) for index in range(2)]
+            ran = [future.result(timeout=60) for future in futures]
+
+        assert sorted(ran) == [False, True]
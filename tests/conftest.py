@@ -13,12 +13,16 @@ from domain.model.recipe_aggregate import create_recipe, Recipe
 from domain.model.vendor_aggregate import create_vendor, Vendor
 
 
-def load_sample_website(filename: str):
+def load_sample_website_content(filename: str) -> bytes:
     path = os.path.join(Path(__file__).parent.parent, f'Assets/sample_websites/{filename}')
     with open(path, "rb") as file:
-        soup = BeautifulSoup(file.read(), "lxml")
-        soup.url = 'https://www.chefkoch.de/rezepte/2529011396359402/Bacon-Bomb.html'
-        return soup
+        return file.read()
+
+
+def load_sample_website(filename: str):
+    soup = BeautifulSoup(load_sample_website_content(filename), "lxml")
+    soup.url = 'https://www.chefkoch.de/rezepte/2529011396359402/Bacon-Bomb.html'
+    return soup
 
 
 @fixture
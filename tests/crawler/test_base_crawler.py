@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from typing import List, Generator
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 from pytest import fixture
 
@@ -9,7 +9,9 @@ from application.crawler.scrapers import RecipeOverviewItem
 from domain.model.category_aggregate import Category
 from domain.model.recipe_aggregate import Recipe
 from domain.model.vendor_aggregate import Vendor
-from infrastructure.fetch import FetchResult, AbstractFetcher
+from domain.repositories.recipe import AbstractRecipeRepository
+from domain.repositories.vendor import AbstractVendorRepository
+from infrastructure.fetch import FetchResult, AbstractFetcher, FetchOutcome, URLQueue
 from infrastructure.log import Logger
 from tests.conftest import load_sample_website
 
@@ -20,10 +22,16 @@ class TestBaseCrawler:
     class FetcherMock(AbstractFetcher):
 
         def fetch(self, urls: List[str]) -> Generator[List[FetchResult], None, None]:
-            assert urls == TestBaseCrawler.test_urls
+            assert urls.urls == TestBaseCrawler.test_urls
             for url in urls:
                 yield [f'{url}_batch_fetched']
 
+    class QueueFetcherMock(AbstractFetcher):
+
+        def fetch(self, urls: URLQueue) -> Generator[List[FetchResult], None, None]:
+            for url in urls:
+                yield [FetchResult(url=url, status=200)]
+
     @classmethod
     @fixture
     def crawler_implementation(cls, vendor: Vendor):
@@ -45,6 +53,25 @@ class TestBaseCrawler:
 
         assert pages == [f'test_url_{i}_batch_fetched' for i in range(100)]
 
+    def test_crawl_urls_deduplicates(self, crawler_implementation):
+        crawler_implementation._fetcher = self.QueueFetcherMock()
+        pages = list(crawler_implementation._crawl_urls(urls=['test_url_0', 'test_url_1', 'test_url_0']))
+
+        assert [page.url for page in pages] == ['test_url_0', 'test_url_1']
+
+    def test_crawl_and_process_discovered_urls(self, crawler_implementation):
+        crawler_implementation._fetcher = self.QueueFetcherMock()
+        queue = URLQueue(['overview_url'])
+
+        def scrape_callback(page: FetchResult) -> str:
+            if page.url == 'overview_url':
+                queue.add(['recipe_url', 'overview_url'])
+                queue.add('next_overview_url', priority=1)
+            return page.url
+
+        assert crawler_implementation._crawl_and_process(urls_to_crawl=queue, scrape_callback=scrape_callback) == \
+               ['overview_url', 'next_overview_url', 'recipe_url']
+
     @patch('application.crawler.base.AbstractBaseCrawler._crawl_urls')
     def test_crawl_and_process(self, mock_crawl_urls, crawler_implementation):
         test_fetch_result = FetchResult(url=self.test_urls[0], status=200, html=load_sample_website('recipe.html'))
@@ -56,8 +83,8 @@ class TestBaseCrawler:
             assert page == test_fetch_result
             return 'scrape result'
 
-        def mock_crawl_urls_implementation(urls: List[str]):
-            assert urls == self.test_urls
+        def mock_crawl_urls_implementation(urls: URLQueue):
+            assert list(urls) == self.test_urls
             yield test_fetch_result
 
         mock_crawl_urls.side_effect = mock_crawl_urls_implementation
@@ -81,8 +108,8 @@ class TestBaseCrawler:
             assert value == 'scrape result'
             store_callback_called = True
 
-        def mock_crawl_urls_implementation(urls: List[str]):
-            assert urls == self.test_urls
+        def mock_crawl_urls_implementation(urls: URLQueue):
+            assert list(urls) == self.test_urls
             yield test_fetch_result
 
         mock_crawl_urls.side_effect = mock_crawl_urls_implementation
@@ -93,6 +120,102 @@ class TestBaseCrawler:
         assert scrape_callback_called is True
         assert store_callback_called is True
 
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_urls')
+    def test_crawl_and_process_skips_failed_pages(self, mock_crawl_urls, crawler_implementation):
+        test_fetch_results = [
+            FetchResult(url=self.test_urls[0], status=None, outcome=FetchOutcome.TIMEOUT, error='TimeoutError: ', attempts=3),
+            FetchResult(url=self.test_urls[1], status=200, html=load_sample_website('recipe.html')),
+        ]
+
+        def mock_crawl_urls_implementation(urls: URLQueue):
+            yield from test_fetch_results
+
+        mock_crawl_urls.side_effect = mock_crawl_urls_implementation
+
+        assert crawler_implementation._crawl_and_process(urls_to_crawl=self.test_urls, scrape_callback=lambda page: page.url) == [self.test_urls[1]]
+
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_urls')
+    def test_crawl_and_process_acknowledges_pages(self, mock_crawl_urls, crawler_implementation, mocker):
+        test_fetch_results = [
+            FetchResult(url=self.test_urls[0], status=None, outcome=FetchOutcome.TIMEOUT, error='TimeoutError: ', attempts=3),
+            FetchResult(url=self.test_urls[1], status=200),
+        ]
+        queue = URLQueue(self.test_urls[:2])
+        mark_done, mark_failed, complete = (mocker.spy(queue, name) for name in ('mark_done', 'mark_failed', 'complete'))
+
+        def mock_crawl_urls_implementation(urls: URLQueue):
+            yield from test_fetch_results
+
+        mock_crawl_urls.side_effect = mock_crawl_urls_implementation
+        crawler_implementation._crawl_and_process(urls_to_crawl=queue, scrape_callback=lambda page: page.url)
+
+        mark_failed.assert_called_once_with(self.test_urls[0], error='TimeoutError: ')
+        mark_done.assert_called_once_with(self.test_urls[1])
+        complete.assert_called_once_with()
+
+    def test_crawl_and_process_stores_batches(self, crawler_implementation, mocker):
+        crawler_implementation._fetcher = self.QueueFetcherMock()
+        queue = URLQueue(self.test_urls[:7])
+        mark_done = mocker.spy(queue, 'mark_done')
+        stored_batches = list()
+
+        def store_callback(batch: List[str]):
+            assert mark_done.call_count == sum(len(stored_batch) for stored_batch in stored_batches)  # acknowledged after storing
+            stored_batches.append(batch)
+
+        assert crawler_implementation._crawl_and_process(
+            urls_to_crawl=queue, scrape_callback=lambda page: page.url, store_results=True, store_callback=store_callback, store_batch_size=3,
+        ) == self.test_urls[:7]
+        assert stored_batches == [self.test_urls[:3], self.test_urls[3:6], self.test_urls[6:7]]
+        assert mark_done.call_count == 7
+
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_urls')
+    def test_crawl_and_process_with_extract_callback(self, mock_crawl_urls, crawler_implementation):
+        test_fetch_results = [FetchResult(url=url, status=200, content=url.encode()) for url in self.test_urls[:3]]
+
+        def mock_crawl_urls_implementation(urls: URLQueue):
+            yield from test_fetch_results
+
+        mock_crawl_urls.side_effect = mock_crawl_urls_implementation
+
+        assert crawler_implementation._crawl_and_process(
+            urls_to_crawl=self.test_urls, extract_callback=bytes.upper, scrape_callback=lambda page, extracted: (page.url, extracted),
+        ) == [(url, url.upper().encode()) for url in self.test_urls[:3]]
+
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_urls')
+    def test_crawl_and_process_fails_pages_with_extract_errors(self, mock_crawl_urls, crawler_implementation, mocker):
+        test_fetch_results = [FetchResult(url=url, status=200, content=url.encode()) for url in self.test_urls[:3]]
+        queue = URLQueue(self.test_urls[:3])
+        mark_done, mark_failed = (mocker.spy(queue, name) for name in ('mark_done', 'mark_failed'))
+
+        def mock_crawl_urls_implementation(urls: URLQueue):
+            yield from test_fetch_results
+
+        def extract_callback(content: bytes) -> bytes:
+            if content == self.test_urls[1].encode():
+                raise ValueError('invalid page')
+            return content.upper()
+
+        mock_crawl_urls.side_effect = mock_crawl_urls_implementation
+
+        assert crawler_implementation._crawl_and_process(
+            urls_to_crawl=queue, extract_callback=extract_callback, scrape_callback=lambda page, extracted: page.url,
+        ) == [self.test_urls[0], self.test_urls[2]]
+        mark_failed.assert_called_once_with(self.test_urls[1], error='extraction failed, ValueError: invalid page')
+        assert mark_done.call_count == 2
+
+    def test_crawl_and_process_releases_pages(self, crawler_implementation):
+        crawler_implementation._fetcher = self.QueueFetcherMock()
+        pages = list()
+
+        def scrape_callback(page: FetchResult):
+            assert page.html is not None
+            pages.append(page)
+            return page.url
+
+        assert crawler_implementation._crawl_and_process(urls_to_crawl=self.test_urls[:3], scrape_callback=scrape_callback) == self.test_urls[:3]
+        assert [(page.is_parsed, page.content) for page in pages] == [(False, b'')] * 3
+
     def test_filter_new_recipes(self, crawler_implementation, category: Category):
         recipe_overviews = [
             RecipeOverviewItem(url='url 1', category=category, published=datetime.now()),
@@ -102,4 +225,50 @@ class TestBaseCrawler:
             RecipeOverviewItem(url='url 5', category=category, published=datetime.now() - timedelta(days=3)),
         ]
 
-        assert crawler_implementation._filter_new_recipes(recipe_overviews) == [recipe_overviews[2], recipe_overviews[3]]
+        day_before_yesterday = crawler_implementation._get_start_of_day(datetime.now()) - timedelta(days=2)
+        assert crawler_implementation._filter_new_recipes(recipe_overviews, {category.id: day_before_yesterday}) == \
+               [recipe_overviews[2], recipe_overviews[3]]
+
+        four_days_ago = day_before_yesterday - timedelta(days=2)
+        assert crawler_implementation._filter_new_recipes(recipe_overviews, {category.id: four_days_ago}) == recipe_overviews[1:]
+
+    def test_filter_known_recipes(self, crawler_implementation, category: Category):
+        recipe_overviews = [RecipeOverviewItem(url=f'url {i}', category=category, published=datetime.now()) for i in range(4)]
+        assert crawler_implementation._filter_known_recipes(recipe_overviews) == recipe_overviews
+
+        crawler_implementation._recipe_repository = MagicMock(spec=AbstractRecipeRepository)
+        crawler_implementation._recipe_repository.get_urls_by_vendor.return_value = iter(['url 1', 'url 3', 'url 5'])
+        crawler_implementation._recipe_repository.count_by_vendor.return_value = 3
+        assert crawler_implementation._filter_known_recipes(recipe_overviews) == [recipe_overviews[0], recipe_overviews[2]]
+
+    def test_load_known_recipe_urls_with_headroom(self, crawler_implementation):
+        crawler_implementation.known_urls_bloom_filter_threshold = 10
+        crawler_implementation._recipe_repository = MagicMock(spec=AbstractRecipeRepository)
+        crawler_implementation._recipe_repository.get_urls_by_vendor.side_effect = lambda vendor: iter([f'url {i}' for i in range(20)])
+        crawler_implementation._recipe_repository.count_by_vendor.return_value = 20
+
+        assert crawler_implementation._load_known_recipe_urls().capacity == 20
+        known_urls = crawler_implementation._load_known_recipe_urls(headroom=1.0)
+        assert known_urls.capacity == 40
+        assert 'url 19' in known_urls
+
+    def test_default_crawl_watermarks(self, crawler_implementation, category: Category):
+        crawler_implementation.vendor.add_category(category)
+        today = crawler_implementation._get_start_of_day(datetime.now())
+
+        crawler_implementation.vendor.date_last_crawled = datetime.now()
+        assert crawler_implementation._get_crawl_watermarks() == {category.id: today - timedelta(days=2)}
+
+        crawler_implementation.vendor.date_last_crawled = datetime.now() - timedelta(days=5)
+        assert crawler_implementation._get_crawl_watermarks() == {category.id: today - timedelta(days=6)}
+
+    def test_stored_crawl_watermarks(self, crawler_implementation, category: Category):
+        crawler_implementation.vendor.add_category(category)
+        crawler_implementation._vendor_repository = MagicMock(spec=AbstractVendorRepository)
+        crawler_implementation._vendor_repository.get_crawl_watermarks.return_value = {category.id: datetime(2021, 4, 1)}
+        assert crawler_implementation._get_crawl_watermarks() == {category.id: datetime(2021, 4, 1)}
+
+        crawler_implementation._advance_crawl_watermarks([category])
+        vendor, watermarks = crawler_implementation._vendor_repository.advance_crawl_watermarks.call_args.args
+        assert vendor is crawler_implementation.vendor
+        assert watermarks == {category.id: crawler_implementation._get_start_of_day(datetime.now()) - timedelta(days=1)}
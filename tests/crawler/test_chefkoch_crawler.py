@@ -1,23 +1,25 @@
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from itertools import chain
 from types import LambdaType
-from typing import List, Callable, Any
-from unittest.mock import patch
+from typing import List, Callable, Any, Generator, Tuple, Iterator
+from unittest.mock import patch, MagicMock
 
 from pytest import fixture, raises
 
 from application.crawler.chefkoch_crawler import ChefkochCrawler
 from application.crawler.scrapers import RecipeOverviewItem
 from domain.model.base import Entity
-from domain.model.category_aggregate import Category
+from domain.model.category_aggregate import Category, create_category
 from domain.model.recipe_aggregate import Recipe
 from domain.model.user_aggregate import User
 from domain.model.vendor_aggregate import Vendor
 from domain.repositories.category import AbstractCategoryRepository
-from domain.repositories.recipe import AbstractRecipeRepository
-from infrastructure.fetch import FetchResult, AsyncFetcher
+from domain.repositories.recipe import AbstractRecipeRepository, RecipeWriteCounts
+from domain.repositories.vendor import AbstractVendorRepository
+from infrastructure.fetch import FetchResult, AsyncFetcher, URLQueue, SharedURLQueue, AbstractFetcher, create_persistent_url_queue
 from infrastructure.log import Logger
+from tests.fetch.test_url_queue import InMemoryFrontierRepository
 
 
 class TestChefkochCrawler:
@@ -34,12 +36,16 @@ class TestChefkochCrawler:
         return [RecipeOverviewItem(url='overview_url', category=category, published=datetime.now())]
 
     @staticmethod
-    def get_mock_and_test_crawl_and_process_function(test_urls: List[str], test_store_results: bool = False, test_store_callback: Callable = None) -> Callable:
-        def mock_and_test_crawl_and_process(urls_to_crawl: List[str], scrape_callback: Callable[[FetchResult], Any], store_results: bool = False, store_callback: Callable = None):
-            assert urls_to_crawl == test_urls
+    def get_mock_and_test_crawl_and_process_function(test_urls: List[str], test_store_results: bool = False, test_store_callback: Callable = None,
+                                                     test_extract_callback: Callable = None, test_store_batch_size: int = None) -> Callable:
+        def mock_and_test_crawl_and_process(urls_to_crawl: List[str], scrape_callback: Callable[[FetchResult], Any], store_results: bool = False, store_callback: Callable = None,
+                                            extract_callback: Callable = None, store_batch_size: int = None):
+            assert (urls_to_crawl.urls if isinstance(urls_to_crawl, URLQueue) else urls_to_crawl) == test_urls
             assert isinstance(scrape_callback, LambdaType)
             assert store_results is test_store_results
             assert store_callback == test_store_callback
+            assert extract_callback == test_extract_callback
+            assert store_batch_size == test_store_batch_size
             return ['verify mock_and_test_crawl_and_process called']
 
         return mock_and_test_crawl_and_process
@@ -58,39 +64,237 @@ class TestChefkochCrawler:
         )
         assert crawler.crawl_categories(store_categories=True) == 'verify mock_and_test_crawl_and_process called'
 
-    @patch('application.crawler.base.AbstractBaseCrawler._crawl_and_process')
+    @patch('application.crawler.base.AbstractBaseCrawler._iter_crawl_and_process')
     @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
     @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._get_recipe_overview_items')
     @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._filter_new_recipes')
     def test_crawl_new_recipes(self, mock_filter_new_recipes, mock_get_recipe_overview_items, mock_crawl_categories_if_needed, mock_crawl_and_process, crawler: ChefkochCrawler,
                                overview_item_mocks):
         mock_filter_new_recipes.return_value = overview_item_mocks
-        mock_get_recipe_overview_items.return_value = overview_item_mocks
+        mock_get_recipe_overview_items.return_value = overview_item_mocks, []
         mock_crawl_categories_if_needed.return_value = None
         mock_crawl_and_process.side_effect = self.get_mock_and_test_crawl_and_process_function(
-            test_urls=[overview_item_mocks[0].url], test_store_results=False, test_store_callback=crawler._store_recipe
+            test_urls=[overview_item_mocks[0].url], test_store_results=False, test_store_callback=crawler._store_recipes,
+            test_extract_callback=crawler.scraper.extract_recipe, test_store_batch_size=crawler.store_batch_size,
         )
         assert crawler.crawl_new_recipes(store_recipes=False) == ['verify mock_and_test_crawl_and_process called']
 
-    @patch('application.crawler.base.AbstractBaseCrawler._crawl_and_process')
+    @patch('application.crawler.base.AbstractBaseCrawler._iter_crawl_and_process')
     @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
     @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._get_recipe_overview_items')
     @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._filter_new_recipes')
     def test_crawl_and_store_new_recipes(self, mock_filter_new_recipes, mock_get_recipe_overview_items, mock_crawl_categories_if_needed, mock_crawl_and_process,
                                          crawler: ChefkochCrawler, overview_item_mocks):
         mock_filter_new_recipes.return_value = overview_item_mocks
-        mock_get_recipe_overview_items.return_value = overview_item_mocks
+        mock_get_recipe_overview_items.return_value = overview_item_mocks, []
         mock_crawl_categories_if_needed.return_value = None
         mock_crawl_and_process.side_effect = self.get_mock_and_test_crawl_and_process_function(
-            test_urls=[overview_item_mocks[0].url], test_store_results=True, test_store_callback=crawler._store_recipe
+            test_urls=[overview_item_mocks[0].url], test_store_results=True, test_store_callback=crawler._store_recipes,
+            test_extract_callback=crawler.scraper.extract_recipe, test_store_batch_size=crawler.store_batch_size,
         )
         assert crawler.crawl_new_recipes() == ['verify mock_and_test_crawl_and_process called']
 
+    @patch('application.crawler.base.AbstractBaseCrawler._iter_crawl_and_process')
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
+    @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._get_recipe_overview_items')
+    @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._filter_new_recipes')
+    def test_crawl_new_recipes_uses_frontier_only_when_storing(self, mock_filter_new_recipes, mock_get_recipe_overview_items, mock_crawl_categories_if_needed,
+                                                               mock_crawl_and_process, crawler: ChefkochCrawler, overview_item_mocks):
+        mock_filter_new_recipes.return_value = overview_item_mocks
+        mock_get_recipe_overview_items.return_value = overview_item_mocks, []
+        mock_crawl_and_process.return_value = []
+        frontier_queue = URLQueue()
+        crawler._create_url_queue = MagicMock(return_value=frontier_queue)
+
+        crawler.crawl_new_recipes(store_recipes=False)
+        crawler._create_url_queue.assert_not_called()
+        assert mock_crawl_and_process.call_args.kwargs['urls_to_crawl'] is not frontier_queue
+
+        crawler.crawl_new_recipes(store_recipes=True)
+        crawler._create_url_queue.assert_called_once_with('Chefkoch.new_recipes')
+        assert mock_crawl_and_process.call_args.kwargs['urls_to_crawl'] is frontier_queue
+
+    @patch('application.crawler.base.AbstractBaseCrawler._iter_crawl_and_process')
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
+    @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._get_recipe_overview_items')
+    def test_crawl_new_recipes_looks_up_overview_items(self, mock_get_recipe_overview_items, mock_crawl_categories_if_needed, mock_crawl_and_process,
+                                                       crawler: ChefkochCrawler, category: Category):
+        other_category = create_category(category_id=uuid.uuid4(), name='Other', url='https://www.chefkoch.de/rs/s0g1/Other.html', vendor=crawler.vendor)
+        crawler.vendor.add_category(category)
+        crawler.vendor.add_category(other_category)
+        published = datetime.now() - timedelta(days=1)
+        overview_items = [RecipeOverviewItem(url=f'recipe/{index}', category=[category, other_category][index % 2], published=published) for index in range(4)]
+        mock_get_recipe_overview_items.return_value = overview_items, []
+
+        def mock_crawl_and_process_implementation(urls_to_crawl: URLQueue, scrape_callback: Callable, **kwargs):
+            return [scrape_callback(FetchResult(url=url, status=200), None) for url in list(urls_to_crawl) + ['recipe/unknown']]
+
+        mock_crawl_and_process.side_effect = mock_crawl_and_process_implementation
+        with patch.object(crawler.scraper, 'build_recipe', side_effect=lambda structured_data, url, category: (url, category)):
+            result = crawler.crawl_new_recipes(store_recipes=False)
+        assert result == [(item.url, item.category) for item in overview_items]
+
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
+    @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._get_recipe_overview_items')
+    def test_crawl_new_recipes_resumes_failed_recipe_page(self, mock_get_recipe_overview_items, mock_crawl_categories_if_needed,
+                                                          crawler: ChefkochCrawler, category: Category):
+        other_category = create_category(category_id=uuid.uuid4(), name='Other', url='https://www.chefkoch.de/rs/s0g1/Other.html', vendor=crawler.vendor)
+        crawler.vendor.add_category(category)
+        crawler.vendor.add_category(other_category)
+        published = datetime.now() - timedelta(days=1)
+        overview_items = [RecipeOverviewItem(url='recipe/failing', category=category, published=published),
+                          RecipeOverviewItem(url='recipe/ok', category=other_category, published=published)]
+        mock_get_recipe_overview_items.return_value = overview_items, [category, other_category]
+        failing_urls = {'recipe/failing'}
+
+        class RecipeFetcherMock(AbstractFetcher):
+            def fetch(self, urls: URLQueue) -> Generator[List[FetchResult], None, None]:
+                for url in urls:
+                    yield [FetchResult(url=url, status=500 if url in failing_urls else 200, content=url.encode())]
+
+        stored_urls = list()
+        crawler._fetcher = RecipeFetcherMock()
+        crawler._recipe_repository = MagicMock(spec=AbstractRecipeRepository)
+        crawler._recipe_repository.get_urls_by_vendor.side_effect = lambda vendor: iter(list(stored_urls))
+        crawler._recipe_repository.count_by_vendor.side_effect = lambda vendor: len(stored_urls)
+        crawler._recipe_repository.add_many.side_effect = lambda recipes: stored_urls.extend(url for url, _ in recipes) or RecipeWriteCounts(inserted=len(recipes))
+        crawler._vendor_repository = MagicMock(spec=AbstractVendorRepository)
+        crawler._vendor_repository.get_crawl_watermarks.return_value = dict()
+        frontier_repository = InMemoryFrontierRepository()
+        crawler._create_url_queue = lambda crawl: create_persistent_url_queue(frontier_repository, crawl=crawl, create_logger=Logger.create)
+
+        with patch.object(crawler.scraper, 'extract_recipe', return_value=None), \
+                patch.object(crawler.scraper, 'build_recipe', side_effect=lambda structured_data, url, category: (url, category)):
+            assert crawler.crawl_new_recipes() == [('recipe/ok', other_category)]
+            watermarks = crawler._vendor_repository.advance_crawl_watermarks.call_args.args[1]
+            assert set(watermarks) == {other_category.id}
+            assert frontier_repository.get_pending_urls('Chefkoch.new_recipes') == [('recipe/failing', 0)]
+
+            failing_urls.clear()
+            assert crawler.crawl_new_recipes() == [('recipe/failing', category)]
+            watermarks = crawler._vendor_repository.advance_crawl_watermarks.call_args.args[1]
+            assert set(watermarks) == {category.id, other_category.id}
+        assert sorted(stored_urls) == ['recipe/failing', 'recipe/ok']
+
     @patch('application.crawler.base.AbstractBaseCrawler._crawl_and_process')
     def test_get_recipe_overview_items(self, mock_crawl_and_process, crawler: ChefkochCrawler, category: Category):
         crawler.vendor.add_category(category)
-        mock_crawl_and_process.side_effect = self.get_mock_and_test_crawl_and_process_function(test_urls=[category.url.value])
-        assert crawler._get_recipe_overview_items() == list(chain(*['verify mock_and_test_crawl_and_process called']))
+        mock_crawl_and_process.side_effect = self.get_mock_and_test_crawl_and_process_function(
+            test_urls=[category.url.value], test_extract_callback=crawler.scraper.extract_recipe_overview,
+        )
+        assert crawler._get_recipe_overview_items({category.id: datetime.now()}) == (list(chain(*['verify mock_and_test_crawl_and_process called'])), [])
+
+    def test_paginate_recipe_overview_until_watermark(self, crawler: ChefkochCrawler, category: Category):
+        category_url = 'https://www.chefkoch.de/rs/s0g119/Partyrezepte.html'
+        crawler.vendor.add_category(create_category(category_id=uuid.uuid4(), name='Party', url=category_url, vendor=crawler.vendor))
+        crawler.vendor.add_category(category)
+        watermark = datetime(2021, 4, 10)
+
+        class OverviewFetcherMock(AbstractFetcher):
+            def fetch(self, urls: URLQueue) -> Generator[List[FetchResult], None, None]:
+                for url in urls:
+                    yield [FetchResult(url=url, status=200, content=url.encode())]
+
+        def extract_recipe_overview(content: bytes) -> List[Tuple[str, datetime]]:
+            url = content.decode()
+            if url == category.url.value:
+                return [(f'{url}/recipe', watermark - timedelta(days=1))]
+            page = int(url.split('/')[4].split('o3')[0][1:]) // ChefkochCrawler.overview_page_size
+            publish_days = [watermark + timedelta(days=20 - page * 7 - day) for day in range(7)]
+            return [(f'{url}/recipe/{index}', published) for index, published in enumerate(publish_days)]
+
+        crawler._fetcher = OverviewFetcherMock()
+        with patch.object(crawler.scraper, 'extract_recipe_overview', extract_recipe_overview):
+            overview_items, completed_categories = crawler._get_recipe_overview_items({category.id: watermark for category in crawler.vendor.categories})
+
+        assert len(overview_items) == 3 * 7 + 1
+        assert {item.url.split('/')[4] for item in overview_items} == {'s0o3g119', 's30o3g119', 's60o3g119', 'kategorien'}
+        assert len(completed_categories) == 2
+
+        crawler.max_overview_pages = 2
+        with patch.object(crawler.scraper, 'extract_recipe_overview', extract_recipe_overview):
+            overview_items, completed_categories = crawler._get_recipe_overview_items({category.id: watermark for category in crawler.vendor.categories})
+        assert len(overview_items) == 2 * 7 + 1
+        assert completed_categories == [category]
+
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
+    def test_backfill_recipes(self, mock_crawl_categories_if_needed, crawler: ChefkochCrawler, category: Category):
+        category_url = 'https://www.chefkoch.de/rs/s0g119/Partyrezepte.html'
+        crawler.vendor.add_category(create_category(category_id=uuid.uuid4(), name='Party', url=category_url, vendor=crawler.vendor))
+        crawler.vendor.add_category(category)
+        newest = datetime(2021, 4, 30)
+
+        class BackfillFetcherMock(AbstractFetcher):
+            def fetch(self, urls: URLQueue) -> Generator[List[FetchResult], None, None]:
+                for url in urls:
+                    yield [FetchResult(url=url, status=200, content=url.encode())]
+
+        def extract_recipe_overview(content: bytes) -> List[Tuple[str, datetime]]:
+            url = content.decode()
+            if url == category.url.value:  # the same recipes as on the first page of the party category
+                return [(f'recipe/{day}', newest - timedelta(days=day)) for day in range(3)]
+            page = int(url.split('/')[4].split('o3')[0][1:]) // ChefkochCrawler.overview_page_size
+            return [(f'recipe/{day}', newest - timedelta(days=day)) for day in range(page * 10, page * 10 + 10) if day < 45]
+
+        crawler._fetcher = BackfillFetcherMock()
+        crawler._recipe_repository = MagicMock(spec=AbstractRecipeRepository)
+        crawler._recipe_repository.get_urls_by_vendor.return_value = iter(['recipe/5'])
+        crawler._recipe_repository.count_by_vendor.return_value = 1
+        crawler._recipe_repository.add_many.side_effect = lambda recipes: RecipeWriteCounts(inserted=len(recipes))
+        with patch.object(crawler.scraper, 'extract_recipe_overview', extract_recipe_overview), \
+                patch.object(crawler.scraper, 'build_recipe', side_effect=lambda structured_data, url, category: None if url == 'recipe/7' else url):
+            progress = crawler.backfill_recipes(published_from=newest - timedelta(days=30), published_until=newest - timedelta(days=1))
+
+        stored_urls = list(chain(*(call.args[0] for call in crawler._recipe_repository.add_many.call_args_list)))
+        assert sorted(stored_urls) == sorted(f'recipe/{day}' for day in range(2, 31) if day not in (5, 7))
+        assert progress.overview_pages == 4 + 1
+        assert progress.recipes_found == 29 + 1
+        assert progress.recipes_skipped == 1 + 1
+        assert progress.recipes_crawled == 27
+        assert progress.recipes_failed == 1
+        assert crawler.recipe_write_counts == RecipeWriteCounts(inserted=27)
+
+        crawler._recipe_repository.reset_mock()
+        crawler._recipe_repository.get_urls_by_vendor.return_value = iter([])
+        with patch.object(crawler.scraper, 'extract_recipe_overview', extract_recipe_overview), \
+                patch.object(crawler.scraper, 'build_recipe', side_effect=lambda structured_data, url, category: url):
+            progress = crawler.backfill_recipes(store_recipes=False, max_overview_pages=2)
+        crawler._recipe_repository.add_many.assert_not_called()
+        assert progress.overview_pages == 2 + 1
+        assert progress.recipes_crawled == 20
+
+    @patch('application.crawler.base.AbstractBaseCrawler._crawl_categories_if_needed')
+    @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._get_recipe_overview_items')
+    @patch('application.crawler.chefkoch_crawler.ChefkochCrawler._filter_new_recipes')
+    def test_enqueue_new_recipes(self, mock_filter_new_recipes, mock_get_recipe_overview_items, mock_crawl_categories_if_needed,
+                                 crawler: ChefkochCrawler, overview_item_mocks):
+        mock_filter_new_recipes.return_value = overview_item_mocks
+        mock_get_recipe_overview_items.return_value = overview_item_mocks, []
+        queue = MagicMock(spec=SharedURLQueue, crawl='test', worker='worker-1')
+
+        assert crawler.enqueue_new_recipes(queue) == 1
+        queue.add.assert_called_once_with(['overview_url'], context=overview_item_mocks[0].category.url.value)
+
+    @patch('application.crawler.base.AbstractBaseCrawler._iter_crawl_and_process')
+    def test_crawl_queued_recipes(self, mock_crawl_and_process, crawler: ChefkochCrawler, category: Category):
+        crawler.vendor.add_category(category)
+        queue = MagicMock(spec=SharedURLQueue, crawl='test', worker='worker-1')
+        queue.get_context.return_value = category.url.value
+
+        def mock_crawl_and_process_implementation(urls_to_crawl: SharedURLQueue, scrape_callback: Callable, store_results: bool, store_callback: Callable,
+                                                  extract_callback: Callable, store_batch_size: int):
+            assert urls_to_crawl is queue
+            assert store_results is True and store_callback == crawler._store_recipes and extract_callback == crawler.scraper.extract_recipe
+            assert store_batch_size == crawler.store_batch_size
+            return [scrape_callback(FetchResult(url='recipe_url', status=200), None)]
+
+        mock_crawl_and_process.side_effect = mock_crawl_and_process_implementation
+        with patch.object(crawler.scraper, 'build_recipe', return_value='recipe') as mock_build_recipe:
+            assert crawler.crawl_queued_recipes(queue) == ['recipe']
+            mock_build_recipe.assert_called_once_with(structured_data=None, url='recipe_url', category=category)
+
+        queue.get_context.return_value = 'unknown category'
+        assert crawler.crawl_queued_recipes(queue) == []
 
     def test_store_categories(self, crawler: ChefkochCrawler, category: Category):
         call_counter = 0
@@ -138,7 +342,7 @@ class TestChefkochCrawler:
         with raises(ValueError):
             crawler._store_categories(categories=[])
 
-    def test_store_recipe(self, crawler: ChefkochCrawler, recipe: Recipe):
+    def test_store_recipes(self, crawler: ChefkochCrawler, recipe: Recipe):
         call_counter = 0
 
         class RecipeRepositoryMock(AbstractRecipeRepository):
@@ -152,6 +356,12 @@ class TestChefkochCrawler:
             def get_unseen_recipes_for_user(self, user: User, limit: int = 20) -> List[Recipe]:
                 pass
 
+            def get_urls_by_vendor(self, vendor_: Vendor) -> Iterator[str]:
+                pass
+
+            def count_by_vendor(self, vendor_: Vendor) -> int:
+                pass
+
             def get_by_id(self, entity_id: uuid.UUID) -> Entity:
                 pass
 
@@ -170,14 +380,16 @@ class TestChefkochCrawler:
                 pass
 
         crawler._recipe_repository = RecipeRepositoryMock()
-        crawler._store_recipe(recipe=recipe)
+        crawler._store_recipes(recipes=[recipe, None, recipe])
 
-        assert call_counter == 1
+        assert call_counter == 2
+        assert crawler.recipe_write_counts == RecipeWriteCounts(inserted=2)
 
     def test_store_recipe_fail(self, crawler: ChefkochCrawler, recipe: Recipe):
         with raises(ValueError):
-            crawler._store_recipe(recipe=recipe)
+            crawler._store_recipes(recipes=[recipe])
 
     def test_get_date_sorted_url(self):
         url = 'https://www.chefkoch.de/rs/s0g119/Partyrezepte.html'
         assert ChefkochCrawler._get_date_sorted_url(url) == 'https://www.chefkoch.de/rs/s0o3g119/Partyrezepte.html'
+        assert ChefkochCrawler._get_date_sorted_url(url, page=2) == 'https://www.chefkoch.de/rs/s60o3g119/Partyrezepte.html'
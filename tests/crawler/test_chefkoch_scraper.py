@@ -1,13 +1,15 @@
 from datetime import datetime
+from timeit import repeat
 from unittest.mock import patch
 
-from pytest import fixture
+from bs4 import BeautifulSoup
+from pytest import fixture, mark
 
 from application.crawler.scrapers import ChefkochScraper, RecipeOverviewItem
 from domain.model.category_aggregate import Category
 from domain.model.recipe_aggregate import Recipe
 from domain.model.vendor_aggregate import Vendor
-from tests.conftest import load_sample_website
+from tests.conftest import load_sample_website, load_sample_website_content
 
 
 class TestChefkochScraper:
@@ -53,3 +55,59 @@ class TestChefkochScraper:
         assert len(parsed_categories) == 182
         for category in parsed_categories:
             assert isinstance(category, Category)
+
+    def test_extract_and_build_recipe(self, scraper: ChefkochScraper, recipe: Recipe, category: Category):
+        structured_data = scraper.extract_recipe(load_sample_website_content('recipe.html'))
+
+        assert isinstance(structured_data, dict)
+        assert structured_data['@type'] == 'Recipe'
+
+        built_recipe = scraper.build_recipe(structured_data=structured_data, url=recipe.url.value, category=category)
+        assert built_recipe.name == recipe.name
+        assert built_recipe.category == category
+        assert len(built_recipe.ingredients) == len(recipe.ingredients)
+
+    def test_extract_recipe_fast_path(self, scraper: ChefkochScraper):
+        content = load_sample_website_content('recipe.html')
+        assert scraper._find_recipe_structured_data_fast(content) == scraper._find_recipe_structured_data(load_sample_website('recipe.html'))
+
+    @patch('application.crawler.scrapers.chefkoch_scraper.ChefkochScraper._find_recipe_structured_data_fast')
+    def test_extract_recipe_fallback(self, mock_find_fast, scraper: ChefkochScraper):
+        mock_find_fast.side_effect = ValueError('invalid ld+json')
+        assert scraper.extract_recipe(load_sample_website_content('recipe.html'))['@type'] == 'Recipe'
+
+    @mark.benchmark
+    def test_extract_recipe_fast_path_benchmark(self, scraper: ChefkochScraper):
+        content = load_sample_website_content('recipe.html')
+        fast_path = min(repeat(lambda: scraper._find_recipe_structured_data_fast(content), number=20, repeat=5))
+        full_parse = min(repeat(lambda: scraper._find_recipe_structured_data(BeautifulSoup(content, 'lxml')), number=20, repeat=5))
+
+        print(f'ld+json extraction of recipe.html: fast path {fast_path / 20 * 1000:.3f} ms, full parse {full_parse / 20 * 1000:.3f} ms')
+
+    def test_extract_recipe_without_structured_data(self, scraper: ChefkochScraper, category: Category):
+        assert scraper.extract_recipe(b'<html><body></body></html>') is None
+        assert scraper.build_recipe(structured_data=None, url='url', category=category) is None
+
+    def test_extract_and_build_recipe_overview(self, scraper: ChefkochScraper, category: Category):
+        entries = scraper.extract_recipe_overview(load_sample_website_content('recipe_overview.html'))
+        overview_items = scraper.build_recipe_overview(entries, category=category)
+
+        assert overview_items == scraper.scrape_recipe_overview(soup=load_sample_website('recipe_overview.html'), category=category)
+
+    def test_parse_recipe_overview_partially(self, scraper: ChefkochScraper, category: Category):
+        content = load_sample_website_content('recipe_overview.html').replace(b'<body>', b'<body><nav><a href="/menu">Menu</a></nav>', 1)
+        soup = BeautifulSoup(content, 'lxml', parse_only=scraper.recipe_overview_parse_only)
+
+        assert soup.find('nav') is None
+        assert scraper.scrape_recipe_overview(soup=soup, category=category) == \
+               scraper.scrape_recipe_overview(soup=load_sample_website('recipe_overview.html'), category=category)
+
+    def test_parse_categories_partially(self, scraper: ChefkochScraper):
+        soup = BeautifulSoup(load_sample_website_content('categories.html'), 'lxml', parse_only=scraper.categories_parse_only)
+
+        assert [category.name for category in scraper.scrape_categories(soup=soup)] == \
+               [category.name for category in scraper.scrape_categories(soup=load_sample_website('categories.html'))]
+
+    def test_extract_recipe_fast_path_decodes_utf8(self, scraper: ChefkochScraper):
+        content = '<html><script type="application/ld+json">{"@type": "Recipe", "name": "Käsespätzle"}</script></html>'.encode()
+        assert scraper._find_recipe_structured_data_fast(content)['name'] == 'Käsespätzle'
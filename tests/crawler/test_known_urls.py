@@ -0,0 +1,34 @@
+import pytest
+
+from application.crawler.known_urls import BloomFilter, create_known_url_filter
+from domain.exceptions import InvalidValueException
+
+
+class TestKnownUrls:
+    known_urls = [f'https://www.chefkoch.de/rezepte/{i}/' for i in range(10000)]
+    unknown_urls = [f'https://www.chefkoch.de/rezepte/{i}/' for i in range(10000, 20000)]
+
+    def test_create_set(self):
+        known_urls = create_known_url_filter(iter(self.known_urls), count=len(self.known_urls), bloom_filter_threshold=len(self.known_urls) + 1)
+        assert known_urls == set(self.known_urls)
+
+    def test_create_bloom_filter(self):
+        known_urls = create_known_url_filter(iter(self.known_urls), count=len(self.known_urls), bloom_filter_threshold=len(self.known_urls))
+        assert isinstance(known_urls, BloomFilter)
+        assert len(known_urls) == len(self.known_urls)
+
+    def test_bloom_filter(self):
+        bloom_filter = BloomFilter(capacity=len(self.known_urls), error_rate=0.001)
+        for url in self.known_urls:
+            bloom_filter.add(url)
+
+        assert all(url in bloom_filter for url in self.known_urls)
+        false_positives = sum(url in bloom_filter for url in self.unknown_urls)
+        assert false_positives <= 3 * 0.001 * len(self.unknown_urls)
+        assert bloom_filter.hash_count == 10
+        assert len(bloom_filter._bits) < 20 * len(self.known_urls)
+
+    @pytest.mark.parametrize('capacity, error_rate', [(0, 0.01), (100, 0), (100, 1)])
+    def test_invalid_bloom_filter(self, capacity: int, error_rate: float):
+        with pytest.raises(InvalidValueException):
+            BloomFilter(capacity=capacity, error_rate=error_rate)
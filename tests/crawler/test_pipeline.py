@@ -0,0 +1,148 @@
+import threading
+from typing import List, Generator
+
+import pytest
+
+from application.crawler import CrawlPipeline, ScrapePool
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import FetchResult, FetchOutcome, URLQueue
+from infrastructure.log import Logger
+
+
+def extract_unless_broken(content: bytes) -> bytes:
+    if content.startswith(b'broken'):
+        raise ValueError('invalid page')
+    return content.upper()
+
+
+class TestCrawlPipeline:
+
+    @staticmethod
+    def fetch(urls: URLQueue) -> Generator[FetchResult, None, None]:
+        for url in urls:
+            if url.startswith('failed'):
+                yield FetchResult(url=url, status=None, outcome=FetchOutcome.TIMEOUT, error='TimeoutError: ')
+            else:
+                yield FetchResult(url=url, status=200, content=url.encode())
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_run(self, workers: int):
+        urls = [f'url_{i}' for i in range(50)] + ['failed_url']
+        with ScrapePool(workers=workers) as scrape_pool:
+            pipeline = CrawlPipeline(fetch=self.fetch, create_logger=Logger.create, scrape_pool=scrape_pool, queue_size=4)
+            results = list(pipeline.run(URLQueue(urls), extract=bytes.upper))
+
+        assert [page.url for page, _ in results] == urls
+        assert [extracted for _, extracted in results] == [url.upper().encode() for url in urls[:-1]] + [None]
+        assert [stats.items for stats in pipeline.stats] == [len(urls)] * 3
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_run_fails_pages_with_extract_errors(self, workers: int):
+        urls = ['url_0', 'broken_url', 'url_1']
+        with ScrapePool(workers=workers) as scrape_pool:
+            pipeline = CrawlPipeline(fetch=self.fetch, create_logger=Logger.create, scrape_pool=scrape_pool)
+            results = list(pipeline.run(URLQueue(urls), extract=extract_unless_broken))
+
+        assert [(page.url, page.ok, extracted) for page, extracted in results] == [
+            ('url_0', True, b'URL_0'), ('broken_url', False, None), ('url_1', True, b'URL_1'),
+        ]
+        assert results[1][0].outcome is FetchOutcome.ERROR
+        assert results[1][0].error == 'extraction failed, ValueError: invalid page'
+
+    def test_run_crawls_added_urls(self):
+        queue = URLQueue(['overview_0'])
+        processed: List[str] = list()
+        pipeline = CrawlPipeline(fetch=self.fetch, create_logger=Logger.create, queue_size=1, fetch_chunk_size=1)
+
+        for page, extracted in pipeline.run(queue):
+            assert extracted is None
+            processed.append(page.url)
+            if page.url == 'overview_0':
+                queue.add(['recipe_0', 'overview_1'])
+            if page.url == 'overview_1':
+                queue.add(['recipe_1', 'recipe_0'])
+
+        assert processed == ['overview_0', 'recipe_0', 'overview_1', 'recipe_1']
+
+    def test_run_holds_lock_while_processing(self):
+        queue = URLQueue([f'url_{i}' for i in range(20)])
+        processing = threading.Event()
+        overlapping = False
+
+        class CheckingQueue(URLQueue):
+            def is_empty(self):
+                nonlocal overlapping
+                overlapping = overlapping or processing.is_set()
+                return queue.is_empty()
+
+            def __next__(self):
+                return next(queue)
+
+        pipeline = CrawlPipeline(fetch=self.fetch, create_logger=Logger.create, queue_size=1, fetch_chunk_size=1)
+        for _ in pipeline.run(CheckingQueue()):
+            processing.set()
+            threading.Event().wait(0.001)
+            processing.clear()
+
+        assert overlapping is False
+
+    def test_run_bounds_buffered_bytes(self):
+        fetched, processed, max_ahead = 0, 0, 0
+
+        def fetch(urls: URLQueue) -> Generator[FetchResult, None, None]:
+            nonlocal fetched
+            for url in urls:
+                fetched += 1
+                yield FetchResult(url=url, status=200, content=b'0123456789')
+
+        pipeline = CrawlPipeline(fetch=fetch, create_logger=Logger.create, max_buffered_bytes=25)
+        for page, _ in pipeline.run(URLQueue([f'url_{i}' for i in range(20)])):
+            threading.Event().wait(0.005)
+            max_ahead = max(max_ahead, fetched - processed)
+            processed += 1
+
+        assert processed == 20
+        assert max_ahead <= 3  # two buffered pages and one that waits for the buffer
+
+    def test_run_fetches_while_processing(self):
+        processing, all_fetched = threading.Event(), threading.Event()
+
+        def fetch(urls: URLQueue) -> Generator[FetchResult, None, None]:
+            for url in urls:
+                yield FetchResult(url=url, status=200, content=b'0123456789')
+                processing.wait(timeout=5)
+            all_fetched.set()
+
+        pipeline = CrawlPipeline(fetch=fetch, create_logger=Logger.create, fetch_chunk_size=100, max_buffered_bytes=1000)
+        processed = list()
+        for page, _ in pipeline.run(URLQueue([f'url_{i}' for i in range(10)])):
+            if not processed:  # e.g. a long database write, the pages are still fetched and buffered meanwhile
+                processing.set()
+                assert all_fetched.wait(timeout=2)
+            processed.append(page.url)
+
+        assert len(processed) == 10
+
+    def test_run_raises_fetch_errors(self):
+        def fetch(urls: URLQueue) -> Generator[FetchResult, None, None]:
+            yield FetchResult(url=next(urls), status=200)
+            raise ValueError('fetch failed')
+
+        pipeline = CrawlPipeline(fetch=fetch, create_logger=Logger.create)
+        with pytest.raises(ValueError, match='fetch failed'):
+            list(pipeline.run(URLQueue(['url_0', 'url_1'])))
+
+    def test_close_run_early(self):
+        pipeline = CrawlPipeline(fetch=self.fetch, create_logger=Logger.create, queue_size=1)
+        run = pipeline.run(URLQueue([f'url_{i}' for i in range(100)]))
+        page, _ = next(run)
+        run.close()
+
+        assert page.url == 'url_0'
+        assert not any(thread.name.startswith('crawl-pipeline') for thread in threading.enumerate())
+
+    @pytest.mark.parametrize('queue_size, fetch_chunk_size, max_buffered_bytes', [(0, 1, None), (1, 0, None), (1, 1, 0)])
+    def test_invalid_pipeline(self, queue_size: int, fetch_chunk_size: int, max_buffered_bytes: int):
+        with pytest.raises(InvalidValueException):
+            CrawlPipeline(fetch=self.fetch, create_logger=Logger.create, queue_size=queue_size, fetch_chunk_size=fetch_chunk_size,
+                          max_buffered_bytes=max_buffered_bytes)
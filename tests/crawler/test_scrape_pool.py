@@ -0,0 +1,45 @@
+import pytest
+
+from application.crawler import ScrapePool
+from application.crawler.scrapers import ChefkochScraper
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import FetchResult
+from tests.conftest import load_sample_website_content
+
+
+class TestScrapePool:
+
+    @staticmethod
+    @pytest.fixture
+    def pages() -> list:
+        content = load_sample_website_content('recipe_overview.html')
+        return [FetchResult(url=f'url_{i}', status=200, content=content) for i in range(6)]
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_submit(self, workers: int, pages: list):
+        expected_entries = ChefkochScraper.extract_recipe_overview(pages[0].content)
+        failed_page = FetchResult(url='failed_url', status=500)
+
+        with ScrapePool(workers=workers) as pool:
+            futures = [pool.submit(ChefkochScraper.extract_recipe_overview, page) for page in pages + [failed_page]]
+            results = [future.result() for future in futures]
+
+        assert all(entries == expected_entries for entries in results[:-1])
+        assert results[-1] is None
+        assert not any(page.is_parsed for page in pages)
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_submit_raises_extract_errors_on_result(self, workers: int):
+        with ScrapePool(workers=workers) as pool:
+            future = pool.submit(int, FetchResult(url='url', status=200, content=b'no number'))
+            with pytest.raises(ValueError):
+                future.result()
+
+    def test_workers_are_not_forked(self, pages: list):
+        with ScrapePool(workers=1) as pool:
+            pool.submit(ChefkochScraper.extract_recipe_overview, pages[0]).result()
+            assert pool._executor._mp_context.get_start_method() in ('forkserver', 'spawn')
+
+    def test_invalid_pool(self):
+        with pytest.raises(InvalidValueException):
+            ScrapePool(workers=-1)
@@ -5,10 +5,11 @@ from unittest.mock import patch
 import aiohttp
 import pytest
 from aiohttp import ClientTimeout, InvalidURL
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from more_itertools import one
 
 from infrastructure.fetch import AsyncFetcher, FetchResult
+from infrastructure.metrics import MetricsRegistry
 
 
 class TestAsyncFetcher:
@@ -20,7 +21,7 @@ class TestAsyncFetcher:
 
     @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
     def test_fetch(self, mock_fetch, fetcher):
-        async def fetch(_, url: str):
+        async def fetch(_, url: str, headers: dict = None):
             return FetchResult(url=url, status=200, html=BeautifulSoup())
 
         mock_fetch.side_effect = fetch
@@ -38,6 +39,100 @@ class TestAsyncFetcher:
             assert result.url == 'dummy_url'
             assert isinstance(result.html, BeautifulSoup)
 
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fetch_persistent_session(self, mock_fetch):
+        fetcher = AsyncFetcher(batch_size=10, persistent_session=True, limit_per_host=5)
+        used_sessions = set()
+
+        async def fetch(session, url: str, headers: dict = None):
+            used_sessions.add(session)
+            return FetchResult(url=url, status=200, html=BeautifulSoup())
+
+        mock_fetch.side_effect = fetch
+
+        with fetcher:
+            batches = list(fetcher.fetch(['dummy_url'] * 25))
+            session = one(used_sessions)
+            assert not session.closed
+            assert session.connector.limit_per_host == 5
+
+        assert [len(batch) for batch in batches] == [10, 10, 5]
+        assert session.closed
+        assert fetcher._session is None
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fetch_session_per_batch(self, mock_fetch, fetcher):
+        used_sessions = set()
+
+        async def fetch(session, url: str, headers: dict = None):
+            used_sessions.add(session)
+            return FetchResult(url=url, status=200, html=BeautifulSoup())
+
+        mock_fetch.side_effect = fetch
+
+        list(fetcher.fetch(['dummy_url'] * 25))
+
+        assert len(used_sessions) == 3
+        assert all(session.closed for session in used_sessions)
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fetch_streaming(self, mock_fetch):
+        fetcher = AsyncFetcher(batch_size=3, streaming=True)
+        in_flight, max_in_flight = 0, 0
+
+        async def fetch(_, url: str, headers: dict = None):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.2 if url == 'slow_url' else 0.01)
+            in_flight -= 1
+            return FetchResult(url=url, status=200, html=BeautifulSoup())
+
+        mock_fetch.side_effect = fetch
+
+        test_urls = ['slow_url'] + [f'fast_url_{i}' for i in range(9)]
+        batches = list(fetcher.fetch(test_urls))
+
+        assert all(len(batch) == 1 for batch in batches)
+        fetched_urls = [one(batch).url for batch in batches]
+        assert sorted(fetched_urls) == sorted(test_urls)
+        assert fetched_urls[-1] == 'slow_url'
+        assert max_in_flight == 3
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fetch_records_metrics(self, mock_fetch):
+        metrics = MetricsRegistry()
+        fetcher = AsyncFetcher(batch_size=2, metrics=metrics)
+
+        async def fetch(_, url: str, headers: dict = None):
+            if url.endswith('broken'):
+                raise aiohttp.ClientConnectionError()
+            return FetchResult(url=url, status=404 if url.endswith('missing') else 200, content=b'12345')
+
+        mock_fetch.side_effect = fetch
+        list(fetcher.fetch(['https://a.test/1', 'https://a.test/missing', 'https://b.test/broken']))
+
+        summary = metrics.summary()
+        assert summary['crawler_fetch_requests_total'] == {'host=a.test,status=200': 1, 'host=a.test,status=404': 1, 'host=b.test,status=error': 1}
+        assert summary['crawler_fetch_bytes_total'] == {'host=a.test': 10, 'host=b.test': 0}
+        assert summary['crawler_fetch_seconds']['host=a.test']['count'] == 2
+        assert summary['crawler_fetch_results_total'] == {'outcome=client_error,from_cache=False': 1, 'outcome=connection_error,from_cache=False': 1,
+                                                          'outcome=success,from_cache=False': 1}
+
+    def test_fetch_result_parses_lazily(self):
+        result = FetchResult(url='dummy_url', status=200, content=b'<html><body><article>recipe</article><nav>menu</nav></body></html>')
+
+        assert not result.is_parsed
+        assert result.html.article.string == 'recipe'
+        assert result.is_parsed
+        assert result.html is result.html
+
+        result.release()
+        assert not result.is_parsed
+
+        assert result.parse(parse_only=SoupStrainer('article')).find('nav') is None
+        assert not result.is_parsed
+
     @pytest.mark.asyncio
     async def test_fetch_success(self, fetcher):
         url = 'https://www.python.org/'
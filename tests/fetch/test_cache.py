@@ -0,0 +1,130 @@
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+from bs4 import BeautifulSoup
+from more_itertools import one
+from multidict import CIMultiDict
+
+from infrastructure.fetch import AsyncFetcher, FetchResult, PageCache
+
+
+class TestPageCache:
+    url = 'https://www.chefkoch.de/rezepte/2529011396359402/Bacon-Bomb.html'
+    content = b'<html><body><h1>Bacon Bomb</h1></body></html>'
+
+    @staticmethod
+    @pytest.fixture
+    def cache(tmp_path) -> PageCache:
+        return PageCache(directory=str(tmp_path))
+
+    def test_get_missing(self, cache: PageCache):
+        assert cache.get(self.url) is None
+
+    def test_store_and_get(self, cache: PageCache):
+        cache.store(url=self.url, content=self.content, headers={'ETag': '"abc"', 'Last-Modified': 'Sun, 18 Oct 2026 10:00:00 GMT'})
+        entry = cache.get(self.url)
+
+        assert entry.content == self.content
+        assert entry.conditional_headers() == {'If-None-Match': '"abc"', 'If-Modified-Since': 'Sun, 18 Oct 2026 10:00:00 GMT'}
+
+    def test_store_lower_case_validators(self, cache: PageCache):
+        cache.store(url=self.url, content=self.content, headers={'etag': '"abc"', 'last-modified': 'Sun, 18 Oct 2026 10:00:00 GMT'})
+        entry = cache.get(self.url)
+
+        assert entry.conditional_headers() == {'If-None-Match': '"abc"', 'If-Modified-Since': 'Sun, 18 Oct 2026 10:00:00 GMT'}
+
+    def test_identical_content_is_stored_once(self, cache: PageCache, tmp_path):
+        cache.store(url=self.url, content=self.content, headers={})
+        cache.store(url=f'{self.url}?page=2', content=self.content, headers={})
+
+        stored_objects = [file for _, _, files in os.walk(tmp_path / 'objects') for file in files]
+        assert len(stored_objects) == 1
+
+    def test_is_fresh(self, cache: PageCache):
+        entry = cache.store(url=self.url, content=self.content, headers={})
+        assert entry.is_fresh(max_age=60)
+        assert not entry.is_fresh(max_age=0)
+
+    def test_evict_oldest_entries_beyond_max_size(self, tmp_path):
+        cache = PageCache(directory=str(tmp_path), eviction_interval=3)
+        for page in range(3):
+            cache.store(url=f'{self.url}?page={page}', content=f'page {page}'.encode(), headers={})
+        object_size = max(os.path.getsize(os.path.join(directory, file)) for directory, _, files in os.walk(tmp_path / 'objects') for file in files)
+
+        cache.max_size_bytes = 2 * object_size
+        assert cache.evict() == 1
+        assert cache.get(f'{self.url}?page=0') is None
+        assert cache.get(f'{self.url}?page=2') is not None
+        stored_objects = [file for _, _, files in os.walk(tmp_path / 'objects') for file in files]
+        assert len(stored_objects) == 2
+
+    def test_evict_expired_entries_on_store(self, tmp_path):
+        cache = PageCache(directory=str(tmp_path), max_entry_age=60, eviction_interval=2)
+        cache.store(url=self.url, content=self.content, headers={})
+        with patch('infrastructure.fetch.cache.time.time', return_value=time.time() + 120):
+            cache.store(url=f'{self.url}?page=2', content=b'page 2', headers={})
+
+        assert cache.get(self.url) is None
+        assert cache.get(f'{self.url}?page=2') is not None
+        stored_objects = [file for _, _, files in os.walk(tmp_path / 'objects') for file in files]
+        assert len(stored_objects) == 1
+
+
+class TestCachedFetch:
+    url = 'https://www.chefkoch.de/rezepte/kategorien/'
+    content = b'<html><body>categories</body></html>'
+
+    @staticmethod
+    def fetch_one(fetcher: AsyncFetcher, url: str) -> FetchResult:
+        return one(one(fetcher.fetch([url])))
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_revalidate_not_modified(self, mock_fetch, tmp_path):
+        fetcher = AsyncFetcher(batch_size=10, cache=PageCache(directory=str(tmp_path)))
+        sent_headers = list()
+
+        async def fetch(_, url: str, headers: dict = None):
+            sent_headers.append(headers)
+            if headers is None:
+                return FetchResult(url=url, status=200, html=BeautifulSoup(self.content, 'lxml'), content=self.content, headers={'ETag': '"v1"'})
+            return FetchResult(url=url, status=304, content=b'', headers={'ETag': '"v1"'})
+
+        mock_fetch.side_effect = fetch
+
+        first = self.fetch_one(fetcher, self.url)
+        second = self.fetch_one(fetcher, self.url)
+
+        assert sent_headers == [None, {'If-None-Match': '"v1"'}]
+        assert not first.from_cache
+        assert second.from_cache and second.ok and second.status == 304
+        assert second.content == self.content
+        assert second.html.body.string == 'categories'
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_revalidate_with_lower_case_etag(self, mock_fetch, tmp_path):
+        fetcher = AsyncFetcher(batch_size=10, cache=PageCache(directory=str(tmp_path)))
+        sent_headers = list()
+
+        async def fetch(_, url: str, headers: dict = None):
+            sent_headers.append(headers)
+            return FetchResult(url=url, status=200, content=self.content, headers=CIMultiDict(etag='"v1"'))
+
+        mock_fetch.side_effect = fetch
+
+        self.fetch_one(fetcher, self.url)
+        self.fetch_one(fetcher, self.url)
+
+        assert sent_headers == [None, {'If-None-Match': '"v1"'}]
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fresh_entry_is_served_without_request(self, mock_fetch, tmp_path):
+        cache = PageCache(directory=str(tmp_path), max_age=60)
+        cache.store(url=self.url, content=self.content, headers={})
+        fetcher = AsyncFetcher(batch_size=10, cache=cache)
+
+        result = self.fetch_one(fetcher, self.url)
+
+        mock_fetch.assert_not_called()
+        assert result.from_cache and result.status == 200 and result.content == self.content
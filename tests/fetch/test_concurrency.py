@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+import pytest
+from bs4 import BeautifulSoup
+
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import AIMDConcurrencyController, AsyncFetcher, FetchResult
+from infrastructure.log import Logger
+
+
+class TestAIMDConcurrencyController:
+
+    @staticmethod
+    @pytest.fixture
+    def controller() -> AIMDConcurrencyController:
+        return AIMDConcurrencyController(create_logger=Logger.create, initial_window=4, min_window=2, max_window=6,
+                                         latency_threshold=1.0, error_rate_threshold=0.25)
+
+    @staticmethod
+    def record_window(controller: AIMDConcurrencyController, latency: float = 0.1, status: int = 200, failures: int = 0):
+        window = controller.window
+        for index in range(window):
+            controller.record(latency=latency, status=status if index >= failures else 503)
+
+    def test_additive_increase(self, controller: AIMDConcurrencyController):
+        self.record_window(controller)
+        assert controller.window == 5
+        self.record_window(controller)
+        assert controller.window == 6
+        self.record_window(controller)
+        assert controller.window == 6
+
+    def test_multiplicative_decrease_on_errors(self, controller: AIMDConcurrencyController):
+        self.record_window(controller, failures=2)
+        assert controller.window == 2
+        self.record_window(controller, failures=2)
+        assert controller.window == 2
+
+    def test_multiplicative_decrease_on_latency(self, controller: AIMDConcurrencyController):
+        self.record_window(controller, latency=1.5)
+        assert controller.window == 2
+
+    def test_no_decision_before_full_window(self, controller: AIMDConcurrencyController):
+        for _ in range(3):
+            controller.record(latency=5, status=None)
+        assert controller.window == 4
+
+    @pytest.mark.parametrize('status, expected', [(None, True), (429, True), (500, True), (503, True), (200, False), (404, False)])
+    def test_is_overload_signal(self, status, expected):
+        assert AIMDConcurrencyController.is_overload_signal(status) is expected
+
+    def test_invalid_controller(self):
+        with pytest.raises(InvalidValueException):
+            AIMDConcurrencyController(create_logger=Logger.create, initial_window=10, max_window=5)
+        with pytest.raises(InvalidValueException):
+            AIMDConcurrencyController(create_logger=Logger.create, initial_window=1, decrease_factor=1)
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fetcher_follows_window(self, mock_fetch, controller: AIMDConcurrencyController):
+        fetcher = AsyncFetcher(batch_size=4, concurrency_controller=controller)
+
+        async def fetch(_, url: str, headers: dict = None):
+            return FetchResult(url=url, status=200, html=BeautifulSoup())
+
+        mock_fetch.side_effect = fetch
+
+        batches = list(fetcher.fetch(['dummy_url'] * 15))
+
+        assert [len(batch) for batch in batches] == [4, 5, 6]
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from bs4 import BeautifulSoup
+
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import AsyncFetcher, FetchResult, HostRateLimiter, TokenBucket
+
+
+class TestTokenBucket:
+
+    @pytest.mark.asyncio
+    async def test_acquire_burst_without_waiting(self):
+        bucket = TokenBucket(rate=1, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        assert time.monotonic() - start < 0.1
+
+    @pytest.mark.asyncio
+    async def test_acquire_respects_rate(self):
+        bucket = TokenBucket(rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        assert time.monotonic() - start >= 0.19
+
+    def test_invalid_bucket(self):
+        with pytest.raises(InvalidValueException):
+            TokenBucket(rate=0, burst=1)
+        with pytest.raises(InvalidValueException):
+            TokenBucket(rate=1, burst=0)
+
+
+class TestHostRateLimiter:
+
+    @pytest.mark.asyncio
+    async def test_max_concurrent_per_host(self):
+        limiter = HostRateLimiter(max_concurrent_per_host=2)
+        in_flight, max_in_flight = dict(), dict()
+
+        async def request(url: str):
+            host = limiter.get_host(url)
+            async with limiter.limit(url):
+                in_flight[host] = in_flight.get(host, 0) + 1
+                max_in_flight[host] = max(max_in_flight.get(host, 0), in_flight[host])
+                await asyncio.sleep(0.01)
+                in_flight[host] -= 1
+
+        await asyncio.gather(*[request(f'https://www.{host}.de/{i}') for host in ('chefkoch', 'lecker') for i in range(10)])
+
+        assert max_in_flight == {'www.chefkoch.de': 2, 'www.lecker.de': 2}
+
+    @pytest.mark.asyncio
+    async def test_hosts_have_separate_budgets(self):
+        limiter = HostRateLimiter(requests_per_second=10, burst=1)
+
+        async def request(url: str):
+            async with limiter.limit(url):
+                pass
+
+        await request('https://www.chefkoch.de/a')
+        start = time.monotonic()
+        await request('https://www.lecker.de/a')
+        assert time.monotonic() - start < 0.05
+
+        start = time.monotonic()
+        await request('https://www.chefkoch.de/b')
+        assert time.monotonic() - start >= 0.05
+
+    def test_invalid_limiter(self):
+        with pytest.raises(InvalidValueException):
+            HostRateLimiter(requests_per_second=-1)
+        with pytest.raises(InvalidValueException):
+            HostRateLimiter(max_concurrent_per_host=-1)
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_fetcher_uses_rate_limiter(self, mock_fetch):
+        fetcher = AsyncFetcher(batch_size=10, streaming=True, rate_limiter=HostRateLimiter(max_concurrent_per_host=1))
+        in_flight, max_in_flight = 0, 0
+
+        async def fetch(_, url: str, headers: dict = None):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return FetchResult(url=url, status=200, html=BeautifulSoup())
+
+        mock_fetch.side_effect = fetch
+
+        results = list(fetcher.fetch([f'https://www.chefkoch.de/{i}' for i in range(5)]))
+
+        assert len(results) == 5
+        assert max_in_flight == 1
@@ -0,0 +1,106 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from aiohttp import ClientConnectionError
+from bs4 import BeautifulSoup
+
+from domain.exceptions import InvalidValueException
+from infrastructure.fetch import AsyncFetcher, FetchResult, FetchOutcome, RetryPolicy
+
+
+class TestRetryPolicy:
+
+    @pytest.mark.parametrize('outcome, expected', [
+        (FetchOutcome.SUCCESS, False),
+        (FetchOutcome.CLIENT_ERROR, False),
+        (FetchOutcome.ERROR, False),
+        (FetchOutcome.RATE_LIMITED, True),
+        (FetchOutcome.SERVER_ERROR, True),
+        (FetchOutcome.TIMEOUT, True),
+        (FetchOutcome.CONNECTION_ERROR, True),
+    ])
+    def test_should_retry_transient_outcomes(self, outcome, expected):
+        assert RetryPolicy().should_retry(outcome, attempt=1) is expected
+
+    def test_should_retry_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        assert policy.should_retry(FetchOutcome.TIMEOUT, attempt=2)
+        assert not policy.should_retry(FetchOutcome.TIMEOUT, attempt=3)
+
+    def test_retry_budget(self):
+        policy = RetryPolicy(max_attempts=5, retry_budget=2)
+        assert policy.should_retry(FetchOutcome.TIMEOUT, attempt=1)
+        assert policy.should_retry(FetchOutcome.TIMEOUT, attempt=1)
+        assert not policy.should_retry(FetchOutcome.TIMEOUT, attempt=1)
+        policy.reset_budget()
+        assert policy.remaining_budget == 2
+
+    def test_delay_is_bounded(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt in range(1, 10):
+            assert 0 <= policy.get_delay(attempt) <= min(5, 2 ** (attempt - 1))
+
+    def test_invalid_policy(self):
+        with pytest.raises(InvalidValueException):
+            RetryPolicy(max_attempts=0)
+        with pytest.raises(InvalidValueException):
+            RetryPolicy(base_delay=2, max_delay=1)
+
+
+class TestFetchRetries:
+
+    @staticmethod
+    @pytest.fixture
+    def fetcher() -> AsyncFetcher:
+        return AsyncFetcher(batch_size=10, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.01))
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_retry_transient_failures(self, mock_fetch, fetcher: AsyncFetcher):
+        calls = dict()
+
+        async def fetch(_, url: str, headers: dict = None):
+            calls[url] = calls.get(url, 0) + 1
+            if url == 'flaky_url' and calls[url] == 1:
+                return FetchResult(url=url, status=503, html=BeautifulSoup())
+            if url == 'timeout_url' and calls[url] < 3:
+                raise asyncio.TimeoutError()
+            if url == 'missing_url':
+                return FetchResult(url=url, status=404, html=BeautifulSoup())
+            return FetchResult(url=url, status=200, html=BeautifulSoup())
+
+        mock_fetch.side_effect = fetch
+
+        results = {result.url: result for batch in fetcher.fetch(['flaky_url', 'timeout_url', 'missing_url', 'url']) for result in batch}
+
+        assert results['flaky_url'].ok and results['flaky_url'].attempts == 2
+        assert results['timeout_url'].ok and results['timeout_url'].attempts == 3
+        assert results['missing_url'].outcome is FetchOutcome.CLIENT_ERROR and results['missing_url'].attempts == 1
+        assert results['url'].ok and results['url'].attempts == 1
+
+    @patch('infrastructure.fetch.async_fetcher.AsyncFetcher._fetch_url_async')
+    def test_failures_are_typed_results(self, mock_fetch):
+        fetcher = AsyncFetcher(batch_size=10, streaming=True)
+        exceptions = {
+            'timeout_url': asyncio.TimeoutError(),
+            'connection_url': ClientConnectionError('connection reset'),
+            'broken_url': ValueError('broken'),
+        }
+
+        async def fetch(_, url: str, headers: dict = None):
+            raise exceptions[url]
+
+        mock_fetch.side_effect = fetch
+
+        results = {result.url: result for batch in fetcher.fetch(list(exceptions)) for result in batch}
+
+        assert all(isinstance(result, FetchResult) and not result.ok and result.status is None for result in results.values())
+        assert results['timeout_url'].outcome is FetchOutcome.TIMEOUT
+        assert results['connection_url'].outcome is FetchOutcome.CONNECTION_ERROR
+        assert results['connection_url'].error == 'ClientConnectionError: connection reset'
+        assert results['broken_url'].outcome is FetchOutcome.ERROR
+
+    @pytest.mark.parametrize('status, outcome', [(200, FetchOutcome.SUCCESS), (301, FetchOutcome.SUCCESS), (404, FetchOutcome.CLIENT_ERROR),
+                                                 (429, FetchOutcome.RATE_LIMITED), (502, FetchOutcome.SERVER_ERROR)])
+    def test_fetch_result_outcome_from_status(self, status, outcome):
+        assert FetchResult(url='url', status=status).outcome is outcome
@@ -1,6 +1,12 @@
+from itertools import islice
+from typing import Dict, List, Tuple, Optional
+
 import pytest
 
-from infrastructure.fetch.url_queue import URLQueue
+from domain.exceptions import InvalidValueException
+from domain.repositories.frontier import AbstractFrontierRepository, FrontierState
+from infrastructure.fetch.url_queue import URLQueue, PersistentURLQueue, create_persistent_url_queue, SharedURLQueue, create_shared_url_queue
+from infrastructure.log import Logger
 
 
 class TestUrlQueue:
@@ -72,3 +78,195 @@ class TestUrlQueue:
         for url in url_queue:
             assert url in self.test_urls
         assert url_queue.is_empty()
+
+    def test_url_queue_deduplicates(self, url_queue: URLQueue):
+        url_queue.add(self.test_urls + self.test_urls)
+        assert url_queue.urls == self.test_urls
+        assert list(url_queue) == self.test_urls
+
+        url_queue.add(self.test_urls[0])
+        assert url_queue.is_empty()
+        assert self.test_urls[0] in url_queue
+
+    def test_url_queue_without_deduplication(self):
+        url_queue = URLQueue(self.test_urls + self.test_urls, deduplicate=False)
+        assert len(url_queue) == 2 * len(self.test_urls)
+        assert list(url_queue) == self.test_urls + self.test_urls
+
+    def test_url_queue_priorities(self, url_queue: URLQueue):
+        url_queue.add('recipe_1')
+        url_queue.add('category_1', priority=1)
+        url_queue.add('recipe_2')
+        url_queue.add('category_2', priority=1)
+        url_queue.add('low', priority=-1)
+
+        assert url_queue.urls == ['category_1', 'category_2', 'recipe_1', 'recipe_2', 'low']
+        assert next(url_queue) == 'category_1'
+        url_queue.add('category_3', priority=1)
+        assert list(url_queue) == ['category_2', 'category_3', 'recipe_1', 'recipe_2', 'low']
+        assert len(url_queue) == 0
+
+    def test_url_queue_add_while_iterating(self, url_queue: URLQueue):
+        url_queue.add(self.test_urls[0])
+        processed = list()
+        for url in url_queue:
+            processed.append(url)
+            url_queue.add(self.test_urls)
+        assert processed == self.test_urls
+
+
+class InMemoryFrontierRepository(AbstractFrontierRepository):
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = dict()
+
+    def add_urls(self, crawl: str, urls: List[str], priority: int = 0, context: Optional[str] = None):
+        for url in urls:
+            self.rows.setdefault(url, dict(priority=priority, state=FrontierState.PENDING, attempts=0, last_error=None, context=context))
+
+    def claim_urls(self, crawl: str, worker: str, limit: int, lease_timeout: float) -> List[Tuple[str, Optional[str]]]:
+        claimed = [url for url, _ in self.get_pending_urls(crawl)][:limit]
+        for url in claimed:
+            self.rows[url]['state'] = FrontierState.IN_PROGRESS
+        return [(url, self.rows[url]['context']) for url in claimed]
+
+    def get_pending_urls(self, crawl: str) -> List[Tuple[str, int]]:
+        pending = [(url, row['priority']) for url, row in self.rows.items() if row['state'] == FrontierState.PENDING]
+        return sorted(pending, key=lambda item: -item[1])
+
+    def get_finished_urls(self, crawl: str) -> List[str]:
+        return [url for url, row in self.rows.items() if row['state'] in (FrontierState.DONE, FrontierState.FAILED)]
+
+    def save_checkpoint(self, crawl: str, done_urls: List[str], failed_urls: Dict[str, str], max_attempts: int):
+        for url in done_urls:
+            self.rows[url]['state'] = FrontierState.DONE
+        for url, error in failed_urls.items():
+            row = self.rows[url]
+            row['attempts'] += 1
+            row['last_error'] = error
+            row['state'] = FrontierState.FAILED if row['attempts'] >= max_attempts else FrontierState.PENDING
+
+    def get_progress(self, crawl: str) -> Dict[FrontierState, int]:
+        return {state: sum(row['state'] == state for row in self.rows.values()) for state in FrontierState}
+
+    def delete_urls(self, crawl: str, state: FrontierState = None):
+        self.rows = {url: row for url, row in self.rows.items() if state is not None and row['state'] != state}
+
+
+class TestPersistentUrlQueue:
+    test_urls = [f'https://www.chefkoch.de/rezepte/{i}/' for i in range(10)]
+
+    @staticmethod
+    @pytest.fixture
+    def repository() -> InMemoryFrontierRepository:
+        return InMemoryFrontierRepository()
+
+    @staticmethod
+    def create_queue(repository: AbstractFrontierRepository, checkpoint_interval: int = 3, max_attempts: int = 2) -> PersistentURLQueue:
+        return create_persistent_url_queue(repository, crawl='test', create_logger=Logger.create, checkpoint_interval=checkpoint_interval,
+                                           max_attempts=max_attempts)
+
+    def test_added_urls_are_stored(self, repository: InMemoryFrontierRepository):
+        queue = self.create_queue(repository)
+        queue.add(self.test_urls)
+        queue.add(self.test_urls[0])
+
+        assert list(repository.rows) == self.test_urls
+        assert queue.progress[FrontierState.PENDING] == len(self.test_urls)
+
+    def test_resume_interrupted_crawl(self, repository: InMemoryFrontierRepository):
+        queue = self.create_queue(repository)
+        queue.add(self.test_urls)
+        for url in islice(queue, 4):
+            queue.mark_done(url)
+
+        resumed_queue = self.create_queue(repository)
+        assert resumed_queue.urls == self.test_urls[3:]
+        assert self.test_urls[0] in resumed_queue
+        resumed_queue.add(self.test_urls)
+        assert len(resumed_queue) == len(self.test_urls) - 3
+
+    def test_checkpoint(self, repository: InMemoryFrontierRepository):
+        queue = self.create_queue(repository, checkpoint_interval=100)
+        queue.add(self.test_urls)
+        queue.mark_done(next(queue))
+        assert queue.progress[FrontierState.DONE] == 0
+
+        queue.checkpoint()
+        assert queue.progress[FrontierState.DONE] == 1
+
+    def test_failed_urls_are_retried_until_max_attempts(self, repository: InMemoryFrontierRepository):
+        for attempt in range(2):
+            queue = self.create_queue(repository)
+            queue.add(self.test_urls[0])
+            queue.mark_failed(next(queue), error='timeout')
+            queue.complete()
+
+        assert repository.rows[self.test_urls[0]] == dict(priority=0, state=FrontierState.FAILED, attempts=2, last_error='timeout', context=None)
+        assert self.create_queue(repository).is_empty()
+
+    def test_complete_deletes_done_urls(self, repository: InMemoryFrontierRepository):
+        queue = self.create_queue(repository)
+        queue.add(self.test_urls)
+        for url in queue:
+            queue.mark_done(url)
+        queue.complete()
+
+        assert repository.rows == dict()
+
+    def test_invalid_repository(self):
+        with pytest.raises(InvalidValueException):
+            create_persistent_url_queue(dict(), crawl='test', create_logger=Logger.create)
+
+
+class TestSharedUrlQueue:
+    test_urls = [f'https://www.chefkoch.de/rezepte/{i}/' for i in range(10)]
+
+    @staticmethod
+    @pytest.fixture
+    def repository() -> InMemoryFrontierRepository:
+        return InMemoryFrontierRepository()
+
+    @staticmethod
+    def create_queue(repository: AbstractFrontierRepository, worker: str) -> SharedURLQueue:
+        return create_shared_url_queue(repository, crawl='test', worker=worker, create_logger=Logger.create, claim_batch_size=3,
+                                       checkpoint_interval=1, max_attempts=2)
+
+    def test_added_urls_are_only_stored(self, repository: InMemoryFrontierRepository):
+        queue = self.create_queue(repository, worker='worker-1')
+        queue.add(self.test_urls, context='category')
+
+        assert len(queue) == 0
+        assert list(repository.rows) == self.test_urls
+
+    def test_workers_claim_disjoint_batches(self, repository: InMemoryFrontierRepository):
+        producer = self.create_queue(repository, worker='producer')
+        producer.add(self.test_urls[:5], context='category 1')
+        producer.add(self.test_urls[5:], context='category 2')
+        first_worker, second_worker = self.create_queue(repository, worker='worker-1'), self.create_queue(repository, worker='worker-2')
+
+        processed = {first_worker.worker: list(), second_worker.worker: list()}
+        while not first_worker.is_empty() or not second_worker.is_empty():
+            for queue in (first_worker, second_worker):
+                if not queue.is_empty():
+                    url = next(queue)
+                    processed[queue.worker].append((url, queue.get_context(url)))
+                    queue.mark_done(url)
+
+        assert sorted(processed['worker-1'] + processed['worker-2']) == sorted(
+            [(url, 'category 1') for url in self.test_urls[:5]] + [(url, 'category 2') for url in self.test_urls[5:]]
+        )
+        assert processed['worker-1'] and processed['worker-2']
+        assert repository.get_progress('test')[FrontierState.DONE] == len(self.test_urls)
+
+    def test_failed_url_is_claimed_again(self, repository: InMemoryFrontierRepository):
+        queue = self.create_queue(repository, worker='worker-1')
+        queue.add(self.test_urls[0])
+
+        processed = list()
+        for url in queue:
+            processed.append(url)
+            queue.mark_failed(url, error='timeout')
+
+        assert processed == [self.test_urls[0]] * 2
+        assert repository.rows[self.test_urls[0]]['state'] == FrontierState.FAILED
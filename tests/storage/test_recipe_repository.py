@@ -0,0 +1,152 @@
+import re
+from types import SimpleNamespace
+from typing import List
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+from pytest import fixture
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.dml import Insert
+
+from domain.model.category_aggregate import create_category
+from domain.model.recipe_aggregate import Recipe, create_recipe
+from domain.repositories.recipe import RecipeWriteCounts
+from infrastructure.log import Logger
+from infrastructure.storage.sql.model import DBRecipe
+from infrastructure.storage.sql.postgres import PostgresDatabase
+from infrastructure.storage.sql.repositories.recipe import RecipeRepository
+
+
+def copy_recipe(recipe: Recipe, **changes) -> Recipe:
+    """Returns a newly crawled version of the recipe, with a new id."""
+    values = dict(
+        recipe_id=uuid4(), name=recipe.name, description=recipe.description, author=recipe.author.name, prep_time=recipe.prep_time,
+        cook_time=recipe.cook_time, total_time=recipe.total_time, date_published=recipe.date_published, url=recipe.url.__str__(),
+        category=recipe.category, vendor=recipe.vendor, language=recipe.language, rating_count=recipe.aggregate_rating.rating_count,
+        rating_value=recipe.aggregate_rating.rating_value, image_url=recipe.image.__str__(), ingredients=list(recipe.ingredients),
+    )
+    values.update(changes)
+    return create_recipe(**values)
+
+
+class FakeQuery:
+
+    def __init__(self, session):
+        self._session = session
+        self._ids = None
+
+    def filter(self, *criteria):
+        """Only the id filter of the query of the stored recipes is applied, the other queries return every stored recipe."""
+        for criterion in criteria:
+            if getattr(criterion.left, 'name', None) == 'id':
+                self._ids = set(criterion.right.value)
+        return self
+
+    def options(self, *options):
+        return self
+
+    def __iter__(self):
+        return iter([SimpleNamespace(id=stored_recipe.id, fk_vendor=stored_recipe.fk_vendor, url=stored_recipe.url,
+                                     content_hash=stored_recipe.content_hash) for stored_recipe in self._session.stored_recipes])
+
+    def all(self):
+        return [stored_recipe for stored_recipe in self._session.stored_recipes if self._ids is None or stored_recipe.id in self._ids]
+
+
+class FakeSession:
+    """Session of the stored recipes that compiles every executed statement for Postgres, like the real session would."""
+
+    def __init__(self, stored_recipes: List[DBRecipe] = ()):
+        self.stored_recipes = list(stored_recipes)
+        self.statements = list()
+
+    def query(self, *entities) -> FakeQuery:
+        return FakeQuery(self)
+
+    def execute(self, statement, parameters=None):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params, parameters))
+        if isinstance(statement, Insert) and statement.table.name == DBRecipe.__tablename__:
+            return [SimpleNamespace(id=value) for key, value in compiled.params.items() if re.fullmatch(r'id_m\d+', key)]
+        return []
+
+
+class TestRecipeRepository:
+
+    @staticmethod
+    @fixture
+    def session() -> FakeSession:
+        return FakeSession()
+
+    @staticmethod
+    @fixture
+    def database(session: FakeSession) -> PostgresDatabase:
+        database = MagicMock(spec=PostgresDatabase)
+        database.transaction.return_value.__enter__.return_value = session
+        return database
+
+    @staticmethod
+    @fixture
+    def repository(database: PostgresDatabase) -> RecipeRepository:
+        return RecipeRepository(database=database, create_logger=Logger.create)
+
+    def test_unique_vendor_url_index(self):
+        index = next(index for index in DBRecipe.__table__.indexes if index.name == 'uq_recipe_vendor_url')
+        assert index.unique
+        assert [column.name for column in index.columns] == ['fk_vendor', 'url']
+
+    def test_insert_statement(self, recipe: Recipe):
+        statement = RecipeRepository._get_insert_statement([DBRecipe.values_from_entity(recipe)])
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+
+        assert sql.startswith('INSERT INTO recipe (')
+        assert sql.endswith('ON CONFLICT (fk_vendor, url) DO NOTHING RETURNING recipe.id')
+
+    def test_add_many_in_chunks(self, repository: RecipeRepository, database: PostgresDatabase, session: FakeSession, recipe: Recipe):
+        recipes = [copy_recipe(recipe, url=f'{recipe.url}?page={page}') for page in range(3)]
+
+        assert repository.add_many(recipes + [copy_recipe(recipes[0])], chunk_size=2) == RecipeWriteCounts(inserted=3)
+        assert database.transaction.call_count == 2
+        recipe_inserts = [params for sql, params, _ in session.statements if sql.startswith('INSERT INTO recipe ')]
+        assert [len([key for key in params if key.startswith('id_m')]) for params in recipe_inserts] == [2, 1]
+        ingredient_inserts = [rows for sql, _, rows in session.statements if sql.startswith('INSERT INTO ingredient ')]
+        assert sum(len(rows) for rows in ingredient_inserts) == 3 * len(recipe.ingredients)
+
+    def test_add_many_skips_recipes_inserted_concurrently(self, repository: RecipeRepository, session: FakeSession, recipe: Recipe):
+        session.execute = MagicMock(return_value=[])  # ON CONFLICT DO NOTHING returns no ids
+
+        assert repository.add_many([recipe]) == RecipeWriteCounts(unchanged=1)
+        session.execute.assert_called_once()
+
+    def test_add_many_writes_only_new_and_changed_recipes(self, repository: RecipeRepository, session: FakeSession, recipe: Recipe):
+        unchanged_recipe = copy_recipe(recipe, url=f'{recipe.url}?unchanged')
+        changed_recipe = copy_recipe(recipe, url=f'{recipe.url}?changed')
+        session.stored_recipes = [DBRecipe.from_entity(unchanged_recipe), DBRecipe.from_entity(changed_recipe)]
+        new_recipe = copy_recipe(recipe, url=f'{recipe.url}?new')
+
+        counts = repository.add_many([copy_recipe(unchanged_recipe), copy_recipe(changed_recipe, name='Bacon Bomb XXL'), new_recipe])
+
+        assert counts == RecipeWriteCounts(inserted=1, updated=1, unchanged=1)
+        recipe_inserts = [params for sql, params, _ in session.statements if sql.startswith('INSERT INTO recipe ')]
+        assert [params['url_m0'] for params in recipe_inserts] == [new_recipe.url.__str__()]
+        updates = [(sql, params) for sql, params, _ in session.statements if sql.startswith('UPDATE recipe ')]
+        assert len(updates) == 1
+        assert updates[0][0].startswith('UPDATE recipe SET name=%(name)s, content_hash=%(content_hash)s WHERE recipe.id = ')
+        assert updates[0][1]['id_1'] == changed_recipe.id
+        assert not any(sql.startswith('DELETE FROM ingredient') for sql, _, _ in session.statements)
+
+    def test_add_many_ignores_other_category(self, repository: RecipeRepository, session: FakeSession, recipe: Recipe, vendor):
+        session.stored_recipes = [DBRecipe.from_entity(recipe)]
+        other_category = create_category(category_id=uuid4(), name='Other', url='https://www.chefkoch.de/rs/s0g1/Other.html', vendor=vendor)
+
+        assert repository.add_many([copy_recipe(recipe, category=other_category)]) == RecipeWriteCounts(unchanged=1)
+        assert session.statements == []
+
+    def test_add_many_replaces_changed_ingredients(self, repository: RecipeRepository, session: FakeSession, recipe: Recipe):
+        session.stored_recipes = [DBRecipe.from_entity(recipe)]
+        ingredients = list(recipe.ingredients)[1:]
+
+        assert repository.add_many([copy_recipe(recipe, ingredients=ingredients)]) == RecipeWriteCounts(updated=1)
+        statements = [sql.split(' WHERE')[0] for sql, _, _ in session.statements]
+        assert statements == ['UPDATE recipe SET content_hash=%(content_hash)s', 'DELETE FROM ingredient', 'INSERT INTO ingredient (id, text, fk_recipe) VALUES (%(id)s, %(text)s, %(fk_recipe)s)']
+        assert len(session.statements[2][2]) == len(ingredients)
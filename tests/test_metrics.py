@@ -0,0 +1,89 @@
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from domain.exceptions import InvalidValueException
+from infrastructure.metrics import MetricsRegistry, MetricsServer
+
+
+class TestMetricsRegistry:
+
+    @staticmethod
+    @pytest.fixture
+    def registry() -> MetricsRegistry:
+        return MetricsRegistry()
+
+    def test_counter(self, registry):
+        counter = registry.counter('pages_total', 'Crawled pages', ('vendor', 'result'))
+        counter.inc(vendor='Chefkoch', result='ok')
+        counter.inc(2, vendor='Chefkoch', result='ok')
+        counter.inc(vendor='Chefkoch', result='failed')
+
+        assert counter.get(vendor='Chefkoch', result='ok') == 3
+        assert registry.counter('pages_total', 'Crawled pages', ('vendor', 'result')) is counter
+        assert registry.summary() == {'pages_total': {'vendor=Chefkoch,result=failed': 1, 'vendor=Chefkoch,result=ok': 3}}
+        assert registry.render() == (
+            '# HELP pages_total Crawled pages\n'
+            '# TYPE pages_total counter\n'
+            'pages_total{vendor="Chefkoch",result="failed"} 1\n'
+            'pages_total{vendor="Chefkoch",result="ok"} 3\n'
+        )
+
+    def test_counter_invalid_values(self, registry):
+        counter = registry.counter('pages_total', 'Crawled pages', ('vendor',))
+        with pytest.raises(InvalidValueException):
+            counter.inc(-1, vendor='Chefkoch')
+        with pytest.raises(InvalidValueException):
+            counter.inc(host='www.chefkoch.de')
+
+    def test_gauge(self, registry):
+        gauge = registry.gauge('queue_depth', 'Queued pages', ('queue',))
+        for value in [3, 7, 2]:
+            gauge.set(value, queue='fetched')
+
+        assert gauge.get(queue='fetched') == 2
+        assert registry.summary() == {'queue_depth': {'queue=fetched': {'last': 2, 'max': 7}}}
+
+    def test_histogram(self, registry):
+        histogram = registry.histogram('fetch_seconds', 'Fetch latency', buckets=(0.1, 1.0))
+        for value in [0.05, 0.5, 0.5, 3.0]:
+            histogram.observe(value)
+
+        assert histogram.get_count() == 4
+        assert registry.summary() == {'fetch_seconds': {'total': {'count': 4, 'sum': 4.05, 'mean': 1.0125, 'max': 3.0, 'p50': 1.0, 'p95': 3.0}}}
+        assert registry.render().splitlines()[2:] == [
+            'fetch_seconds_bucket{le="0.1"} 1',
+            'fetch_seconds_bucket{le="1"} 3',
+            'fetch_seconds_bucket{le="+Inf"} 4',
+            'fetch_seconds_sum 4.05',
+            'fetch_seconds_count 4',
+        ]
+
+    def test_summary_skips_unused_metrics(self, registry):
+        registry.counter('pages_total', 'Crawled pages')
+        assert registry.summary() == dict()
+
+    def test_metric_mismatch(self, registry):
+        registry.counter('pages_total', 'Crawled pages', ('vendor',))
+        with pytest.raises(InvalidValueException):
+            registry.gauge('pages_total', 'Crawled pages', ('vendor',))
+        with pytest.raises(InvalidValueException):
+            registry.counter('pages_total', 'Crawled pages', ('host',))
+
+
+class TestMetricsServer:
+
+    def test_serve_metrics(self):
+        registry = MetricsRegistry()
+        registry.counter('pages_total', 'Crawled pages').inc()
+
+        with MetricsServer(registry, port=0, host='127.0.0.1') as server:
+            with urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                assert response.status == 200
+                assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                assert response.read().decode() == registry.render()
+
+            with pytest.raises(HTTPError) as error:
+                urlopen(f'http://127.0.0.1:{server.port}/')
+            assert error.value.code == 404